@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the aggregators filter on the candidate URLs of a company.
+
+    python -m benchmarks.bench_aggregators [-n NUMBER]
+
+The previous filter scanned the list of domains for every URL and normalized the company
+name again for each of them, the current one looks up the suffixes of the host in a set
+and normalizes the company once.
+"""
+
+from tools.aggregators import DomainIndex, get_aggregators, set_aggregators
+from tools.format import remove_aggregators_url, is_valid_vat, format_vat, get_company_filter
+from urllib.parse import urlparse
+import argparse, re, timeit
+
+URLS = [
+    "https://www.brico-planit.be/",
+    "https://be.kompass.com/c/brico-plan-it/be0423369762/",
+    "https://www.companyweb.be/fr/0423369762/brico-plan-it",
+    "https://fr.trustpilot.com/review/brico-planit.be",
+    "https://www.facebook.com/BricoPlanIt/",
+    "https://www.planit-deco.be/",
+    "https://www.pagesdor.be/brico-plan-it/",
+    "https://www.linkedin.com/company/brico-plan-it",
+]
+
+
+def previous_is_aggregator(url: str, vat_number: str, company_name: str, domains: list) -> bool:
+    parsed_url = urlparse(url)
+    domain = parsed_url.netloc.replace("www.", "").casefold()
+    path = parsed_url.path
+    if domain in domains:
+        return True
+    if is_valid_vat(vat_number) and (vat_number in path or format_vat(vat_number) in path):
+        return True
+    normalized_company_name = re.sub(r"[^a-zA-Z0-9]", "", company_name.casefold())
+    return normalized_company_name in re.sub(r"[^a-zA-Z0-9]", "", path.casefold())
+
+
+def measure(func, number: int) -> float:
+    """Return the best mean time of a call, in microseconds."""
+    times = timeit.repeat(func, number=number, repeat=3)
+    return min(times) / number * 1e6
+
+
+def main(number: int):
+    bundled = sorted(get_aggregators().domains)
+    large = bundled + [f"annuaire-{i}.be" for i in range(50000)]
+    for label, domains in ((f"{len(bundled)} domains", bundled), (f"{len(large)} domains", large)):
+        index = DomainIndex(domains)
+
+        def previous():
+            return [url for url in URLS if not previous_is_aggregator(url, "0423369762", "Brico Plan-It", domains)]
+
+        def current():
+            get_company_filter.cache_clear()  # One new company per call
+            return remove_aggregators_url(URLS, "0423369762", "Brico Plan-It")
+
+        set_aggregators(index)
+        before, after = measure(previous, number), measure(current, number)
+        print(f"{label:<16} {len(URLS)} URLs  {before:9.1f} us -> {after:6.1f} us  (x{before / after:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=200)
+    main(parser.parse_args().number)
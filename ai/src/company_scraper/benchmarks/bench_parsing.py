@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of the HTML parsing path on the test fixtures.
+
+    python -m benchmarks.bench_parsing [-n NUMBER]
+
+The previous path parsed each page with `html.parser` several times (KBO cleanup or
+meta extraction, then `MarkdownifyTransformer`), the current one parses it once with
+lxml and shares the tree between the steps.
+"""
+
+from langchain_community.document_transformers import MarkdownifyTransformer
+from tools.document import Document
+from bs4 import BeautifulSoup
+from tools.format import *
+import argparse, os, timeit
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+KBO_URL = "https://kbopub.economie.fgov.be/kbopub/toonondernemingps.html?ondernemingsnummer=0423369762"
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+def previous_kbo(html: str) -> str:
+    """KBO cleanup then Markdown conversion, each step parsing the HTML with html.parser."""
+    soup = BeautifulSoup(html, "html.parser")
+    documents = kbo_format([Document(html, metadata={"source": KBO_URL})], soup)
+    return MarkdownifyTransformer().transform_documents(documents)[0].page_content
+
+
+def current_kbo(html: str) -> str:
+    """Direct parse of the KBO table, then cleanup and conversion of the same tree."""
+    soup = parse_html(html)
+    parse_kbo(None, soup)
+    documents = kbo_format([Document(html, metadata={"source": KBO_URL})], soup)
+    return convert_html_to_markdown(documents)[0].page_content
+
+
+def previous_website(html: str) -> tuple:
+    """Markdown conversion and meta extraction, each one parsing the HTML."""
+    documents = [Document(html)]
+    markdown = MarkdownifyTransformer().transform_documents(documents)[0].page_content
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.title, soup.find("meta", attrs={"property": "og:title"}), markdown
+
+
+def current_website(html: str) -> tuple:
+    """One lxml parse shared by the meta extraction and the Markdown conversion."""
+    soup = parse_html(html)
+    return soup.title, soup.find("meta", attrs={"property": "og:title"}), soup_to_markdown(soup)
+
+
+def measure(func, html: str, number: int) -> float:
+    """Return the best mean time of a call, in milliseconds."""
+    times = timeit.repeat(lambda: func(html), number=number, repeat=3)
+    return min(times) / number * 1000
+
+
+def main(number: int):
+    cases = [
+        ("kbo_0423369762.html", previous_kbo, current_kbo),
+        ("website_brico_planit.html", previous_website, current_website),
+    ]
+    print(f"Parser: {HTML_PARSER}")
+    for name, previous, current in cases:
+        html = read_fixture(name)
+        before, after = measure(previous, html, number), measure(current, html, number)
+        print(f"{name:<28} {before:8.2f} ms -> {after:8.2f} ms  (x{before / after:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=20)
+    main(parser.parse_args().number)
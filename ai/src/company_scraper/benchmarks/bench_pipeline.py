@@ -0,0 +1,214 @@
+"""
+Offline benchmark of the enrichment pipeline, on recorded responses and a fake LLM.
+
+    python -m benchmarks.bench_pipeline [-n NUMBER] [-c 1 4 16] [--latency S] [--llm-latency S]
+                                        [--save FILE] [--compare FILE] [--threshold RATIO]
+
+No request leaves the machine (see `benchmarks.offline`). The parsing steps are measured
+call by call, then `run()` and `arun()` enrich NUMBER distinct companies at each concurrency
+level, every response and LLM answer being delayed by the simulated latencies. Nothing is
+cached between the runs, so they are all cold runs.
+
+The results are saved as JSON with --save. With --compare, they are compared with a previous
+result file and the command fails when the median latency or the throughput regressed beyond
+the threshold.
+"""
+
+from benchmarks.offline import *
+from runnable.company_scraper import run, arun
+from runnable.company_description import extract_page_data
+from tools.format import kbo_format, convert_html_to_markdown, parse_html
+from tools.utils import get_financial_data
+from tools.document import Document
+from concurrent.futures import ThreadPoolExecutor
+import argparse, datetime, json, math, platform, sys
+
+KBO_URL = f"https://kbopub.economie.fgov.be/kbopub/toonondernemingps.html?ondernemingsnummer={RECORDED_VAT}"
+
+# Metrics compared with --compare, and whether a higher value is better
+COMPARED = {"p50_ms": False, "p95_ms": False, "throughput": True}
+# The p95 of short series is noisy, its changes are reported without failing the comparison
+GATED = ("p50_ms", "throughput")
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of the values, `p` between 0 and 100."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(latencies: list, wall: float, errors: int = 0) -> dict:
+    """Throughput (calls by second) and latency distribution (milliseconds) of a series of calls."""
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / wall, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+    }
+
+
+def measure(func, number: int) -> dict:
+    """Call `func` NUMBER times, one after the other."""
+    func()  # Warm up (imports, lazy tables)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(number):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_steps(number: int) -> dict:
+    """Measure the parsing steps, the responses being served without latency."""
+    kbo = read_fixture("kbo_0423369762.html")
+    website = read_fixture("website_brico_planit.html")
+    website_url = f"https://{RECORDED_HOST}/"
+
+    with offline(Recordings()):
+        return {
+            "kbo_format": measure(
+                lambda: kbo_format([Document(kbo, metadata={"source": KBO_URL})], parse_html(kbo)), number
+            ),
+            "convert_html_to_markdown": measure(
+                lambda: convert_html_to_markdown([Document(website, metadata={"source": website_url})]), number
+            ),
+            "extract_page_data": measure(lambda: extract_page_data(website_url, RECORDED_NAME), number),
+            "get_financial_data": measure(lambda: get_financial_data(RECORDED_VAT), number),
+        }
+
+
+def bench_run(companies: list, concurrency: int) -> dict:
+    """Enrich the companies with `run()` from a pool of `concurrency` threads."""
+
+    def enrich(company: Company) -> tuple:
+        start = time.perf_counter()
+        company_schema = run({"vat_number": company.vat_number})
+        return time.perf_counter() - start, company_schema is None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(enrich, companies))
+    wall = time.perf_counter() - start
+    return summarize([latency for latency, _ in results], wall, sum(failed for _, failed in results))
+
+
+def bench_arun(companies: list, concurrency: int) -> dict:
+    """Enrich the companies with `arun()`, at most `concurrency` at a time."""
+
+    async def enrich(company: Company, semaphore: asyncio.Semaphore) -> tuple:
+        async with semaphore:
+            start = time.perf_counter()
+            company_schema = await arun({"vat_number": company.vat_number})
+            return time.perf_counter() - start, company_schema is None
+
+    async def main() -> tuple:
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(enrich(company, semaphore) for company in companies))
+        return results, time.perf_counter() - start
+
+    results, wall = asyncio.run(main())
+    return summarize([latency for latency, _ in results], wall, sum(failed for _, failed in results))
+
+
+def bench_pipeline(number: int, levels: list, latency: float, llm_latency: float) -> dict:
+    """Measure `run()` and `arun()` at each concurrency level, on the same NUMBER companies."""
+    results = {"run": {}, "arun": {}}
+    for name, bench in (("run", bench_run), ("arun", bench_arun)):
+        for concurrency in levels:
+            recordings = Recordings(number, latency)
+            with offline(recordings, FakeLLM(llm_latency)):
+                results[name][str(concurrency)] = bench(recordings.companies, concurrency)
+    return results
+
+
+def flatten(results: dict) -> dict:
+    """{"steps/kbo_format": {...}, "run/4": {...}, ...}"""
+    flat = {f"steps/{name}": value for name, value in results["steps"].items()}
+    for mode, levels in results["pipeline"].items():
+        flat.update({f"{mode}/{concurrency}": value for concurrency, value in levels.items()})
+    return flat
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Print the changes since the baseline.
+
+    :return: The regressions beyond the threshold (relative change, e.g. 0.1 for 10%).
+    """
+    regressions = []
+    current, previous = flatten(results), flatten(baseline)
+    print(f"\nComparison with {baseline['meta']['date']} (threshold {threshold:.0%})")
+    for name, values in current.items():
+        if name not in previous:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED.items():
+            before, after = previous[name][metric], values[metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            regressed = metric in GATED and (-change if higher_is_better else change) > threshold
+            changes.append(f"{metric} {change:+.1%}{' !' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{name} {metric}")
+        print(f"  {name:<32} " + "  ".join(changes))
+    return regressions
+
+
+def print_results(results: dict):
+    print(f"{'step':<32} {'mean':>10} {'p50':>10} {'p95':>10}")
+    for name, value in results["steps"].items():
+        print(f"{name:<32} {value['mean_ms']:8.3f}ms {value['p50_ms']:8.3f}ms {value['p95_ms']:8.3f}ms")
+    print(f"\n{'pipeline':<32} {'runs/s':>10} {'p50':>10} {'p95':>10} {'errors':>7}")
+    for mode, levels in results["pipeline"].items():
+        for concurrency, value in levels.items():
+            label = f"{mode}() concurrency {concurrency}"
+            print(
+                f"{label:<32} {value['throughput']:10.2f} {value['p50_ms']:8.1f}ms"
+                f" {value['p95_ms']:8.1f}ms {value['errors']:7}"
+            )
+
+
+def main(args) -> int:
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "number": args.number,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "llm_latency": args.llm_latency,
+        },
+        "steps": bench_steps(args.steps_number),
+        "pipeline": bench_pipeline(args.number, args.concurrency, args.latency, args.llm_latency),
+    }
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=32, help="Companies enriched at each level")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--steps-number", type=int, default=50, help="Calls of each parsing step")
+    parser.add_argument("--latency", type=float, default=0.05, help="Delay of every HTTP response (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Delay of every LLM answer (s)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with a previous JSON result file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated relative regression")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the annual account CSV parsing on the CBSO fixtures.
+
+    python -m benchmarks.bench_rubrics [-n NUMBER]
+
+The previous path loaded every row of the CSV into a dict with `csv.reader` then
+converted the amounts with `safe_float`, the current one streams the lines, types
+the requested amounts on the fly and stops once all of them have been found.
+"""
+
+from tools.utils import load_csv_to_dict, safe_float, extract_financial_data
+from tools.rubrics import iter_rubrics
+from tools.financial import parse_rubrics
+from config.config import RUBRICS
+from io import StringIO
+import argparse, csv, os, timeit
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+BALANCE_CODES = ("10/15", "10/49")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+def previous_financial_data(text: str) -> dict:
+    """Dict of every row, then conversion of the needed values."""
+    data = load_csv_to_dict(text)
+    return {
+        "model": data.get("Model code", ""),
+        "employees": safe_float(data.get("1003", data.get("9087", 0))),
+        "year revenue": safe_float(data.get("70", 0)),
+        "total asset": safe_float(data.get("10/49", 0)),
+        "gross margin": (safe_float(data.get("74", 0)) + safe_float(data.get("70", 0)))
+        - (safe_float(data.get("60", 0)) + safe_float(data.get("61", 0))),
+    }
+
+
+def previous_rubrics(text: str, codes=None) -> dict:
+    """Every row through `csv.reader`, then the requested amounts."""
+    data = load_csv_to_dict(text)
+    return {code: safe_float(value) for code, value in data.items() if codes is None or code in codes}
+
+
+def count_lines(text: str, codes) -> int:
+    """Number of lines read by the streaming parser before it stops."""
+    lines = StringIO(text)
+    for _ in iter_rubrics(lines, codes):
+        pass
+    return text.count("\n", 0, lines.tell())
+
+
+def measure(func, text: str, number: int) -> float:
+    """Return the best mean time of a call, in microseconds."""
+    times = timeit.repeat(lambda: func(text), number=number, repeat=3)
+    return min(times) / number * 1e6
+
+
+def main(number: int):
+    cases = [
+        ("extract_financial_data", previous_financial_data, extract_financial_data, None),
+        ("ratio rubrics", lambda text: previous_rubrics(text, set(RUBRICS.values())),
+         lambda text: parse_rubrics(text, RUBRICS.values()), list(RUBRICS.values())),
+        ("balance sheet totals", lambda text: previous_rubrics(text, BALANCE_CODES),
+         lambda text: dict(iter_rubrics(StringIO(text), BALANCE_CODES)), BALANCE_CODES),
+        ("all rubrics", previous_rubrics, parse_rubrics, None),
+    ]
+    for name in ("cbso_account_m02-f.csv", "cbso_account_m81-f.csv"):
+        text = read_fixture(name)
+        total = text.count("\n")
+        print(f"{name} ({total} lines)")
+        for label, previous, current, codes in cases:
+            before, after = measure(previous, text, number), measure(current, text, number)
+            read = f"{count_lines(text, codes)}/{total} lines" if codes else ""
+            print(f"  {label:<24} {before:8.1f} us -> {after:8.1f} us  (x{before / after:.1f})  {read}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=200)
+    main(parser.parse_args().number)
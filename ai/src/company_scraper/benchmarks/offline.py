@@ -0,0 +1,224 @@
+"""
+Offline environment of the enrichment pipeline, shared by the benchmarks and the tests.
+
+The public sources (KBO, CBSO, Nominatim, company websites) are served from the recorded
+responses of `tests/fixtures` through a `httpx.MockTransport`, the search engine returns
+recorded results and the chat models are replaced by a deterministic `FakeLLM`.
+Additional companies are derived from the recorded one, with their own VAT number,
+name and website, so that concurrent runs neither share a computation nor a cache entry.
+"""
+
+from tools.cache import CacheBackend, NullCache
+from tools.format import format_vat
+from tools.hosts import HostLimits
+from tools.llm import prompt_name
+from tools.search import StaticSearch
+from contextlib import ExitStack, contextmanager
+from collections import Counter, namedtuple
+from functools import lru_cache
+from unittest.mock import patch
+import asyncio, os, re, threading, time, weakref, httpx
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+# The recorded company, the other ones are derived from its responses
+RECORDED_VAT = "0423369762"
+RECORDED_NAME = "Brico Plan-It"
+RECORDED_HOST = "www.brico-planit.be"
+
+# URL pattern, fixture and content type of the recorded responses.
+# The `vat` and `host` groups identify the company whose response is served.
+ROUTES = [
+    (r"kbopub\.economie\.fgov\.be/.*nummer=(?P<vat>\d{10})", "kbo_0423369762.html", "text/html; charset=utf-8"),
+    (
+        r"consult\.cbso\.nbb\.be/api/rs-consult/published-deposits\?.*enterpriseNumber=(?P<vat>\d{10})",
+        "cbso_deposits_0423369762.json",
+        "application/json",
+    ),
+    (r"consult\.cbso\.nbb\.be/api/external/broker/public/deposits/consult/csv/", "cbso_account_m02-f.csv", "text/csv"),
+    (r"nominatim\.openstreetmap\.org/", "nominatim_auderghem.json", "application/json"),
+    (r"//(?P<host>www\.brico-planit[\w-]*\.be)/", "website_brico_planit.html", "text/html; charset=utf-8"),
+    (r"//www\.planit-deco\.be/", "website_planit_deco.html", "text/html; charset=utf-8"),
+]
+
+Company = namedtuple("Company", ["vat_number", "name", "host"])
+
+
+@lru_cache(maxsize=None)
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+def make_vat_number(index: int) -> str:
+    """Valid Belgian VAT number (modulo 97 check digits) of a derived company."""
+    base = 4233697 + index * 7919
+    return f"0{base:07d}{97 - base % 97:02d}"
+
+
+def make_companies(count: int) -> list:
+    """The recorded company followed by `count - 1` derived ones."""
+    companies = [Company(RECORDED_VAT, RECORDED_NAME, RECORDED_HOST)]
+    for index in range(1, count):
+        companies.append(Company(make_vat_number(index), f"{RECORDED_NAME} {index}", f"www.brico-planit-{index}.be"))
+    return companies
+
+
+def render(text: str, company: Company) -> str:
+    """Adapt a recorded response to a derived company."""
+    if company.vat_number == RECORDED_VAT:
+        return text
+    return (
+        text.replace(format_vat(RECORDED_VAT), format_vat(company.vat_number))
+        .replace(RECORDED_VAT, company.vat_number)
+        .replace(RECORDED_NAME, company.name)
+        .replace(RECORDED_HOST, company.host)
+    )
+
+
+class Recordings:
+    """Recorded responses of the public sources and of the search engine, with a simulated latency."""
+
+    def __init__(self, count: int = 1, latency: float = 0.0):
+        """
+        :param count: The number of companies, see `make_companies`.
+        :param latency: The delay of every response, in seconds.
+        """
+        self.companies = make_companies(count)
+        self.latency = latency
+        self.by_vat = {company.vat_number: company for company in self.companies}
+        self.by_host = {company.host: company for company in self.companies}
+        self.lock = threading.Lock()
+        self.requests = Counter()  # By host
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def find_company(self, match: re.Match) -> Company:
+        groups = match.groupdict()
+        if "vat" in groups:
+            return self.by_vat.get(groups["vat"])
+        if "host" in groups:
+            return self.by_host.get(groups["host"])
+        return self.companies[0]
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        """Build the recorded response of a request, 404 for the URLs which were not recorded."""
+        url = str(request.url)
+        with self.lock:
+            self.requests[request.url.host] += 1
+        for pattern, fixture, content_type in ROUTES:
+            match = re.search(pattern, url)
+            if match:
+                company = self.find_company(match)
+                if company:
+                    content = render(read_fixture(fixture), company)
+                    return httpx.Response(200, text=content, headers={"content-type": content_type})
+        return httpx.Response(404, text="Not Found", headers={"content-type": "text/plain"})
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(request)
+
+    async def ahandle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(request)
+
+    def get_client(self) -> httpx.Client:
+        return httpx.Client(transport=httpx.MockTransport(self.handle))
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """Client of the running event loop, like `tools.client.get_async_client`."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(transport=httpx.MockTransport(self.ahandle))
+        return client
+
+    def get_search_provider(self) -> StaticSearch:
+        """Recorded search results of each company: its website, a homonym and an aggregator."""
+        return StaticSearch(
+            {
+                company.name: [
+                    f"https://{company.host}/",
+                    "https://www.planit-deco.be/",
+                    f"https://www.companyweb.be/fr/{company.vat_number}/brico-plan-it",
+                ]
+                for company in self.companies
+            }
+        )
+
+
+class FakeChain:
+    def __init__(self, llm, name: str):
+        self.llm = llm
+        self.name = name
+
+    def invoke(self, inputs: dict):
+        if self.llm.latency:
+            time.sleep(self.llm.latency)
+        return self.llm.answer(self.name, inputs)
+
+    async def ainvoke(self, inputs: dict):
+        if self.llm.latency:
+            await asyncio.sleep(self.llm.latency)
+        return self.llm.answer(self.name, inputs)
+
+
+class FakeLLM:
+    """Deterministic stand-in of the chat models: the answer only depends on the prompt and its inputs."""
+
+    def __init__(self, latency: float = 0.0):
+        """:param latency: The delay of every answer, in seconds."""
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()  # By prompt
+
+    def build_chain(self, prompt, model, schema=None) -> FakeChain:
+        """Replacement of `tools.llm.build_chain`."""
+        return FakeChain(self, prompt_name(prompt))
+
+    def answer(self, name: str, inputs: dict):
+        with self.lock:
+            self.calls[name] += 1
+        if name == "MAKE_DESCRIPTION":
+            text = re.sub(r"[#*_>\[\]()\s]+", " ", inputs["input"]).strip()
+            return {
+                "description": text[:300],
+                "sectors": ["Commerce de détail"],
+                "services": ["Conseil", "Livraison à domicile"],
+            }
+        if name == "FIND_URL":
+            match = re.search(r"https?://[^\s'\"]+", str(inputs.get("requests")))
+            return match.group(0) if match else ""
+        return None  # EXTRACT_LEGAL_DATA, the recorded KBO page is parsed without LLM
+
+
+@contextmanager
+def offline(recordings: Recordings = None, llm: FakeLLM = None, cache: CacheBackend = None):
+    """
+    Run the pipeline on the recorded responses and the fake LLM.
+
+    :param cache: The cache backend of the HTTP responses, LLM answers and stages,
+        by default nothing is cached so that every run is a cold one.
+    :return: The recordings, whose `requests` count the requests by host.
+    """
+    recordings = recordings or Recordings()
+    llm = llm or FakeLLM()
+    client = recordings.get_client()
+    replacements = {
+        "tools.scraper.get_client": lambda: client,
+        "tools.scraper.get_async_client": recordings.get_async_client,
+        "tools.cache._cache": cache or NullCache(),
+        "tools.llm.build_chain": llm.build_chain,
+        "tools.hosts._host_limits": HostLimits(rates={}, default_rate=None),  # No politeness delay
+        "tools.search.search_engine.providers": [recordings.get_search_provider()],
+        "runnable.legal_data.lookup_kbo": lambda vat_number: None,  # No local KBO index
+    }
+    with ExitStack() as stack:
+        for target, value in replacements.items():
+            stack.enter_context(patch(target, value))
+        try:
+            yield recordings
+        finally:
+            client.close()
@@ -1,32 +1,15 @@
-AGGREGATORS_DOMAINS = [
-    # Business data aggregators
-    "companyweb.be",
-    "graydon.be",
-    "trends-business-information.be",
-    "dnb.com",
-    "infogreffe.be",
-    "kbopub.economie.fgov.be",
-    "kbopub.kbo.belgium.be",
-    "opencorporates.com",
-    "companytracker.be",
-    "staatsbladmonitor.be",
-    "bizzy.org",
-    # Business review and rating sites
-    "trustpilot.com",
-    "business.google.com",
-    "yelp.be",
-    "glassdoor.be",
-    # Sector-specific platforms and regional initiatives
-    "digitalwallonia.be",
-    "agoria.be",
-    "ucm.be",
-    "voka.be",
-    "beci.be",
-    "unizo.be",
-    # General business directories
-    "pagesdor.be",
-    "goudengids.be",
-    "kompass.com",
-    "europages.be",
-    "zefix.ch",
-]
+import os
+
+# Blocklist of the business directories and aggregators, one domain per line (see the bundled file).
+# AGGREGATORS_FILE may point to a larger list with the same format, its "# version:" header
+# tells when it changed.
+AGGREGATORS_FILE = os.getenv(
+    "AGGREGATORS_FILE", os.path.join(os.path.dirname(__file__), "data", "aggregators.txt")
+)
+
+# Public suffixes made of several labels, never accepted as blocklist entries since they would
+# block every domain registered under them (single labels such as "be" are rejected too)
+PUBLIC_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "co.nz", "co.za",
+    "co.jp", "com.br", "com.tr", "com.cn", "com.mx", "com.pl", "co.in", "gouv.fr", "asso.fr",
+}
@@ -0,0 +1,37 @@
+import os
+
+# Cache location: "sqlite:///path/to/file.sqlite", "redis://host:port/db" or "none"
+CACHE_URL = os.getenv(
+    "CACHE_URL",
+    "sqlite:///" + os.path.expanduser("~/.cache/company_scraper/cache.sqlite"),
+)
+
+DAY = 24 * 60 * 60
+
+# Freshness of the cached HTTP responses, by URL prefix (without the scheme).
+# None means the response never expires, URLs matching no prefix are not cached.
+HTTP_CACHE_TTL = {
+    "kbopub.economie.fgov.be/": 3 * DAY,
+    "consult.cbso.nbb.be/api/rs-consult/published-deposits": 1 * DAY,
+    # Deposits are immutable once published, the CSV of a deposit id never changes
+    "consult.cbso.nbb.be/api/external/broker/public/deposits/consult/csv/": None,
+    "nominatim.openstreetmap.org/": 90 * DAY,
+}
+
+# Stale responses with an ETag or Last-Modified header are kept this long to be revalidated
+HTTP_CACHE_STALE_RETENTION = 30 * DAY
+
+# Cached LLM answers are evicted after this delay
+LLM_CACHE_TTL = 30 * DAY
+
+# Single-flight of the pipeline runs: concurrent requests for the same VAT number share
+# one computation. Set FLIGHT_URL ("redis://...") to also coalesce across worker processes.
+FLIGHT_URL = os.getenv("FLIGHT_URL", "")
+FLIGHT_LOCK_TTL = int(os.getenv("FLIGHT_LOCK_TTL", 300))  # Lock expiry if its worker dies
+FLIGHT_RESULT_TTL = 60  # Result kept for the workers waiting on the lock
+FLIGHT_POLL_INTERVAL = 0.5
+FLIGHT_WAIT_TIMEOUT = int(os.getenv("FLIGHT_WAIT_TIMEOUT", 300))  # Then computed locally
+
+# Fingerprints and outputs of the pipeline stages of each company, reused by the next run
+# when the inputs of a stage are unchanged. Entries older than this are recomputed.
+STAGES_TTL = int(os.getenv("STAGES_TTL", 90 * DAY))
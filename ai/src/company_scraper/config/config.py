@@ -1,13 +1,20 @@
 from .urls import URLS
 from .prompts import Prompt
-from .aggregators import AGGREGATORS_DOMAINS
+from .aggregators import *
+from .hosts import *
+from .cache import *
+from .search import *
+from .jobs import *
+from .tokens import *
+from .ranking import *
+from .kbo import *
+from .geography import *
+from .financial import *
 from .models import LLM
 from .belgian_annual_account_models import *
 from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from typing import List
-from langsmith import traceable
 from concurrent.futures import ThreadPoolExecutor
-from langchain_community.document_loaders import AsyncHtmlLoader
-import json, urllib.parse, logging, string, requests
+import json, urllib.parse, logging, string, asyncio
 from schema.company_schema import *
@@ -0,0 +1,31 @@
+import os
+
+# Rubrics of the annual accounts (NBB/CBSO CSV exports) used by the financial history
+RUBRICS = {
+    "revenue": "70",  # Chiffre d'affaires
+    "other_operating_income": "74",  # Autres produits d'exploitation
+    "purchases": "60",  # Approvisionnements et marchandises
+    "services": "61",  # Services et biens divers
+    "gross_margin": "9900",  # Marge brute d'exploitation (abbreviated and micro models)
+    "equity": "10/15",  # Capitaux propres
+    "total_assets": "10/49",  # Total du passif
+    "employees": "1003",  # Travailleurs ETP (social balance)
+    "average_employees": "9087",  # Effectif moyen ETP
+}
+
+# Rows of the annual account CSV read by `extract_financial_data`, the parsing stops once all are found
+FINANCIAL_DATA_CODES = ("Model code", "1003", "9087", "70", "74", "60", "61", "10/49")
+
+# Number of deposits requested per page of the published-deposits API
+DEPOSITS_PAGE_SIZE = 50
+
+# Retries of the CBSO requests rejected with 429 or 503, or failing on a transport error.
+# The delay is the Retry-After header when given, an exponential backoff otherwise,
+# multiplied by a random factor between 1 and 1 + CBSO_JITTER.
+CBSO_MAX_RETRIES = int(os.getenv("CBSO_MAX_RETRIES", 5))
+CBSO_BACKOFF = float(os.getenv("CBSO_BACKOFF", 1))
+CBSO_MAX_BACKOFF = float(os.getenv("CBSO_MAX_BACKOFF", 60))
+CBSO_JITTER = 0.5
+
+# Companies whose accounts are backfilled at the same time (requests are limited per host)
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", 20))
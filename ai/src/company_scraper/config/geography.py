@@ -0,0 +1,32 @@
+import os
+
+# Bundled table of the Belgian postal codes, with the French names of the localities.
+# POSTAL_CODES_FILE may point to a more complete export (e.g. the bpost list) with the same
+# columns: postal_code, city and optionally province and region. The version of the table,
+# part of the fingerprint of the address stage, is a hash of the file.
+POSTAL_CODES_FILE = os.getenv(
+    "POSTAL_CODES_FILE", os.path.join(os.path.dirname(__file__), "data", "postal_codes.csv")
+)
+
+# Province and region of each range of postal codes (first code, last code), used for the
+# codes missing from the table when the external lookup fails
+POSTAL_CODE_RANGES = [
+    (1000, 1299, "", "Bruxelles"),  # Brussels-Capital Region has no province
+    (1300, 1499, "Brabant wallon", "Wallonie"),
+    (1500, 1999, "Brabant flamand", "Flandre"),
+    (2000, 2999, "Anvers", "Flandre"),
+    (3000, 3499, "Brabant flamand", "Flandre"),
+    (3500, 3999, "Limbourg", "Flandre"),
+    (4000, 4999, "Liège", "Wallonie"),
+    (5000, 5999, "Namur", "Wallonie"),
+    (6000, 6599, "Hainaut", "Wallonie"),
+    (6600, 6999, "Luxembourg", "Wallonie"),
+    (7000, 7999, "Hainaut", "Wallonie"),
+    (8000, 8999, "Flandre occidentale", "Flandre"),
+    (9000, 9999, "Flandre orientale", "Flandre"),
+]
+
+COUNTRY = "Belgique"
+
+# Query Nominatim (cached, 1 request/s) for the postal codes outside of the Belgian ranges
+NOMINATIM_FALLBACK = os.getenv("NOMINATIM_FALLBACK", "1") not in ("0", "false", "False")
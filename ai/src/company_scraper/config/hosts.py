@@ -0,0 +1,54 @@
+import os
+
+# Maximum number of simultaneous requests per host, to stay polite with the
+# public sources when many companies are enriched at the same time
+HOST_CONCURRENCY = {
+    "kbopub.economie.fgov.be": 4,
+    "consult.cbso.nbb.be": int(os.getenv("CBSO_CONCURRENCY", 4)),
+    "nominatim.openstreetmap.org": 1,  # Nominatim usage policy: 1 request at a time
+}
+
+# Limit applied to any other host (company websites, ...)
+DEFAULT_HOST_CONCURRENCY = 8
+
+# Shared HTTP client settings (seconds for the timeouts)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 2))  # Retries on connection errors only
+
+# Request rate allowed per host: (requests per second, burst). The rate is halved when the host
+# answers 429/503 and regained by HOST_RATE_INCREASE of its configured value after each success.
+HOST_RATES = {
+    "kbopub.economie.fgov.be": (2.0, 4),
+    "consult.cbso.nbb.be": (float(os.getenv("CBSO_RATE", 5)), 5),
+    "nominatim.openstreetmap.org": (1.0, 1),  # Nominatim usage policy: 1 request per second
+    "www.google.com": (0.5, 1),  # Search results page, throttled quickly
+}
+DEFAULT_HOST_RATE = (5.0, 10)
+HOST_MIN_RATE = 0.05
+HOST_RATE_DECREASE = 0.5
+HOST_RATE_INCREASE = 0.05
+
+# Circuit breaker: consecutive failures (connection error, timeout, 5xx) after which a host is
+# not requested again during FAILED_HOST_TTL seconds, then a single request probes it.
+# A company website is skipped at its first failure, the public sources get a few more chances.
+HOST_FAILURE_THRESHOLD = {
+    "kbopub.economie.fgov.be": 5,
+    "consult.cbso.nbb.be": 5,
+    "nominatim.openstreetmap.org": 3,
+    "www.google.com": 3,
+}
+DEFAULT_FAILURE_THRESHOLD = 1
+FAILED_HOST_TTL = float(os.getenv("FAILED_HOST_TTL", 300))
+
+# Hosts labelled by name in the metrics (with the host of SEARXNG_URL), the requests to the
+# company websites are counted under "other" to keep the number of label values bounded
+METRICS_HOSTS = {
+    "kbopub.economie.fgov.be",
+    "consult.cbso.nbb.be",
+    "nominatim.openstreetmap.org",
+    "www.google.com",
+}
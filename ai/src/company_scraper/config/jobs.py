@@ -0,0 +1,29 @@
+import os
+
+# Queue of the enrichment jobs: "redis://host:port/db" to share it between the web tier and
+# the workers, or "memory://" for a queue living in the worker process (tests, local runs)
+JOBS_URL = os.getenv("JOBS_URL", "memory://")
+JOBS_PREFIX = "jobs"
+
+# Lanes, by priority: a worker always takes the interactive jobs before the batch ones
+JOB_LANES = ("interactive", "batch")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+
+# Seconds after which a job is abandoned, from its submission
+JOB_DEADLINES = {
+    "interactive": int(os.getenv("JOB_INTERACTIVE_DEADLINE", 120)),
+    "batch": int(os.getenv("JOB_BATCH_DEADLINE", 24 * 60 * 60)),
+}
+
+# Retries of a failed job, after an exponential backoff (seconds) with jitter
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_BACKOFF = 5.0
+JOB_MAX_BACKOFF = 300.0
+JOB_JITTER = 0.2
+
+# A running job is renewed every JOB_HEARTBEAT seconds, a job whose lease expired (its worker
+# died) is queued again
+JOB_LEASE = 60.0
+JOB_HEARTBEAT = 10.0
+JOB_POLL_INTERVAL = 0.5  # Delay between two polls of an empty queue
+JOB_RESULT_TTL = 7 * 24 * 60 * 60  # The jobs and their results are kept this long
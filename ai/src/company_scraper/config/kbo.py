@@ -0,0 +1,37 @@
+import os
+
+# Local index of the KBO (BCE) open data dump, see `python -m tools.kbo --help`
+KBO_DATABASE = os.getenv(
+    "KBO_DATABASE", os.path.expanduser("~/.cache/company_scraper/kbo.sqlite")
+)
+
+# Language of the names, addresses and code descriptions ("FR", "NL", "DE" or "EN")
+KBO_LANGUAGE = os.getenv("KBO_LANGUAGE", "FR")
+
+# Files of the dump imported in the index and their columns (the first one is the entity number).
+# Establishment units and branches are not imported.
+KBO_TABLES = {
+    "enterprise": ["EnterpriseNumber", "Status", "JuridicalSituation", "TypeOfEnterprise", "JuridicalForm", "StartDate"],
+    "denomination": ["EntityNumber", "Language", "TypeOfDenomination", "Denomination"],
+    "address": [
+        "EntityNumber", "TypeOfAddress", "Zipcode", "MunicipalityNL", "MunicipalityFR",
+        "StreetNL", "StreetFR", "HouseNumber", "Box",
+    ],
+    "activity": ["EntityNumber", "ActivityGroup", "NaceVersion", "NaceCode", "Classification"],
+    "contact": ["EntityNumber", "ContactType", "Value"],
+}
+
+# Code descriptions, shared by all the entities
+KBO_CODE_COLUMNS = ["Category", "Code", "Language", "Description"]
+
+# Language codes of the denominations, in order of preference for each language
+KBO_DENOMINATION_LANGUAGES = {"FR": "1", "NL": "2", "DE": "3", "EN": "4"}
+
+# Type of denomination of the legal name and type of address of the registered office
+KBO_LEGAL_NAME = "001"
+KBO_REGISTERED_OFFICE = "REGO"
+
+MONTHS_FR = [
+    "janvier", "février", "mars", "avril", "mai", "juin",
+    "juillet", "août", "septembre", "octobre", "novembre", "décembre",
+]
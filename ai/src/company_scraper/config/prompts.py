@@ -1,10 +1,6 @@
-from langchain.prompts import PromptTemplate
-
-
-"""A class to encapsulate various prompts used for LLMs."""
+"""A class to encapsulate various prompts used for LLMs (templates, see `tools.llm.get_prompt`)."""
 class Prompt:
-    FIND_URL = PromptTemplate.from_template(
-        """
+    FIND_URL = """
         You are an expert in data validation and web scraping. Your task is to identify the most relevant URL that corresponds to the official website of the company "{name}".  
 
         ### **Input Information:**  
@@ -31,18 +27,14 @@ class Prompt:
         ### **Final Output:**  
         Return only the URL. Do not provide any explanation, reasoning, or additional text. If no URL match, return an empty string `""`.  
         """
-    )
 
-    MAKE_DESCRIPTION = PromptTemplate.from_template(
-        """
+    MAKE_DESCRIPTION = """
         Make a concise summary (up to 5 lines) about the company's activities based on the following content: {input}. 
         Focus on the core business, products, and services of the company.
         Exclude any irrelevant details such as promotions, loyalty programs, or non-business-related information.
         """
-    )
 
-    EXTRACT_LEGAL_DATA = PromptTemplate.from_template(
-        """
+    EXTRACT_LEGAL_DATA = """
     Extract structured company data from the following raw text.
 
     **Rules:**
@@ -56,4 +48,3 @@ class Prompt:
     ### **Raw Text:**
     {input}
     """
-    )
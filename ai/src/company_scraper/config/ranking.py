@@ -0,0 +1,20 @@
+# Points of each signal in the score (out of 100) of a candidate website
+RANKING_WEIGHTS = {
+    "domain": 40,  # Similarity between the company name and the domain
+    "site_name": 25,  # Company name in the og:site_name, og:title or title
+    "activities": 20,  # Share of the company activities mentioned on the page
+    "vat": 15,  # VAT number of the company published on the page
+}
+
+# The LLM only chooses between the candidates scoring within this margin of the best one
+RANKING_MARGIN = 15
+
+# Below this score, even a single candidate is checked by the LLM
+RANKING_MIN_SCORE = 50
+
+# Words of the NACEBEL descriptions too generic to identify an activity
+GENERIC_ACTIVITY_WORDS = {
+    "activites", "autres", "commerce", "detail", "magasin", "specialise", "services",
+    "service", "gros", "produits", "articles", "fabrication", "compris", "non",
+    "classe", "ailleurs", "divers", "general", "generale", "principalement",
+}
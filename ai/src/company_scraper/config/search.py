@@ -0,0 +1,17 @@
+import os
+
+# Search providers used to find the website of a company, in order of preference:
+# "google" (googlesearch, scrapes the Google results page), "searxng" (JSON API of a
+# SearXNG instance, e.g. a local container) and "static" (recorded results of SEARCH_FIXTURES,
+# a JSON file {query: [urls]}). Set SEARCH_FAN_OUT to query all of them
+# concurrently and merge their results, otherwise the next one is only used when a provider fails.
+SEARCH_PROVIDERS = [name.strip() for name in os.getenv("SEARCH_PROVIDERS", "google").split(",") if name.strip()]
+SEARCH_FAN_OUT = os.getenv("SEARCH_FAN_OUT", "0") not in ("0", "false", "False")
+SEARXNG_URL = os.getenv("SEARXNG_URL", "http://localhost:8888")
+SEARCH_LANGUAGE = "fr-BE"
+SEARCH_FIXTURES = os.getenv("SEARCH_FIXTURES", "")
+
+# Results of a query (company name and address) are reused during this delay (seconds)
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 30 * 24 * 60 * 60))
+
+# The rate limit and circuit breaker of each provider are those of its host, see HOST_RATES
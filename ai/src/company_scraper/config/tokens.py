@@ -0,0 +1,22 @@
+import os
+
+# Tokenizer used to measure the prompt contents (encoding of the GPT-4 family)
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+# Token budget of each candidate website content sent to Prompt.FIND_URL
+FIND_URL_TOKEN_BUDGET = int(os.getenv("FIND_URL_TOKEN_BUDGET", 1000))
+
+# Token budget of the website content sent to Prompt.MAKE_DESCRIPTION
+DESCRIPTION_TOKEN_BUDGET = int(os.getenv("DESCRIPTION_TOKEN_BUDGET", 6000))
+
+# Tags never containing useful content for the LLM
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "iframe", "svg", "canvas",
+    "nav", "footer", "aside", "form", "button", "select", "input",
+]
+
+# ARIA roles of the navigation and page-wide elements
+BOILERPLATE_ROLES = ["navigation", "contentinfo", "dialog", "alertdialog", "search"]
+
+# Class or id fragments of the cookie banners, menus and pop-ups, matched against each class name
+BOILERPLATE_PATTERN = r"cookie|consent|gdpr|rgpd|newsletter|popup|modal|breadcrumb|(^|[-_])(nav|menu|footer|sidebar)([-_]|$)"
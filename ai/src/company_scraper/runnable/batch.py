@@ -0,0 +1,147 @@
+from runnable.company_scraper import arun
+from tools.metrics import metrics
+from config.config import *
+from typing import AsyncIterator, Iterable, Union
+import argparse, os, re, sys
+
+
+class Checkpoint:
+    """
+    Append-only file recording the VAT numbers already enriched by a batch,
+    so an interrupted batch can be resumed where it stopped.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.done = {line.strip() for line in file if line.strip()}
+
+    def __contains__(self, vat_number: str) -> bool:
+        return vat_number in self.done
+
+    def add(self, vat_number: str):
+        """Mark a VAT number as processed."""
+        self.done.add(vat_number)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(vat_number + "\n")
+
+
+def read_vat_numbers(source: Union[str, Iterable[str]]) -> Iterable[str]:
+    """
+    Read VAT numbers from a file (one per line, "-" for stdin) or an iterable.
+    Dots, spaces and the "BE" prefix are removed, empty lines are ignored.
+
+    :param source: A file path or an iterable of VAT numbers.
+    :return: An iterator over the cleaned VAT numbers.
+    """
+    if isinstance(source, str):
+        file = sys.stdin if source == "-" else open(source, encoding="utf-8")
+        with file:
+            yield from read_vat_numbers(iter(file.readline, ""))
+        return
+
+    for line in source:
+        vat_number = re.sub(r"[^\d]", "", line)
+        if vat_number:
+            yield vat_number
+
+
+async def run_batch(
+    vat_numbers: Union[str, Iterable[str]],
+    concurrency: int = 10,
+    checkpoint: str = None,
+) -> AsyncIterator[CompanySchema]:
+    """
+    Enrich many companies concurrently and yield each `CompanySchema` as soon as it is complete.
+
+    Requests sent to the public sources are additionally limited per host (see `HOST_CONCURRENCY`).
+    A VAT number is written to the checkpoint once its result has been consumed, failed
+    lookups are logged and will be retried by the next run. An error reading the input is
+    raised once the VAT numbers already read are processed.
+
+    :param vat_numbers: A file path or an iterable of VAT numbers.
+    :param concurrency: The maximum number of companies enriched at the same time.
+    :param checkpoint: Path of the checkpoint file used to skip already processed VAT numbers.
+    :return: An asynchronous iterator over the completed company schemas.
+    """
+    done = Checkpoint(checkpoint)
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue()
+
+    async def stop_workers():
+        for _ in range(concurrency):
+            await pending.put(None)  # Stop signal for each worker
+
+    async def produce():
+        seen = set()
+        lines = read_vat_numbers(vat_numbers)
+        try:
+            # Read in a thread: a slow input (e.g. a pipe on stdin) must not block the workers
+            while (vat_number := await asyncio.to_thread(next, lines, None)) is not None:
+                if vat_number in done or vat_number in seen:
+                    continue
+                seen.add(vat_number)
+                await pending.put(vat_number)
+        except Exception:
+            # The workers finish the queued VAT numbers, the error is raised to the caller after them
+            await stop_workers()
+            raise
+        await stop_workers()
+
+    async def work():
+        while (vat_number := await pending.get()) is not None:
+            try:
+                company_schema = await arun({"vat_number": vat_number})
+            except Exception as e:
+                logging.error(f"Enrichment failed for VAT number {vat_number}: {e}")
+                continue
+            await results.put((vat_number, company_schema))
+        await results.put(None)
+
+    tasks = [asyncio.create_task(produce())]
+    tasks += [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            item = await results.get()
+            if item is None:
+                running -= 1
+                continue
+            vat_number, company_schema = item
+            if company_schema:
+                yield company_schema
+                done.add(vat_number)
+        await tasks[0]  # Raise the error of the producer, e.g. a missing input file
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def write_batch(source, output, concurrency: int, checkpoint: str):
+    """Stream the results of `run_batch` as JSON lines into the output file."""
+    async for company_schema in run_batch(source, concurrency, checkpoint):
+        output.write(company_schema.model_dump_json() + "\n")
+        output.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich a list of Belgian companies.")
+    parser.add_argument("input", help="File with one VAT number per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSON lines output file")
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--checkpoint", help="Checkpoint file used to resume the batch")
+    parser.add_argument("--metrics", help="Write the metrics of the batch (.prom or .json file)")
+    args = parser.parse_args()
+
+    # Resumed batches append to the previous output
+    output = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    with output:
+        asyncio.run(write_batch(args.input, output, args.concurrency, args.checkpoint))
+
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as file:
+            file.write(metrics.to_json() if args.metrics.endswith(".json") else metrics.to_prometheus())
@@ -1,32 +1,44 @@
 from tools.utils import *
-from googlesearch import search
 from tools.scraper import CompanyScraper
 from concurrent.futures import ThreadPoolExecutor
 from tools.format import *
+from tools.llm import invoke_llm, ainvoke_llm
+from tools.reduce import *
+from tools.ranking import *
+from tools.aggregators import get_aggregators
+from tools.search import search_engine
+from tools.flight import request_flights, get_request_key
+from tools.stages import StageRun, fingerprint, content_hash
+from tools.metrics import metrics, in_context
+from tools.tracing import traceable
 from config.config import *
 
-scraper = CompanyScraper(AsyncHtmlLoader)
+scraper = CompanyScraper()
 
 
+@metrics.timed("search")
 def get_urls_from_google(
     company_name: str, adress: str, num_results: int = 5
 ) -> List[str]:
     """
-    Perform a Google search using the company name and its activities and return the URLs.
+    Search the company name and its address and return the URLs of the results,
+    through the configured search providers (see `tools.search`).
 
     :param company_name: The name of the company.
-    :param activities: List of activities or keywords related to the company's business.
+    :param adress: The address of the company.
     :param num_results: The number of search results to return.
 
     :return List[str]: A list of URLs that match the search query.
     """
-    # Combine company name and activities into a single search query
-    search_query = f"{company_name} {adress}"
-    # Perform the Google search (assuming 'search' is a function to perform the search)
-    results = search(search_query, num_results=num_results, region="be")
+    return search_engine.search(company_name, adress, num_results)
 
-    # Return the URLs from the search results
-    return list(results)
+
+@metrics.timed("search")
+async def aget_urls_from_google(
+    company_name: str, adress: str, num_results: int = 5
+) -> List[str]:
+    """Asynchronous version of `get_urls_from_google`."""
+    return await search_engine.asearch(company_name, adress, num_results)
 
 
 def get_meta_content(soup, *attrs):
@@ -49,13 +61,32 @@ def extract_page_data(url: str, company_name: str) -> dict:
     documents = scraper.run(url)
     if not documents:
         return ""
+    return parse_page_data(url, documents, company_name)
+
+
+async def aextract_page_data(url: str, company_name: str) -> dict:
+    """Asynchronous version of `extract_page_data`, parsing is done outside the event loop."""
+    documents = await scraper.arun(url)
+    if not documents:
+        return ""
+    return await asyncio.to_thread(parse_page_data, url, documents, company_name)
+
+
+def parse_page_data(url: str, documents: list, company_name: str) -> dict:
+    """
+    Builds the page metadata dictionary of `extract_page_data` from the loaded documents.
+
+    :param url (str): The URL of the web page.
+    :param documents (list): The documents loaded from the URL.
+
+    :return dict: A dictionary containing the extracted metadata
+    """
     html = documents[0].page_content
     if html == "":
         return
 
-    markdown = convert_html_to_markdown(documents)[0].page_content
-
-    soup = BeautifulSoup(html, "html.parser")
+    # Parse once, the tree is used for both the metadata and the Markdown conversion
+    soup = parse_html(html)
 
     return {
         "data": {
@@ -70,11 +101,24 @@ def extract_page_data(url: str, company_name: str) -> dict:
                 soup, ("name", "twitter:description")
             ),
             "similarity_name_domain": compare_name_with_domain(company_name, url),
-            "website_content": markdown,
+            "vat_numbers": find_vat_numbers(html),
+            "website_content": page_to_markdown(soup),  # Read last, the boilerplate is removed
         }
     }
 
 
+def page_to_markdown(soup: BeautifulSoup) -> str:
+    """Convert a parsed page into Markdown, without its navigation, cookie banners and repeated blocks."""
+    return clean_markdown(soup_to_markdown(strip_boilerplate(soup)))
+
+
+def website_to_markdown(documents: list) -> str:
+    """Convert the loaded documents of a website into reduced Markdown."""
+    if not documents or not documents[0].page_content:
+        return ""
+    return page_to_markdown(parse_html(documents[0].page_content))
+
+
 def parallel_execution(urls: List[str], company_name: str) -> List[dict]:
     """Process URLs and retrieve the metadata."""
     if not urls or not isinstance(company_name, str):
@@ -84,9 +128,19 @@ def parallel_execution(urls: List[str], company_name: str) -> List[dict]:
     search_data = [(url, company_name) for url in urls]
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         results = list(
-            executor.map(lambda data: extract_page_data(data[0], data[1]), search_data)
+            executor.map(in_context(lambda data: extract_page_data(data[0], data[1])), search_data)
         )
-    return [item for item in results if item is not None]  # None value filter
+    return [item for item in results if item]  # Empty value filter
+
+
+async def aparallel_execution(urls: List[str], company_name: str) -> List[dict]:
+    """Asynchronous version of `parallel_execution`, all the URLs are fetched concurrently."""
+    if not urls or not isinstance(company_name, str):
+        return
+    results = await asyncio.gather(
+        *(aextract_page_data(url, company_name) for url in urls)
+    )
+    return [item for item in results if item]  # Empty value filter
 
 
 def find_website(company_schema: CompanySchema):
@@ -106,29 +160,57 @@ def find_website(company_schema: CompanySchema):
     urls_without_aggregators = remove_aggregators_url(
         urls, company_schema.vat_number, company_schema.name
     )
-    print(urls)
-    print(urls_without_aggregators)
+    logging.debug(f"Search results: {urls}, without aggregators: {urls_without_aggregators}")
     if not urls_without_aggregators:
         return
 
     # Process the URLs to retrieve metadata for each website
-    websites_data = parallel_execution(urls_without_aggregators, company_schema.name)
+    websites_data = load_candidates(urls_without_aggregators, company_schema)
     if not websites_data:
         return
 
-    # Use the LLM to select the most relevant website based on the processed data
-    chain = Prompt.FIND_URL | LLM.GPT_4_TURBO
-    best_url = chain.invoke(
+    # Use the LLM only when the deterministic ranking has no obvious winner
+    winner, contenders = pick_website(rank_websites(websites_data, company_schema))
+    if winner:
+        return winner
+    best_url = invoke_llm(
+        Prompt.FIND_URL,
+        LLM.GPT_4_TURBO,
         {
             "name": company_schema.name,
-            "requests": websites_data,
+            "requests": reduce_candidates(contenders),
             "activities": company_schema.activities.company_activities,
-        }
-    ).content
+        },
+    )
+    return select_website(best_url, contenders)
+
+
+def load_candidates(urls: List[str], company_schema: CompanySchema) -> List[dict]:
+    """
+    Load the candidate websites, the most promising domains first (see `split_candidates`).
+    The other websites are only loaded when they can still reach the score of the first ones.
+    """
+    first, others = split_candidates(sort_urls(urls, company_schema), company_schema)
+    websites_data = parallel_execution(first, company_schema.name) or []
+    best_score = max((score_website(entry, company_schema) for entry in websites_data), default=0)
+    others = [url for url in others if can_win(url, company_schema, best_score)]
+    return websites_data + (parallel_execution(others, company_schema.name) or [])
+
+
+async def aload_candidates(urls: List[str], company_schema: CompanySchema) -> List[dict]:
+    """Asynchronous version of `load_candidates`."""
+    first, others = split_candidates(sort_urls(urls, company_schema), company_schema)
+    websites_data = await aparallel_execution(first, company_schema.name) or []
+    best_score = max((score_website(entry, company_schema) for entry in websites_data), default=0)
+    others = [url for url in others if can_win(url, company_schema, best_score)]
+    return websites_data + (await aparallel_execution(others, company_schema.name) or [])
+
+
+def select_website(best_url: str, websites_data: List[dict]) -> dict:
+    """Find the complete data entry corresponding to the best URL selected by LLM."""
     if not best_url:
         return None
 
-    # Find the complete data entry corresponding to the best URL selected by LLM
     best_netloc = urlparse(best_url).netloc  # Extract domain
 
     # Compare the domains
@@ -144,6 +226,36 @@ def find_website(company_schema: CompanySchema):
     return selected_entry
 
 
+async def afind_website(company_schema: CompanySchema):
+    """Asynchronous version of `find_website`."""
+    urls = await aget_urls_from_google(
+        company_schema.name, company_schema.address.full_address
+    )
+    urls_without_aggregators = remove_aggregators_url(
+        urls, company_schema.vat_number, company_schema.name
+    )
+    if not urls_without_aggregators:
+        return
+
+    websites_data = await aload_candidates(urls_without_aggregators, company_schema)
+    if not websites_data:
+        return
+
+    winner, contenders = pick_website(rank_websites(websites_data, company_schema))
+    if winner:
+        return winner
+    best_url = await ainvoke_llm(
+        Prompt.FIND_URL,
+        LLM.GPT_4_TURBO,
+        {
+            "name": company_schema.name,
+            "requests": reduce_candidates(contenders),
+            "activities": company_schema.activities.company_activities,
+        },
+    )
+    return select_website(best_url, contenders)
+
+
 company_description_output = {
     "title": "CompanyDescription",
     "description": "Extracts the company description and sectors based on its activities.",
@@ -177,41 +289,182 @@ company_description_output = {
 def get_company_description(website_content: str) -> str:
     """
     Generates a company description based on the provided website content using a Large Language Model (LLM).
+    The content is reduced to `DESCRIPTION_TOKEN_BUDGET` tokens.
     """
-    chain = Prompt.MAKE_DESCRIPTION | LLM.GPT_4O_MINI.with_structured_output(
-        company_description_output
+    return invoke_llm(
+        Prompt.MAKE_DESCRIPTION,
+        LLM.GPT_4O_MINI,
+        {"input": reduce_content(website_content, DESCRIPTION_TOKEN_BUDGET)},
+        schema=company_description_output,
     )
 
-    return chain.invoke({"input": website_content})
+
+async def aget_company_description(website_content: str) -> dict:
+    """Asynchronous version of `get_company_description`."""
+    return await ainvoke_llm(
+        Prompt.MAKE_DESCRIPTION,
+        LLM.GPT_4O_MINI,
+        {"input": reduce_content(website_content, DESCRIPTION_TOKEN_BUDGET)},
+        schema=company_description_output,
+    )
+
+
+def get_description_key(company_schema: CompanySchema, force=False) -> str:
+    """
+    Key of the website discovery and description of a company, None without VAT number.
+
+    :param force: The `force` argument of the run, a forced refresh is not shared with a normal one.
+    """
+    if not company_schema.vat_number:
+        return None
+    return get_request_key(
+        {
+            "vat_number": company_schema.vat_number,
+            "name": company_schema.name,
+            "website": company_schema.contact.website,
+        },
+        force,
+    )
+
+
+def get_website_key(company_schema: CompanySchema) -> str:
+    """
+    Fingerprint of the website discovery: what the search, the aggregators filter and the ranking
+    depend on. The city is left out, it may be filled by the address completion running meanwhile.
+    """
+    address = company_schema.address
+    return fingerprint(
+        company_schema.name,
+        [address.street, address.street_number, address.postal_code],
+        company_schema.activities.nacebel_codes,
+        company_schema.activities.company_activities,
+        company_schema.contact.website,
+        get_aggregators().version,
+    )
+
+
+def get_description_stage_key(website_data: dict) -> str:
+    """Fingerprint of the description: the website URL and the hash of its content."""
+    data = website_data["data"]
+    return fingerprint(data["url"], content_hash(data["website_content"]))
+
+
+def load_website_data(url: str) -> dict:
+    """Download the website of the company, as in the output of `find_website`."""
+    content = website_to_markdown(scraper.run(url))
+    return {"data": {"url": url, "website_content": content}}
+
+
+async def aload_website_data(url: str) -> dict:
+    """Asynchronous version of `load_website_data`."""
+    documents = await scraper.arun(url)
+    content = await asyncio.to_thread(website_to_markdown, documents)
+    return {"data": {"url": url, "website_content": content}}
+
 
 @traceable
-def complete_schema(company_schema: CompanySchema) -> CompanySchema:
+def complete_schema(company_schema: CompanySchema, stages: StageRun = None) -> CompanySchema:
     """
     Completes the provided company schema with additional information fetched from the web.
+    Concurrent completions of the same company share the website discovery and LLM calls.
 
     :param company_schema: The schema object representing the company that will be updated.
-    :param company_name: The name of the company, used to fetch related information from the web.
+    :param stages: The stages of the run, the discovery and description are reused when unchanged.
 
     :return: The updated company schema with the added website and company description.
     """
-    # Retrieve the website data based on the company name
-    if company_schema.contact.website:
-        content = convert_html_to_markdown(scraper.run(company_schema.contact.website))[
-            0
-        ].page_content
-        website_data = {
-            "data": {"url": company_schema.contact.website, "website_content": content}
-        }
-    else:
-        website_data = find_website(company_schema)
-    if not website_data:
+    described = request_flights.do(
+        "description",
+        get_description_key(company_schema, stages.force if stages else False),
+        lambda: describe_company(company_schema, stages),
+    )
+    if not described:
         return company_schema
+    return set_description_data(company_schema, *described)
+
+
+def describe_company(company_schema: CompanySchema, stages: StageRun = None) -> tuple:
+    """
+    Find the website of the company and describe it. With `stages`, a website found by
+    the previous run is only downloaded again, and described again if its content changed.
+
+    :return tuple: (website_data, description_data), or None when no website is found.
+    """
+    stages = stages or StageRun()
+    with metrics.timer("stage", stage="website"):
+        website_key = get_website_key(company_schema)
+        found, fragment = stages.reuse("website", website_key)
+        if found:
+            website_data = load_website_data(fragment["url"]) if fragment["url"] else None
+        else:
+            # Retrieve the website data based on the company name
+            if company_schema.contact.website:
+                website_data = load_website_data(company_schema.contact.website)
+            else:
+                website_data = find_website(company_schema)
+            if website_data:  # Not found (e.g. a throttled search) is not stored, the next run searches again
+                stages.record("website", website_key, {"url": website_data["data"]["url"]})
+    if not website_data:
+        return None
+
+    with metrics.timer("stage", stage="description"):
+        description_key = get_description_stage_key(website_data)
+        found, description_data = stages.reuse("description", description_key)
+        if not found:
+            description_data = get_company_description(website_data["data"]["website_content"])
+            stages.record("description", description_key, description_data)
+    return website_data, description_data
 
-    # Update the company schema with the website URL, description and sector
+
+def set_description_data(
+    company_schema: CompanySchema, website_data: dict, description_data: dict
+) -> CompanySchema:
+    """Update the company schema with the website URL, description and sector."""
     company_schema.contact.website = website_data["data"]["url"]
-    description_data = get_company_description(website_data["data"]["website_content"])
     company_schema.activities.company_description = description_data["description"]
     company_schema.activities.sectors = description_data["sectors"]
     company_schema.activities.services = description_data["services"]
 
     return company_schema
+
+
+@traceable
+async def acomplete_schema(company_schema: CompanySchema, stages: StageRun = None) -> CompanySchema:
+    """Asynchronous version of `complete_schema`."""
+    described = await request_flights.ado(
+        "description",
+        get_description_key(company_schema, stages.force if stages else False),
+        lambda: adescribe_company(company_schema, stages),
+    )
+    if not described:
+        return company_schema
+    return set_description_data(company_schema, *described)
+
+
+async def adescribe_company(company_schema: CompanySchema, stages: StageRun = None) -> tuple:
+    """Asynchronous version of `describe_company`."""
+    stages = stages or StageRun()
+    async with metrics.atimer("stage", stage="website"):
+        website_key = get_website_key(company_schema)
+        found, fragment = stages.reuse("website", website_key)
+        if found:
+            website_data = await aload_website_data(fragment["url"]) if fragment["url"] else None
+        else:
+            if company_schema.contact.website:
+                website_data = await aload_website_data(company_schema.contact.website)
+            else:
+                website_data = await afind_website(company_schema)
+            if website_data:  # Not found (e.g. a throttled search) is not stored, the next run searches again
+                stages.record("website", website_key, {"url": website_data["data"]["url"]})
+    if not website_data:
+        return None
+
+    async with metrics.atimer("stage", stage="description"):
+        description_key = get_description_stage_key(website_data)
+        found, description_data = stages.reuse("description", description_key)
+        if not found:
+            description_data = await aget_company_description(
+                website_data["data"]["website_content"]
+            )
+            stages.record("description", description_key, description_data)
+    return website_data, description_data
@@ -1,5 +1,15 @@
-from runnable.legal_data import get_company_schema
-from runnable.company_description import complete_schema
+from runnable.legal_data import (
+    get_company_schema,
+    start_financial_task,
+    aget_legal_data,
+    acomplete_address,
+    acomplete_financial,
+)
+from runnable.company_description import complete_schema, acomplete_schema
+from tools.flight import request_flights, get_request_key, dump_schema, load_schema
+from tools.stages import stage_store
+from tools.metrics import track_run
+from tools.tracing import traceable
 from config.config import *
 
 # Configuration du logging
@@ -9,9 +19,81 @@ logging.basicConfig(
 )
 
 @traceable
-def run(fields: dict):
-    company_schema = get_company_schema(fields)
-    complete_schema(company_schema)
+def run(fields: dict, force: bool = False):
+    """
+    Enrich a company. Concurrent requests for the same VAT number (in this process, or in
+    every worker when `FLIGHT_URL` is set) share one computation and receive a copy of its result.
+
+    The stages whose inputs did not change since the last run of the company (same KBO pages,
+    address, latest deposit, website content) are skipped and their stored output is reused.
+
+    :param force: Recompute every stage, or only the given stages (see `STAGES`).
+    """
+    return request_flights.do(
+        "run", get_request_key(fields, force), lambda: enrich(fields, force), dump_schema, load_schema
+    )
+
+
+def enrich(fields: dict, force: bool = False) -> CompanySchema:
+    """Run every stage of the pipeline, the timing breakdown is attached to the result."""
+    with track_run() as timings:
+        stages = stage_store.start(fields.get("vat_number"), force)
+        company_schema = get_company_schema(fields, stages)
+        if company_schema:
+            complete_schema(company_schema, stages)
+            stages.save()
+            company_schema.timings = timings.to_dict()
+    return company_schema
+
+
+@traceable
+async def arun(fields: dict, force: bool = False) -> CompanySchema:
+    """Asynchronous version of `run`."""
+    return await request_flights.ado(
+        "run", get_request_key(fields, force), lambda: aenrich(fields, force), dump_schema, load_schema
+    )
+
+
+async def aenrich(fields: dict, force: bool = False, on_stage=None) -> CompanySchema:
+    """
+    Asynchronous version of `enrich`, every stage shares the caller's event loop.
+
+    The NBB lookups start as soon as the VAT number is known. Once the legal data
+    is extracted, the address completion, the financial data and the website
+    discovery (Google search, candidate pages, LLM calls) run concurrently.
+
+    :param on_stage: Function called with (stage, company_schema) in the event loop once the
+                     legal data is read ("legal"), then as the "address", "financial" and
+                     "description" (website and description) completions finish.
+    """
+
+    def report(stage: str):
+        if on_stage is not None:
+            on_stage(stage, company_schema)
+
+    async def complete(stage: str, completion):
+        await completion
+        report(stage)
+
+    with track_run() as timings:
+        stages = await asyncio.to_thread(stage_store.start, fields.get("vat_number"), force)
+        financial_task = start_financial_task(fields, stages)
+        try:
+            company_schema = await aget_legal_data(fields, stages)
+            if not company_schema:
+                return None
+            report("legal")
+
+            await asyncio.gather(
+                complete("address", acomplete_address(company_schema.address, stages)),
+                complete("financial", acomplete_financial(company_schema, financial_task)),
+                complete("description", acomplete_schema(company_schema, stages)),
+            )
+        finally:
+            # Not found, or failed: the NBB lookups are not left running unobserved
+            financial_task.cancel()
+        await asyncio.to_thread(stages.save)
+        company_schema.timings = timings.to_dict()
     return company_schema
 
 if __name__ == "__main__":
@@ -32,6 +114,7 @@ if __name__ == "__main__":
         {"vat_number": "0448540668"},
     ]
 
+    # asyncio.run(arun(fields[0]))  # Brico P. I. (asynchronous pipeline)
     # run(fields[0])  # Brico P. I.
     # run(fields[1])  # Ada I. T.
     # run(fields[2])  # ACA IT - SOLUTIONS
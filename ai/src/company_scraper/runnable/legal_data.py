@@ -1,8 +1,17 @@
 from tools.utils import *
 from tools.scraper import CompanyScraper
 from tools.format import *
+from tools.llm import invoke_llm, ainvoke_llm
+from tools.kbo import lookup_kbo
+from tools.geography import get_postal_codes, lookup_postal_code, lookup_postal_area
+from tools.flight import request_flights, get_request_key, dump_schema, load_schema
+from tools.stages import StageRun, fingerprint, content_hash
+from tools.metrics import metrics, in_context
+from tools.tracing import traceable
 from config.config import *
 
+scraper = CompanyScraper()
+
 
 def get_urls_to_scrape(fields: dict, urls: List[str]) -> List[str]:
     """
@@ -20,28 +29,134 @@ def get_urls_to_scrape(fields: dict, urls: List[str]) -> List[str]:
     return final_urls
 
 
-def complete_address(adress_schema: AddressSchema):
+def set_address_data(adress_schema: AddressSchema, address_data: dict):
+    """Update the address schema with the data retrieved from an external source."""
+    # Update address fields with retrieved data, using default values if keys are missing
+    adress_schema.country = address_data.get("country", "")
+    adress_schema.province = address_data.get("province", "")
+    adress_schema.region = address_data.get("region", "")
+    if not adress_schema.city:
+        adress_schema.city = address_data.get("city", "")
+
+    # If the region is still empty, try to determine it based on the postal code
+    if not adress_schema.region and adress_schema.postal_code:
+        region = find_region(adress_schema.postal_code)
+        if region:
+            adress_schema.region = region
+
+
+def get_address_key(adress_schema: AddressSchema) -> str:
+    """Fingerprint of the address completion: the address and the postal codes table."""
+    return fingerprint(adress_schema.full_address, adress_schema.postal_code, get_postal_codes().version)
+
+
+@metrics.timed("stage", stage="address")
+def complete_address(adress_schema: AddressSchema, stages: StageRun = None):
+    """
+    Complete the city, province, region and country of an address.
+
+    :param stages: The stages of the run, the completion of an unchanged address is reused.
+    """
+    if adress_schema:
+        stages = stages or StageRun()
+        key = get_address_key(adress_schema)
+        found, address_data = stages.reuse("address", key)
+        if not found:
+            # Offline postal code table, then the range of the code (the city comes from KBO):
+            # Nominatim is only requested for the foreign or invalid postal codes
+            address_data = lookup_postal_code(adress_schema.postal_code) or lookup_postal_area(
+                adress_schema.postal_code
+            )
+            if not address_data and NOMINATIM_FALLBACK:
+                address_data = get_data_from_address(adress_schema.full_address)
+            if address_data:
+                stages.record("address", key, address_data)
+        set_address_data(adress_schema, address_data or {})
+
+
+@metrics.timed("stage", stage="address")
+async def acomplete_address(adress_schema: AddressSchema, stages: StageRun = None):
+    """Asynchronous version of `complete_address`."""
     if adress_schema:
-        # Retrieve address information from an external source
-        address_data = get_data_from_address(adress_schema.full_address) or {}
+        stages = stages or StageRun()
+        key = get_address_key(adress_schema)
+        found, address_data = stages.reuse("address", key)
+        if not found:
+            address_data = lookup_postal_code(adress_schema.postal_code) or lookup_postal_area(
+                adress_schema.postal_code
+            )
+            if not address_data and NOMINATIM_FALLBACK:
+                address_data = await aget_data_from_address(adress_schema.full_address)
+            if address_data:
+                stages.record("address", key, address_data)
+        set_address_data(adress_schema, address_data or {})
 
-        # Update address fields with retrieved data, using default values if keys are missing
-        adress_schema.country = address_data.get("country", "")
-        adress_schema.province = address_data.get("province", "")
-        adress_schema.region = address_data.get("region", "")
 
-        # If the region is still empty, try to determine it based on the postal code
-        if not adress_schema.region and adress_schema.postal_code:
-            region = find_region(adress_schema.postal_code)
-            if region:
-                adress_schema.region = region
+def set_financial_data(company_schema: CompanySchema, data: list):
+    """Fill the financial part of the schema with the result of `get_size_and_financial_data`."""
+    if not data:
+        return
+    company_schema.financial.company_size = data[0]
+    company_schema.financial.number_of_employees = int(data[1]["employees"])
+    company_schema.financial.gross_margin = int(data[1]["gross margin"])
 
-def complete_financial(company_schema: CompanySchema):
+
+@metrics.timed("stage", stage="financial")
+def get_financial_stage(vat_number: str, stages: StageRun = None) -> list:
+    """
+    Size and financial data of the company (see `get_size_and_financial_data`). The annual
+    account is only read again when a new deposit has been published since the last run.
+    """
+    if not vat_number:
+        return None
+    stages = stages or StageRun()
+    deposit_id = get_latest_deposit_id(vat_number)
+    key = fingerprint(deposit_id)
+    found, data = stages.reuse("financial", key)
+    if not found:
+        data = get_size_and_financial_data(vat_number, deposit_id) if deposit_id else None
+        # A failed lookup is not stored, the next run tries again
+        if deposit_id and data:
+            stages.record("financial", key, data)
+    return data
+
+
+@metrics.timed("stage", stage="financial")
+async def aget_financial_stage(vat_number: str, stages: StageRun = None) -> list:
+    """Asynchronous version of `get_financial_stage`."""
+    if not vat_number:
+        return None
+    stages = stages or StageRun()
+    deposit_id = await aget_latest_deposit_id(vat_number)
+    key = fingerprint(deposit_id)
+    found, data = stages.reuse("financial", key)
+    if not found:
+        data = await aget_size_and_financial_data(vat_number, deposit_id) if deposit_id else None
+        # A failed lookup is not stored, the next run tries again
+        if deposit_id and data:
+            stages.record("financial", key, data)
+    return data
+
+
+def complete_financial(company_schema: CompanySchema, stages: StageRun = None):
     if company_schema:
-        data = get_size_and_financial_data(company_schema.vat_number)
-        company_schema.financial.company_size = data[0]
-        company_schema.financial.number_of_employees = int(data[1]["employees"])
-        company_schema.financial.gross_margin = int(data[1]["gross margin"])
+        data = get_financial_stage(company_schema.vat_number, stages)
+        set_financial_data(company_schema, data)
+
+
+async def acomplete_financial(
+    company_schema: CompanySchema, financial_task: asyncio.Task = None, stages: StageRun = None
+):
+    """
+    Asynchronous version of `complete_financial`.
+
+    :param financial_task: An already started `aget_financial_stage` task, so the NBB
+                           lookups can run while the legal data is still being extracted.
+    """
+    if company_schema:
+        if financial_task is None:
+            financial_task = aget_financial_stage(company_schema.vat_number, stages)
+        set_financial_data(company_schema, await financial_task)
 
 
 def make_llm_ready_content(url: str) -> str:
@@ -52,72 +167,254 @@ def make_llm_ready_content(url: str) -> str:
     :param url: The URL of the web page to retrieve.
     :return: A string containing the cleaned and formatted content in Markdown.
     """
-    scraper = CompanyScraper(AsyncHtmlLoader)
     documents = scraper.run(url)  # Load HTML content from the URL.
+    return format_llm_ready_content(url, documents)
+
 
+def format_llm_ready_content(url: str, documents: list, soup: BeautifulSoup = None) -> str:
+    """
+    Apply the website specific formatting and convert the documents into Markdown.
+
+    :param soup: The already parsed HTML of the first document, if any (may be modified).
+    """
     # Apply the correct formatting function
     if is_company_tracker(url):
-        documents = company_tracker_format(documents)
+        documents = company_tracker_format(documents, soup)
     elif is_kbo(url):
-        documents = kbo_format(documents)
+        documents = kbo_format(documents, soup)
+    elif soup is not None:
+        return soup_to_markdown(soup)
 
     # Convert formatted content to Markdown
     ready_content = convert_html_to_markdown(documents)
-
     return ready_content[0].page_content if ready_content else ""
 
 
-def parallel_execution(urls: List[str]) -> str:
+def load_pages(urls: List[str]) -> List[list]:
     """
     Perform parallel web scraping using multiple threads.
 
     param urls: A list of URLs to scrape.
-    return: A single concatenated string containing the content of all scraped pages.
-    """
-    results = []
-    if len(urls) > 0:
-        max_workers = min(10, len(urls))  # Limit number of workers to 10
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            results = list(
-                executor.map(make_llm_ready_content, urls)
-            )  # Execute load_web_content in parallel
+    return: The documents loaded from each URL, in the same order.
+    """
+    if not urls:
+        return []
+    max_workers = min(10, len(urls))  # Limit number of workers to 10
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(in_context(scraper.run), urls))
+
+
+async def aload_pages(urls: List[str]) -> List[list]:
+    """Fetch all the URLs concurrently on the running event loop."""
+    return list(await asyncio.gather(*(scraper.arun(url) for url in urls)))
+
+
+def parse_pages(pages: List[list]) -> list:
+    """Parse the HTML of each page once, the trees are shared by the following steps."""
+    return [
+        parse_html(documents[0].page_content) if documents and documents[0].page_content else None
+        for documents in pages
+    ]
+
+
+def parse_legal_pages(urls: List[str], soups: list) -> CompanySchema:
+    """
+    Read the legal data directly from the KBO page, without LLM.
+
+    return: The parsed `CompanySchema`, or None if no KBO page could be completely parsed.
+    """
+    for url, soup in zip(urls, soups):
+        if is_kbo(url) and soup is not None:
+            company_schema = parse_kbo(None, soup)
+            if is_complete_legal_data(company_schema):
+                return company_schema
+            logging.info(f"Incomplete KBO data for {url}, falling back to the LLM")
+    return None
+
+
+def format_legal_pages(urls: List[str], pages: List[list], soups: list) -> str:
+    """Merge the Markdown content of all the pages, to be processed by the LLM."""
+    results = [
+        format_llm_ready_content(url, documents, soup)
+        for url, documents, soup in zip(urls, pages, soups)
+    ]
     return "\n\n---\n\n".join(results)  # Merge all extracted contents with separators
 
 
-def extract_company_data(scraped_content: str):
+def read_legal_pages(urls: List[str], pages: List[list]) -> tuple:
+    """
+    Read the legal data from the loaded pages, each page being parsed only once.
+
+    return: (company_schema, None) when the KBO table is complete,
+            otherwise (None, llm_ready_content) to be processed by the LLM.
+    """
+    soups = parse_pages(pages)
+    company_schema = parse_legal_pages(urls, soups)
+    if company_schema:
+        return company_schema, None
+    return None, format_legal_pages(urls, pages, soups)
+
+
+def extract_company_data(scraped_content: str) -> CompanySchema:
     """
     Extract structured company data from raw scraped text using a Language Model (LLM).
 
     param scraped_content: The raw textual content extracted from the web.
-    param llm: The LLM instance (BaseChatModel) used to process and extract structured data.
 
     return: A `CompanySchema` object containing structured company information.
     """
-    # Extract data and complete schema
-    model = LLM.GPT_3_5_TURBO.with_structured_output(CompanySchema)
-    chain =  Prompt.EXTRACT_LEGAL_DATA| model
-    company_schema = chain.invoke({"input": scraped_content})
+    return invoke_llm(
+        Prompt.EXTRACT_LEGAL_DATA,
+        LLM.GPT_3_5_TURBO,
+        {"input": scraped_content},
+        schema=CompanySchema,
+    )
+
+
+async def aextract_company_data(scraped_content: str) -> CompanySchema:
+    """Asynchronous version of `extract_company_data`."""
+    return await ainvoke_llm(
+        Prompt.EXTRACT_LEGAL_DATA,
+        LLM.GPT_3_5_TURBO,
+        {"input": scraped_content},
+        schema=CompanySchema,
+    )
+
+
+def get_legal_key(urls: List[str], pages: List[list]) -> str:
+    """Fingerprint of the legal data extraction: the content of the scraped pages."""
+    return fingerprint(
+        *(
+            (url, content_hash(documents[0].page_content if documents else ""))
+            for url, documents in zip(urls, pages)
+        )
+    )
 
-    # Complexe missing address data
-    complete_address(company_schema.address)
-    complete_financial(company_schema)
+
+def reuse_legal_data(stages: StageRun, key: str) -> tuple:
+    """:return: (found, company_schema) of the previous extraction of the same pages."""
+    found, fragment = stages.reuse("legal", key)
+    return found, CompanySchema.model_validate(fragment) if found and fragment else None
+
+
+@metrics.timed("stage", stage="legal")
+def get_legal_data(fields: dict, stages: StageRun = None) -> CompanySchema:
+    """
+    Read the legal data of the company in the local KBO index, or scrape its sources.
+    The KBO table is parsed directly, the LLM is only used when the parse is incomplete.
+
+    :param stages: The stages of the run, the extraction of unchanged pages is reused.
+    """
+    company_schema = lookup_kbo(fields.get("vat_number"))
+    if is_complete_legal_data(company_schema):
+        return company_schema
+
+    stages = stages or StageRun()
+    scraping_urls = get_urls_to_scrape(fields, URLS)
+    pages = load_pages(scraping_urls)
+    key = get_legal_key(scraping_urls, pages)
+    found, company_schema = reuse_legal_data(stages, key)
+    if found:
+        return company_schema
+
+    company_schema, llm_ready_content = read_legal_pages(scraping_urls, pages)
+    company_schema = company_schema or extract_company_data(llm_ready_content)
+    if company_schema:
+        stages.record("legal", key, company_schema.model_dump())
+    return company_schema
+
+
+@metrics.timed("stage", stage="legal")
+async def aget_legal_data(fields: dict, stages: StageRun = None) -> CompanySchema:
+    """Asynchronous version of `get_legal_data`, parsing is done outside the event loop."""
+    company_schema = lookup_kbo(fields.get("vat_number"))
+    if is_complete_legal_data(company_schema):
+        return company_schema
+
+    stages = stages or StageRun()
+    scraping_urls = get_urls_to_scrape(fields, URLS)
+    pages = await aload_pages(scraping_urls)
+    key = get_legal_key(scraping_urls, pages)
+    found, company_schema = reuse_legal_data(stages, key)
+    if found:
+        return company_schema
+
+    company_schema, llm_ready_content = await asyncio.to_thread(
+        read_legal_pages, scraping_urls, pages
+    )
+    company_schema = company_schema or await aextract_company_data(llm_ready_content)
+    if company_schema:
+        stages.record("legal", key, company_schema.model_dump())
     return company_schema
 
 
 @traceable
-def get_company_schema(fields) -> CompanySchema:
+def get_company_schema(fields, stages: StageRun = None) -> CompanySchema:
     """
     Retrieves and processes company data based on given input fields -> vat_number.
 
     :param fields (dict): A dictionary containing necessary input values,
                        such as a VAT number or additional parameters.
+    :param stages: The stages of the run, the unchanged ones are skipped.
 
     :return dict or None: A structured company schema if data is successfully extracted,
                       otherwise `None`.
     """
-    scraping_urls = get_urls_to_scrape(fields, URLS)
-    llm_ready_content = parallel_execution(scraping_urls)
-    company_schema = extract_company_data(llm_ready_content)
+    return request_flights.do(
+        "company_schema",
+        get_request_key(fields, stages.force if stages else False),
+        lambda: build_company_schema(fields, stages),
+        dump_schema,
+        load_schema,
+    )
+
+
+def build_company_schema(fields, stages: StageRun = None) -> CompanySchema:
+    company_schema = get_legal_data(fields, stages)
     if not company_schema:
         return None
+
+    # Complete missing address and financial data
+    complete_address(company_schema.address, stages)
+    complete_financial(company_schema, stages)
+    return company_schema
+
+
+def start_financial_task(fields: dict, stages: StageRun = None) -> asyncio.Task:
+    """Start the NBB lookups as soon as the VAT number is known."""
+    vat_number = fields.get("vat_number")
+    return asyncio.create_task(aget_financial_stage(vat_number, stages))
+
+
+@traceable
+async def aget_company_schema(fields, stages: StageRun = None) -> CompanySchema:
+    """Asynchronous version of `get_company_schema`."""
+    return await request_flights.ado(
+        "company_schema",
+        get_request_key(fields, stages.force if stages else False),
+        lambda: abuild_company_schema(fields, stages),
+        dump_schema,
+        load_schema,
+    )
+
+
+async def abuild_company_schema(fields, stages: StageRun = None) -> CompanySchema:
+    """
+    Asynchronous version of `build_company_schema`.
+    The financial data is fetched while the legal data is scraped and extracted,
+    then the address and financial data are completed concurrently.
+    """
+    financial_task = start_financial_task(fields, stages)
+    try:
+        company_schema = await aget_legal_data(fields, stages)
+        if not company_schema:
+            return None
+
+        await asyncio.gather(
+            acomplete_address(company_schema.address, stages),
+            acomplete_financial(company_schema, financial_task),
+        )
+    finally:
+        # Not found, or failed: the NBB lookups are not left running unobserved
+        financial_task.cancel()
     return company_schema
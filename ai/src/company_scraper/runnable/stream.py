@@ -0,0 +1,156 @@
+from runnable.company_scraper import aenrich
+from tools.stages import stage_listener, track_stages
+from config.config import *
+from typing import AsyncIterator, Callable
+import argparse, json, sys
+
+
+def get_patch(company_schema: CompanySchema, stage: str) -> dict:
+    """The fields of the company schema set by a stage, as a JSON serializable partial schema."""
+    if stage == "legal":
+        return company_schema.model_dump(mode="json")
+    if stage == "address":
+        return {"address": company_schema.address.model_dump(mode="json")}
+    if stage == "financial":
+        return {"financial": company_schema.financial.model_dump(mode="json")}
+    if stage == "website":
+        return {"contact": {"website": company_schema.contact.website}}
+    activities = company_schema.activities
+    return {
+        "activities": {
+            "company_description": activities.company_description,
+            "sectors": activities.sectors,
+            "services": activities.services,
+        }
+    }
+
+
+def get_fragment_patch(stage: str, fragment) -> dict:
+    """The partial schema of a website or description stage fragment, None when it found nothing."""
+    if not fragment:
+        return None
+    if stage == "website":
+        return {"contact": {"website": fragment["url"]}} if fragment.get("url") else None
+    return {
+        "activities": {
+            "company_description": fragment["description"],
+            "sectors": fragment["sectors"],
+            "services": fragment["services"],
+        }
+    }
+
+
+def merge_patch(data: dict, patch: dict) -> dict:
+    """Apply a patch to a partial schema (in place), the nested models are merged."""
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            merge_patch(data[key], value)
+        else:
+            data[key] = value
+    return data
+
+
+async def aenrich_progressive(
+    fields: dict, emit: Callable[[str, dict], None], force: bool = False
+) -> CompanySchema:
+    """
+    `aenrich` reporting the fields of the company as each stage completes: `emit(stage, patch)`
+    is called with the legal data first, then with the address (region), the financial data,
+    the website and the description, in completion order. The website is emitted as soon as
+    it is found, before its description by the LLM.
+    The run is not shared with concurrent requests (see `arun`), their stages are not observable.
+
+    :param emit: Function called once by stage which set fields, in the event loop.
+    :param force: Recompute every stage, or only the given stages (see `STAGES`).
+    :return CompanySchema: The complete schema, None when the company is not found.
+    """
+    loop = asyncio.get_running_loop()
+    previous_listener = stage_listener.get()
+    sent = set()
+
+    def send(stage: str, patch: dict):
+        if patch and stage not in sent:
+            sent.add(stage)
+            emit(stage, patch)
+
+    def on_fragment(stage: str, reused: bool, fragment):
+        if previous_listener is not None:
+            previous_listener(stage, reused, fragment)
+        if stage in ("website", "description"):
+            loop.call_soon_threadsafe(send, stage, get_fragment_patch(stage, fragment))
+
+    def on_stage(stage: str, company_schema: CompanySchema):
+        if stage != "description":
+            send(stage, get_patch(company_schema, stage))
+            return
+        # Description shared with a concurrent run: its stages were not notified here
+        if company_schema.contact.website:
+            send("website", get_patch(company_schema, "website"))
+        if company_schema.activities.company_description:
+            send("description", get_patch(company_schema, "description"))
+
+    with track_stages(on_fragment):
+        return await aenrich(fields, force, on_stage)
+
+
+async def astream(fields: dict, force: bool = False) -> AsyncIterator[dict]:
+    """
+    Enrich a company and yield its fields as each stage completes, see `aenrich_progressive`.
+    The events are {"event": "patch", "stage": ..., "data": partial schema}, then either
+    {"event": "done", "data": complete schema, "timings": ...} or {"event": "error", "data": {"message": ...}}
+    when the company is not found. The errors of the pipeline are raised.
+    """
+    events = asyncio.Queue()
+
+    def emit(stage: str, patch: dict):
+        events.put_nowait({"event": "patch", "stage": stage, "data": patch})
+
+    task = asyncio.create_task(aenrich_progressive(fields, emit, force))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        company_schema = task.result()
+    finally:
+        task.cancel()
+
+    if company_schema is None:
+        yield {"event": "error", "data": {"message": f"No company found for {fields.get('vat_number')}"}}
+    else:
+        yield {"event": "done", "data": company_schema.model_dump(mode="json"), "timings": company_schema.timings}
+
+
+def format_sse(event: dict, event_id: int = None) -> str:
+    """Format an event of `astream` as a server-sent event, its payload is the JSON data line."""
+    payload = {key: value for key, value in event.items() if key != "event"}
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event['event']}", f"data: {json.dumps(payload, ensure_ascii=False)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def astream_sse(fields: dict, force: bool = False) -> AsyncIterator[str]:
+    """
+    `astream` as a server-sent event stream, e.g. the body of a "text/event-stream" response.
+    An error of the pipeline ends the stream with an "error" event.
+    """
+    event_id = 0
+    try:
+        async for event in astream(fields, force):
+            yield format_sse(event, event_id)
+            event_id += 1
+    except Exception as e:
+        logging.error(f"Enrichment of {fields.get('vat_number')} failed: {e}")
+        yield format_sse({"event": "error", "data": {"message": str(e) or type(e).__name__}}, event_id)
+
+
+async def print_stream(vat_number: str):
+    async for chunk in astream_sse({"vat_number": vat_number}):
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich a company and print its fields as server-sent events.")
+    parser.add_argument("vat_number")
+    args = parser.parse_args()
+    asyncio.run(print_stream(args.vat_number))
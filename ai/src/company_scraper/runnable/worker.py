@@ -0,0 +1,161 @@
+from runnable.company_scraper import arun
+from runnable.batch import read_vat_numbers
+from tools.jobs import JobQueue, get_job_queue
+from tools.stages import track_stages
+from config.config import *
+import argparse, json, sys, time
+
+
+async def enrich_job(job: dict) -> dict:
+    """Run the pipeline on the request of a job, return the JSON serializable company schema."""
+    company_schema = await arun(job["fields"], force=job["stages"] or False)
+    return company_schema.model_dump(mode="json") if company_schema else None
+
+
+class WorkerPool:
+    """
+    Async workers consuming the job queue, so that the web tier only submits jobs and polls them.
+    Each job runs under its deadline, the completed stages are written back while it runs,
+    and a failed job is queued again after a backoff.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue = None,
+        workers: int = JOB_WORKERS,
+        lanes=None,
+        handler=enrich_job,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        heartbeat: float = JOB_HEARTBEAT,
+    ):
+        """
+        :param queue: The job queue, the process-wide one (`JOBS_URL`) by default.
+        :param workers: The number of jobs processed at the same time.
+        :param lanes: The lanes served by these workers, by priority, every lane by default.
+        :param handler: Coroutine function computing the result of a job.
+        :param heartbeat: Interval (seconds) of the lease renewals of the running jobs.
+        """
+        self._queue = queue
+        self.workers = workers
+        self.lanes = lanes
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+
+    @property
+    def queue(self) -> JobQueue:
+        return self._queue or get_job_queue()
+
+    async def run(self, stop: asyncio.Event = None, drain: bool = False):
+        """
+        Run the workers until `stop` is set.
+
+        :param drain: Stop once no job is queued nor running anymore.
+        """
+        stop = stop or asyncio.Event()
+        tasks = [asyncio.create_task(self.work(stop, drain)) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def work(self, stop: asyncio.Event, drain: bool):
+        failures = 0
+        while not stop.is_set():
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.lanes)
+                if job is not None:
+                    await self.process(job)
+                    failures = 0
+                    continue
+                await asyncio.to_thread(self.queue.recover)
+                if drain and not await asyncio.to_thread(self.queue.pending, self.lanes):
+                    return
+                failures = 0
+                delay = self.poll_interval
+            except Exception as e:
+                # The queue is unavailable: this worker backs off, the others keep running.
+                # A job whose outcome could not be written is queued again when its lease expires.
+                failures += 1
+                delay = min(self.poll_interval * 2 ** failures, JOB_MAX_BACKOFF)
+                logging.error(f"Job queue error, retrying in {delay:.1f}s: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process(self, job: dict):
+        """Run a job and write its outcome: done, retried, failed or expired."""
+        loop = asyncio.get_running_loop()
+        changed, finished = asyncio.Event(), asyncio.Event()
+
+        def on_stage(stage: str, reused: bool, fragment):
+            job["progress"][stage] = "reused" if reused else "done"
+            loop.call_soon_threadsafe(changed.set)
+
+        renewals = asyncio.create_task(self.renew(job, changed, finished))
+        error = result = None
+        status = "done"
+        try:
+            with track_stages(on_stage):
+                result = await asyncio.wait_for(self.handler(job), timeout=max(0.0, job["deadline"] - time.time()))
+        except asyncio.TimeoutError:
+            status, error = "expired", "Deadline exceeded"
+        except Exception as e:
+            status, error = "failed", str(e) or type(e).__name__
+            logging.error(f"Job {job['id']} failed (attempt {job['attempts']}): {error}")
+        finally:
+            # The last renewal is written before the outcome, never after it
+            finished.set()
+            changed.set()
+            await renewals
+
+        if status == "done":
+            await asyncio.to_thread(self.queue.complete, job, result)
+        elif status == "expired":
+            await asyncio.to_thread(self.queue.finish, job, status, error)
+        else:
+            await asyncio.to_thread(self.queue.fail, job, error)
+
+    async def renew(self, job: dict, changed: asyncio.Event, finished: asyncio.Event):
+        """Write the progress of the job as it changes, and renew its lease meanwhile."""
+        while True:
+            try:
+                await asyncio.wait_for(changed.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+            changed.clear()
+            if finished.is_set():
+                return
+            snapshot = {**job, "progress": dict(job["progress"])}
+            try:
+                await asyncio.to_thread(self.queue.renew, snapshot)
+            except Exception as e:
+                logging.warning(f"Progress of job {job['id']} not written: {e}")
+
+
+async def serve(queue: JobQueue, workers: int, lanes, drain: bool):
+    await WorkerPool(queue, workers, lanes).run(drain=drain)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the enrichment workers of the job queue.")
+    parser.add_argument("-w", "--workers", type=int, default=JOB_WORKERS)
+    parser.add_argument("--lanes", default=",".join(JOB_LANES), help="Lanes served, by priority")
+    parser.add_argument("--enqueue", help="Submit the VAT numbers of a file first ('-' for stdin)")
+    parser.add_argument("--lane", default="batch", help="Lane of the submitted jobs")
+    parser.add_argument("--drain", action="store_true", help="Stop once the queue is empty")
+    args = parser.parse_args()
+
+    queue = get_job_queue()
+    job_ids = []
+    if args.enqueue:
+        job_ids = [queue.submit({"vat_number": vat_number}, lane=args.lane) for vat_number in read_vat_numbers(args.enqueue)]
+    asyncio.run(serve(queue, args.workers, args.lanes.split(","), args.drain))
+
+    # With the in-process queue, the results are only available here
+    for job_id in job_ids if args.drain else []:
+        job = queue.get(job_id)
+        sys.stdout.write(json.dumps({key: job[key] for key in ("id", "status", "error", "result")}) + "\n")
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
 from enum import Enum
 import re
 
@@ -74,6 +74,18 @@ class CompanySchema(BaseModel):
     financial: FinancialSchema = Field(..., description="Financial details")
     contact: ContactSchema = Field(..., description="Contact informations")
 
+    # Timing breakdown of the run which produced the schema, not part of the output
+    _timings: dict = PrivateAttr(default_factory=dict)
+
+    @property
+    def timings(self) -> dict:
+        """Duration of the run and of each of its steps (see `tools.metrics.RunTimings`)."""
+        return self._timings
+
+    @timings.setter
+    def timings(self, value: dict):
+        self._timings = value
+
     @field_validator("vat_number", mode="before")
     @classmethod
     def format_vat_number(cls, value: str) -> str:
@@ -0,0 +1,73 @@
+import unittest, os, tempfile
+from tools.aggregators import *
+from tools.format import is_aggregator, remove_aggregators_url
+
+
+class TestDomainIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DomainIndex(["kompass.com", "www.pagesdor.be", "https://business.google.com/", "co.uk", "be"])
+
+    # Les sous-domaines d'un agrégateur sont aussi filtrés
+    def test_subdomains(self):
+        self.assertIn("be.kompass.com", self.index)
+        self.assertIn("www.kompass.com", self.index)
+        self.assertIn("pagesdor.be", self.index)
+        self.assertIn("fr.business.google.com", self.index)
+        self.assertNotIn("google.com", self.index)
+        self.assertNotIn("notkompass.com", self.index)
+        self.assertNotIn("", self.index)
+
+    # Un suffixe public bloquerait tous les domaines enregistrés sous lui
+    def test_public_suffixes_are_rejected(self):
+        self.assertEqual(self.index.domains, {"kompass.com", "pagesdor.be", "business.google.com"})
+        self.assertNotIn("www.brico.co.uk", self.index)
+
+    def test_load_versioned_file(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "aggregators.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("# version: 2025.2\n# Annuaires\ncylex.be\n\n")
+            file.writelines(f"annuaire-{i}.be\n" for i in range(50000))
+        index = DomainIndex()
+        index.load(path)
+        self.assertEqual(index.version, "2025.2")
+        self.assertEqual(len(index), 50001)
+        self.assertIn("www.annuaire-49999.be", index)
+
+        # Sans en-tête, la version suit le contenu de la liste
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("cylex.be\n")
+        first = DomainIndex()
+        first.load(path)
+        second = DomainIndex()
+        second.load(path)
+        self.assertEqual(first.version, second.version)
+
+    def test_bundled_file(self):
+        self.assertIn("companyweb.be", get_aggregators())
+        self.assertTrue(get_aggregators().version)
+
+
+class TestIsAggregator(unittest.TestCase):
+
+    def test_is_aggregator(self):
+        self.assertTrue(is_aggregator("https://be.kompass.com/c/brico/be123/", "0423369762", "Brico"))
+        self.assertTrue(is_aggregator("https://www.companyweb.be/fr/0423369762", "0423369762", "Brico"))
+        self.assertTrue(is_aggregator("https://annuaire.be/entreprise/0423.369.762", "0423369762", "Brico"))
+        self.assertTrue(is_aggregator("https://annuaire.be/brico-plan-it", "0423369762", "Brico Plan-It"))
+        self.assertFalse(is_aggregator("https://www.brico-planit.be/fr", "0423369762", "Brico Plan-It"))
+        self.assertFalse(is_aggregator("", "0423369762", "Brico"))
+
+    # Un nom sans caractère alphanumérique ne filtre pas toutes les URLs
+    def test_name_without_alphanumeric_characters(self):
+        self.assertFalse(is_aggregator("https://www.brico.be/contact", "0423369762", "&"))
+        self.assertFalse(is_aggregator("https://www.brico.be/contact", None, None))
+
+    def test_remove_aggregators_url(self):
+        urls = ["https://www.brico-planit.be/", "https://fr.trustpilot.com/review/brico-planit.be"]
+        self.assertEqual(remove_aggregators_url(urls, "0423369762", "Brico Plan-It"), urls[:1])
+
+
+if __name__ == "__main__":
+    unittest.main()
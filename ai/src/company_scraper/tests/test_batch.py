@@ -0,0 +1,78 @@
+import unittest, os, tempfile, time
+from unittest.mock import patch
+from runnable.batch import *
+
+
+# Enrichissement simulé, sans appel réseau
+async def fake_arun(fields: dict):
+    if fields["vat_number"] == "0000000000":
+        raise ValueError("lookup failed")
+    if fields["vat_number"] == "1111111111":
+        return None  # Entreprise introuvable
+    return CompanySchema(
+        vat_number=fields["vat_number"],
+        address=AddressSchema(),
+        activities=ActivitiesSchema(),
+        financial=FinancialSchema(),
+        contact=ContactSchema(),
+    )
+
+
+async def collect(*args, **kwargs):
+    return [company.vat_number async for company in run_batch(*args, **kwargs)]
+
+
+@patch("runnable.batch.arun", fake_arun)
+class TestRunBatch(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), "checkpoint.txt")
+
+    # Les numéros de TVA sont nettoyés et les doublons ignorés
+    async def test_read_and_deduplicate(self):
+        vat_numbers = ["BE 0423.369.762", "0423369762", "", "1004905845"]
+        result = await collect(vat_numbers, concurrency=2)
+        self.assertCountEqual(result, ["0423369762", "1004905845"])
+
+    # Une erreur sur une entreprise n'arrête pas le batch
+    async def test_failure_is_not_checkpointed(self):
+        result = await collect(["0000000000", "0423369762"], checkpoint=self.checkpoint)
+        self.assertEqual(result, ["0423369762"])
+        self.assertNotIn("0000000000", Checkpoint(self.checkpoint))
+
+    # Une entreprise introuvable sera recherchée à nouveau par le batch suivant
+    async def test_not_found_is_not_checkpointed(self):
+        result = await collect(["1111111111", "0423369762"], checkpoint=self.checkpoint)
+        self.assertEqual(result, ["0423369762"])
+        self.assertNotIn("1111111111", Checkpoint(self.checkpoint))
+
+    # Un fichier d'entrée introuvable termine le batch par une erreur, sans le bloquer
+    async def test_missing_input(self):
+        with self.assertRaises(FileNotFoundError):
+            await asyncio.wait_for(collect(os.path.join(tempfile.mkdtemp(), "missing.txt"), concurrency=2), 3)
+
+    # Une entrée lente ne bloque pas les entreprises déjà lues
+    async def test_slow_input(self):
+        def slow_input():
+            yield "0423369762"
+            time.sleep(0.3)  # En attente de la ligne suivante, par exemple sur stdin
+            yield "1004905845"
+
+        start = time.monotonic()
+        delays = []
+        async for company in run_batch(slow_input(), concurrency=2):
+            delays.append(time.monotonic() - start)
+        self.assertEqual(len(delays), 2)
+        self.assertLess(delays[0], 0.2)
+
+    # Un batch relancé reprend là où il s'est arrêté
+    async def test_resume_from_checkpoint(self):
+        await collect(["0423369762"], checkpoint=self.checkpoint)
+        result = await collect(
+            ["0423369762", "1004905845"], checkpoint=self.checkpoint
+        )
+        self.assertEqual(result, ["1004905845"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest, json, re, threading
+import httpx
+import pandas as pd
+from tools.cbso import *
+from tools.cache import HttpCache, MemoryCache
+from tools.hosts import HostLimits
+from tests.test_financial import DEPOSITS, ACCOUNTS
+from tests.test_scraper import ThreadCache
+
+
+class TestCbsoClient(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.rejected = set()
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            url = str(request.url)
+            self.requests.append(url)
+            if "published-deposits" in url:
+                vat = re.search(r"enterpriseNumber=(\d+)", url).group(1)
+                page = int(re.search(r"page=(\d+)", url).group(1))
+                deposits = DEPOSITS[vat]
+                total_pages = -(-len(deposits) // 2)
+                content = {"content": deposits[page * 2:page * 2 + 2], "totalPages": total_pages, "last": page + 1 >= total_pages}
+                return httpx.Response(200, json=content)
+            deposit_id = url.rsplit("/", 1)[1]
+            # Première demande de chaque compte refusée par la limite de débit
+            if deposit_id not in self.rejected:
+                self.rejected.add(deposit_id)
+                return httpx.Response(429, headers={"Retry-After": "0"})
+            return httpx.Response(200, text=ACCOUNTS[deposit_id], headers={"content-type": "text/csv"})
+
+        self.client = CbsoClient(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache()),
+            concurrency=2,
+            backoff=0,
+            limits=HostLimits(rates={}, default_rate=None),  # Sans limite de débit, les 429 ralentiraient les tests
+        )
+
+    # Les comptes sont relus après un 429, les dépôts de toutes les pages sont chargés
+    def test_backfill(self):
+        history = asyncio.run(self.client.abackfill(["0423369762", "0738512604"]))
+        self.assertEqual(len(history.accounts), 4)
+        self.assertEqual(self.client.stats["retries"], 4)
+        ratios = history.ratios()
+        self.assertEqual(ratios.loc[("0738512604", pd.Timestamp("2023-12-31")), "gross_margin"], 150000)
+        self.assertAlmostEqual(ratios.loc[("0423369762", pd.Timestamp("2023-12-31")), "revenue_growth"], 0.2)
+
+    # Le cache HTTP est lu et écrit hors de la boucle d'événements
+    def test_cache_access_in_thread(self):
+        backend = ThreadCache()
+        self.client.cache = HttpCache(backend)
+
+        async def backfill():
+            history = await self.client.abackfill(["0738512604"])
+            return history, threading.get_ident()
+
+        history, loop_thread = asyncio.run(backfill())
+        self.assertTrue(history.accounts)
+        self.assertTrue(backend.threads)
+        self.assertNotIn(loop_thread, backend.threads)
+
+    # La page suivante n'est pas demandée quand les périodes sont trop anciennes
+    def test_lazy_pagination(self):
+        async def collect():
+            return [deposit["id"] async for deposit in self.client.aiter_deposits("0423369762", "2023-01-01", page_size=2)]
+
+        self.assertEqual(asyncio.run(collect()), ["a2023"])
+        self.assertEqual(len([url for url in self.requests if "published-deposits" in url]), 1)
+
+    # Abandon après le nombre maximal de tentatives
+    def test_give_up(self):
+        self.client.max_retries = 0
+        with self.assertRaises(CbsoError):
+            asyncio.run(self.client.aget_account("a2023"))
+        self.assertEqual(self.client.stats["failures"], 1)
+
+    # Une entreprise dont un compte n'a pas pu être lu est signalée, sans compte partiel
+    def test_failed_company(self):
+        self.client.max_retries = 0
+        history = asyncio.run(self.client.abackfill(["0423369762"]))
+        self.assertEqual(history.failed, ["0423369762"])
+        self.assertEqual(history.accounts, [])
+
+    # Circuit ouvert par des 503 : le backfill attend la fin du délai au lieu d'abandonner
+    def test_open_circuit_is_awaited(self):
+        statuses = [503, 503]
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(str(request.url))
+            if statuses:
+                return httpx.Response(statuses.pop())
+            return httpx.Response(200, text=ACCOUNTS["a2023"], headers={"content-type": "text/csv"})
+
+        client = CbsoClient(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache()),
+            backoff=0,
+            limits=HostLimits(rates={}, default_rate=None, thresholds={}, default_threshold=1, cooldown=0.05),
+        )
+        model, rubrics, values = asyncio.run(client.aget_account("a2023"))
+        self.assertTrue(rubrics)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(client.stats["failures"], 0)
+
+    # Retry-After en secondes ou en date HTTP
+    def test_retry_after(self):
+        self.assertEqual(get_retry_after(httpx.Response(429, headers={"Retry-After": "3"})), 3)
+        date = httpx.Response(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        self.assertEqual(get_retry_after(date), 0)
+        self.assertIsNone(get_retry_after(httpx.Response(429)))
+        self.assertGreaterEqual(self.client.get_delay(0, 2), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest, json
+from unittest.mock import patch
+from tools.document import Document
+from tools.financial import *
+
+
+def make_account(model: str, **rubrics) -> str:
+    rows = [f'"Model code","{model}"', '"Reference","2024-00001"']
+    rows += [f'"{code.replace("_", "/")}","{value}"' for code, value in rubrics.items()]
+    return "\n".join(rows)
+
+
+# Deux entreprises : un modèle complet sur trois ans et un modèle abrégé avec un dépôt corrigé
+DEPOSITS = {
+    "0423369762": [
+        {"id": "a2023", "periodEndDate": "2023-12-31", "depositDate": "2024-07-01", "importFileType": "XBRL"},
+        {"id": "a2022", "periodEndDate": "2022-12-31", "depositDate": "2023-07-01", "importFileType": "XBRL"},
+        {"id": "a2021", "periodEndDate": "2021-12-31", "depositDate": "2022-07-01", "importFileType": "XBRL"},
+        {"id": "a2020", "periodEndDate": "2020-12-31", "depositDate": "2021-07-01", "importFileType": "PDF"},
+    ],
+    "0738512604": [
+        {"id": "b2023-fix", "periodEndDate": "2023-12-31", "depositDate": "2024-09-01", "importFileType": "XBRL"},
+        {"id": "b2023", "periodEndDate": "2023-12-31", "depositDate": "2024-06-01", "importFileType": "XBRL"},
+    ],
+}
+ACCOUNTS = {
+    "a2023": make_account("m02-f", **{"70": "1200000", "74": "0", "60": "600000", "61": "200000", "10_15": "500000", "10_49": "1000000", "1003": "12,5"}),
+    "a2022": make_account("m02-f", **{"70": "1000000", "60": "500000", "61": "150000", "10_15": "400000", "10_49": "1000000", "1003": "10"}),
+    "a2021": make_account("m02-f", **{"70": "800000", "60": "400000", "61": "100000", "10_15": "300000", "10_49": "900000", "1003": "9"}),
+    "b2023-fix": make_account("m81-f", **{"9900": "150000", "10_15": "50000", "10_49": "200000", "9087": "3"}),
+    "b2023": make_account("m81-f", **{"9900": "999999"}),
+}
+
+
+class FakeScraper:
+    """Répond aux URLs du CBSO, les dépôts étant servis par pages de 2."""
+
+    def __init__(self):
+        self.urls = []
+
+    def run(self, url: str):
+        self.urls.append(url)
+        if "published-deposits" in url:
+            vat = re.search(r"enterpriseNumber=(\d+)", url).group(1)
+            page = int(re.search(r"page=(\d+)", url).group(1))
+            deposits = DEPOSITS[vat]
+            total_pages = -(-len(deposits) // 2)
+            content = {"content": deposits[page * 2:page * 2 + 2], "totalPages": total_pages, "last": page + 1 >= total_pages}
+            return [Document(json.dumps(content))]
+        return [Document(ACCOUNTS[url.rsplit("/", 1)[1]])]
+
+
+class TestFinancialHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.scraper = FakeScraper()
+        patcher = patch("tools.financial.scraper", self.scraper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Toutes les pages de dépôts sont parcourues, PDF et dépôts corrigés exclus
+    def test_deposits(self):
+        self.assertEqual(len(get_all_deposits("0423369762", page_size=2)), 4)
+        selected = select_deposits(DEPOSITS["0738512604"] + DEPOSITS["0423369762"])
+        self.assertEqual([deposit["id"] for deposit in selected], ["b2023-fix", "a2022", "a2021"])
+
+    # Les ratios de toutes les entreprises sont calculés ensemble
+    def test_ratios(self):
+        history = load_financial_history(["0423369762", "0738512604"], max_workers=2)
+        self.assertEqual(len(history.accounts), 4)
+        ratios = history.ratios()
+
+        full = ratios.loc["0423369762"]
+        self.assertEqual(list(full.index.year), [2021, 2022, 2023])
+        self.assertAlmostEqual(full["revenue_growth"].iloc[2], 0.2)
+        self.assertEqual(full["gross_margin"].iloc[2], 400000)
+        self.assertAlmostEqual(full["gross_margin_rate"].iloc[1], 0.35)
+        self.assertAlmostEqual(full["solvency"].iloc[2], 0.5)
+        self.assertEqual(list(full["employees_trend"].iloc[1:]), [1, 2.5])
+        self.assertTrue(np.isnan(full["revenue_growth"].iloc[0]))
+
+        abbreviated = ratios.loc["0738512604"].iloc[0]
+        self.assertEqual((abbreviated["gross_margin"], abbreviated["employees"]), (150000, 3))
+        self.assertTrue(np.isnan(abbreviated["revenue_growth"]))
+
+    # Historique vide
+    def test_empty(self):
+        self.assertTrue(FinancialHistory().ratios().empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
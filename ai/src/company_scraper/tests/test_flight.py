@@ -0,0 +1,189 @@
+import unittest, asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from tools.flight import *
+from schema.company_schema import *
+
+
+class FakeLock:
+    def __init__(self, redis, name: str):
+        self.redis, self.name = redis, name
+
+    def acquire(self, blocking=True):
+        with self.redis.mutex:
+            if self.name in self.redis.locks:
+                return False
+            self.redis.locks.add(self.name)
+            return True
+
+    def release(self):
+        with self.redis.mutex:
+            self.redis.locks.discard(self.name)
+
+
+class FakeRedis:
+    """Redis factice partagé par plusieurs `RequestFlights`, comme entre deux processus."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.values = {}
+        self.locks = set()
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value, ex=None):
+        self.values[key] = value
+
+    def lock(self, name: str, timeout=None):
+        return FakeLock(self, name)
+
+
+class BrokenRedis(FakeRedis):
+    def get(self, key: str):
+        raise ConnectionError("Connection refused")
+
+
+class TestRequestFlights(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        time.sleep(0.05)
+        return CompanySchema(
+            name="Brico",
+            vat_number="0423369762",
+            address=AddressSchema(),
+            activities=ActivitiesSchema(),
+            financial=FinancialSchema(),
+            contact=ContactSchema(),
+        )
+
+    # Les demandes simultanées du même numéro de TVA partagent un seul calcul
+    def test_threads_are_coalesced(self):
+        flights = RequestFlights(url="")
+        key = get_request_key({"vat_number": "0423369762"})
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: flights.do("run", key, self.compute), range(5)))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({result.name for result in results}, {"Brico"})
+        # Chaque appelant reçoit sa propre copie
+        self.assertEqual(len({id(result) for result in results}), 5)
+        self.assertEqual(flights.stats["run"], {"computed": 1, "coalesced": 4})
+
+    def test_async_calls_are_coalesced(self):
+        flights = RequestFlights(url="")
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return self.compute()
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("run", "key", compute) for _ in range(3)))
+
+        self.assertEqual(len(asyncio.run(main())), 3)
+        self.assertEqual(self.calls, 1)
+
+    # Un appelant qui modifie le résultat partagé ne change pas celui des autres
+    def test_shared_result_is_copied(self):
+        flights = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            return self.compute()
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("key", compute) for _ in range(3)))
+
+        results = asyncio.run(main())
+        self.assertEqual([shared for _, shared in results], [False, True, True])
+        results[0][0].name = "Brico Plan-It"
+        self.assertEqual([result.name for result, _ in results[1:]], ["Brico", "Brico"])
+        self.assertEqual(len({id(result) for result, _ in results}), 3)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: flights.do("key", lambda: time.sleep(0.05) or self.compute()), range(3)))
+        self.assertEqual(len({id(result) for result, _ in results}), 3)
+
+    # Le calcul partagé continue tant qu'un appelant l'attend, il est annulé avec le dernier
+    def test_cancelled_callers(self):
+        flights = SingleFlight()
+        states = []
+
+        async def compute():
+            try:
+                await asyncio.sleep(0.1)
+                states.append("done")
+                return "Brico"
+            except asyncio.CancelledError:
+                states.append("cancelled")
+                raise
+
+        async def main():
+            first = asyncio.create_task(flights.ado("key", compute))
+            second = asyncio.create_task(flights.ado("key", compute))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            self.assertEqual(await second, ("Brico", True))
+
+            callers = [asyncio.create_task(flights.ado("key", compute)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0.01)
+            # Un nouvel appel relance le calcul
+            self.assertEqual(await flights.ado("key", compute), ("Brico", False))
+
+        asyncio.run(main())
+        self.assertEqual(states, ["done", "cancelled", "done"])
+
+    # Le résultat publié par un autre processus est réutilisé
+    def test_remote_result(self):
+        redis = FakeRedis()
+        workers = [
+            RequestFlights(remote=RedisFlight("", poll_interval=0.01, client=redis)) for _ in range(2)
+        ]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(flights.do, "run", "key", self.compute, dump_schema, load_schema)
+                for flights in workers
+            ]
+            results = [future.result() for future in futures]
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(sum(flights.stats["run"]["remote"] for flights in workers), 1)
+        self.assertFalse(redis.locks)
+
+    # Sans Redis, le calcul est fait localement
+    def test_unavailable_redis(self):
+        flights = RequestFlights(remote=RedisFlight("", client=BrokenRedis()))
+        self.assertEqual(flights.do("run", "key", self.compute).name, "Brico")
+        self.assertEqual(self.calls, 1)
+
+    # Le format du numéro de TVA ne change pas la clé, sans numéro pas de regroupement
+    def test_request_key(self):
+        self.assertEqual(
+            get_request_key({"vat_number": "BE 0423.369.762"}), get_request_key({"vat_number": "0423369762"})
+        )
+        self.assertNotEqual(
+            get_request_key({"vat_number": "0423369762"}), get_request_key({"vat_number": "0439340516"})
+        )
+        self.assertIsNone(get_request_key({}))
+
+    # Un rafraîchissement forcé ne rejoint pas une demande normale en cours
+    def test_forced_request_key(self):
+        fields = {"vat_number": "0423369762"}
+        key = get_request_key(fields)
+        self.assertEqual(get_request_key(fields, False), key)
+        self.assertNotEqual(get_request_key(fields, True), key)
+        self.assertNotEqual(get_request_key(fields, ["website"]), key)
+        self.assertNotEqual(get_request_key(fields, ["website"]), get_request_key(fields, True))
+        self.assertEqual(
+            get_request_key(fields, ["website", "financial"]), get_request_key(fields, ("financial", "website"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest, os
+from unittest.mock import patch
+from tools.utils import *
+from tools.format import *
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+class TestParseKbo(unittest.TestCase):
+
+    def setUp(self):
+        self.company = parse_kbo(read_fixture("kbo_0423369762.html"))
+
+    # Les données légales sont lues directement dans le tableau KBO
+    def test_legal_data(self):
+        self.assertEqual(self.company.name, "Brico Plan-It")
+        self.assertEqual(self.company.vat_number, "0423369762")
+        self.assertEqual(self.company.legal_form, "Société anonyme")
+        self.assertEqual(self.company.established, "29 juin 1983")
+        self.assertEqual(self.company.company_type, ["Personne morale"])
+        self.assertTrue(self.company.is_company)
+        self.assertTrue(is_complete_legal_data(self.company))
+
+    # L'adresse est découpée en rue, numéro, code postal et ville
+    def test_address(self):
+        address = self.company.address
+        self.assertEqual(address.street, "Boulevard du Souverain")
+        self.assertEqual(address.street_number, "280")
+        self.assertEqual(address.postal_code, "1160")
+        self.assertEqual(address.city, "Auderghem")
+
+    # Les codes NACEBEL ne sont repris qu'une fois
+    def test_nacebel_codes(self):
+        self.assertEqual(self.company.activities.nacebel_codes, ["47.520", "46.730"])
+        self.assertEqual(len(self.company.activities.company_activities), 2)
+
+    # Adresse avec boîte postale
+    def test_address_with_postal_box(self):
+        address = parse_kbo_address(["Rue de la Station 12 boîte 3", "4000 Liège"])
+        self.assertEqual(
+            (address.street, address.street_number, address.postal_box),
+            ("Rue de la Station", "12", "3"),
+        )
+
+    # Une page sans tableau n'est pas analysée
+    def test_page_without_table(self):
+        self.assertIsNone(parse_kbo("<html><body>Numéro inconnu</body></html>"))
+
+
+class TestSharedParse(unittest.TestCase):
+
+    # Le même arbre sert à l'analyse KBO puis au nettoyage pour le LLM
+    def test_kbo_format_reuses_soup(self):
+        html = read_fixture("kbo_0423369762.html")
+        soup = parse_html(html)
+        self.assertIsNotNone(parse_kbo(None, soup))
+        documents = kbo_format([Document(html)], soup)
+        self.assertIn("**code nacebel: 47.520", documents[0].page_content)
+        self.assertIn("Company type:", documents[0].page_content)
+
+    # Les balises meta et le Markdown viennent d'une seule analyse du site
+    def test_markdown_without_scripts(self):
+        soup = parse_html(read_fixture("website_brico_planit.html"))
+        markdown = soup_to_markdown(soup)
+        self.assertNotIn("<script", markdown)
+        self.assertNotIn("\xa0", markdown)
+        self.assertNotIn("\n\n\n", markdown)
+        self.assertIsNotNone(soup.find("meta", attrs={"property": "og:title"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest, asyncio, os, tempfile
+from unittest.mock import patch
+from tools.geography import *
+from tools.utils import find_region
+from schema.company_schema import AddressSchema
+from tools.cache import MemoryCache
+from tools.stages import StageStore
+import runnable.legal_data as legal_data
+
+
+class TestPostalCodes(unittest.TestCase):
+
+    # Ville, province et région sont connues sans requête
+    def test_lookup(self):
+        self.assertEqual(
+            lookup_postal_code("1348"),
+            {"city": "Louvain-la-Neuve", "province": "Brabant wallon", "region": "Wallonie", "country": "Belgique"},
+        )
+        self.assertEqual(lookup_postal_code(3000)["province"], "Brabant flamand")
+        self.assertEqual(lookup_postal_code("6600")["province"], "Luxembourg")
+
+    # Un code absent du fichier n'est pas résolu par la table, seule sa tranche donne province et région
+    def test_unlisted_code(self):
+        self.assertIsNone(lookup_postal_code("6999"))
+        location = lookup_postal_area("6999")
+        self.assertEqual((location["city"], location["province"]), ("", "Luxembourg"))
+        self.assertIsNone(lookup_postal_area("75001"))
+
+    # Codes invalides ou étrangers
+    def test_unknown_code(self):
+        self.assertIsNone(lookup_postal_code("75001"))
+        self.assertIsNone(lookup_postal_code(""))
+        self.assertEqual(find_region("999"), "")
+        self.assertEqual(find_region(1160), "Bruxelles")
+
+    # Un fichier plus complet peut remplacer la table fournie
+    def test_custom_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8") as file:
+            file.write("postal_code,city,province,region\n6999,Ville test,,\n")
+        self.addCleanup(os.remove, file.name)
+        postal_codes = PostalCodes(file.name)
+        self.assertEqual(postal_codes.lookup("6999")["city"], "Ville test")
+        # La version suit le contenu du fichier
+        self.assertNotEqual(postal_codes.version, get_postal_codes().version)
+        self.assertEqual(PostalCodes(file.name).version, postal_codes.version)
+
+
+class TestCompleteAddress(unittest.TestCase):
+
+    # Nominatim n'est appelé que pour les codes étrangers ou invalides
+    def test_nominatim_fallback(self):
+        with patch.object(legal_data, "get_data_from_address", return_value={"country": "France"}) as nominatim:
+            address = AddressSchema(street="Boulevard du Souverain", street_number="280", postal_code="1160")
+            legal_data.complete_address(address)
+            nominatim.assert_not_called()
+            self.assertEqual((address.city, address.region, address.country), ("Auderghem", "Bruxelles", "Belgique"))
+
+            address = AddressSchema(street="Rue de Rivoli", postal_code="75001", city="Paris")
+            legal_data.complete_address(address)
+            nominatim.assert_called_once()
+            self.assertEqual(address.country, "France")
+
+    # Un code belge absent de la table est résolu par sa tranche, la ville vient de KBO
+    def test_area_without_nominatim(self):
+        stages = StageStore(MemoryCache()).start("0423369762")
+        with patch.object(legal_data, "get_data_from_address") as nominatim:
+            address = AddressSchema(street="Rue du Village", street_number="1", postal_code="4031", city="Angleur")
+            legal_data.complete_address(address, stages)
+        nominatim.assert_not_called()
+        self.assertEqual(
+            (address.city, address.province, address.region, address.country), ("Angleur", "Liège", "Wallonie", "Belgique")
+        )
+        self.assertIn("address", stages.current)
+
+        with patch.object(legal_data, "aget_data_from_address") as nominatim:
+            address = AddressSchema(street="Rue du Village", street_number="1", postal_code="6999")
+            asyncio.run(legal_data.acomplete_address(address))
+        nominatim.assert_not_called()
+        self.assertEqual(address.province, "Luxembourg")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest, asyncio, json, time, httpx
+from tools.hosts import *
+from tools.metrics import Metrics
+from tools.scraper import CompanyScraper
+from tools.cache import HttpCache, MemoryCache
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    # La rafale est servie sans attente, les requêtes suivantes sont espacées
+    def test_rate(self):
+        bucket = TokenBucket(10.0, 2)
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0, 0])
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(bucket.reserve(), 0.2, delta=0.01)
+
+    # Le débit est divisé par deux sur un 429 puis remonte progressivement
+    def test_aimd(self):
+        bucket = TokenBucket(4.0, 4)
+        bucket.decrease()
+        self.assertEqual(bucket.rate, 2.0)
+        self.assertGreater(bucket.reserve(), 0)  # Plus de rafale
+        bucket.increase()
+        self.assertEqual(bucket.rate, 2.2)
+        for _ in range(100):
+            bucket.increase()
+        self.assertEqual(bucket.rate, 4.0)
+
+    def test_retry_after(self):
+        bucket = TokenBucket(10.0, 10)
+        bucket.decrease(retry_after=2)
+        self.assertGreaterEqual(bucket.reserve(), 2)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(None)
+        bucket.decrease()
+        self.assertEqual([bucket.reserve() for _ in range(100)], [0] * 100)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_states(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+        self.assertFalse(breaker.failure())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.failure())
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        # Après le délai, une seule requête sonde l'hôte
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+
+    # L'échec de la sonde rouvre le circuit immédiatement
+    def test_failed_probe(self):
+        breaker = CircuitBreaker(threshold=3, cooldown=0.05)
+        for _ in range(3):
+            breaker.failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.failure())
+        self.assertFalse(breaker.allow())
+
+
+class TestHostLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.limits = HostLimits(
+            rates={"nominatim.openstreetmap.org": (1.0, 1)},
+            default_rate=(100.0, 10),
+            thresholds={"kbopub.economie.fgov.be": 2},
+            default_threshold=1,
+        )
+
+    def test_configuration(self):
+        self.assertEqual(self.limits.get("Nominatim.OpenStreetMap.org").bucket.rate, 1.0)
+        self.assertEqual(self.limits.get("www.brico.be").bucket.rate, 100.0)
+        self.assertEqual(self.limits.get("kbopub.economie.fgov.be").breaker.threshold, 2)
+
+    # 429 ralentit sans couper l'hôte, 503 et les erreurs de connexion comptent comme des pannes
+    def test_record(self):
+        limiter = self.limits.get("www.brico.be")
+        limiter.record(httpx.Response(429, headers={"Retry-After": "0"}))
+        self.assertEqual(limiter.bucket.rate, 50.0)
+        self.assertEqual(limiter.breaker.state, "closed")
+        limiter.record(httpx.Response(200))
+        limiter.record(error=httpx.ConnectTimeout("timeout"))
+        self.assertEqual(limiter.breaker.state, "open")
+        self.assertFalse(limiter.wait())
+
+    def test_status(self):
+        self.limits.get("www.brico.be").record(error=httpx.ConnectError("refused"))
+        self.assertEqual(self.limits.status()["www.brico.be"]["circuit_open"], 1)
+
+        metrics = Metrics()
+        metrics.register("host", self.limits.labelled_status, label="host", gauge=True)
+        snapshot = json.loads(metrics.to_json())
+        self.assertIn(
+            {"name": "host", "labels": {"host": "other", "result": "circuit_open"}, "value": 1},
+            snapshot["gauges"],
+        )
+        self.assertIn('company_scraper_host{host="other",result="circuit_open"} 1', metrics.to_prometheus())
+
+    # Seuls les hôtes des sources publiques gardent leur propre label, les sites sont additionnés
+    def test_labelled_status(self):
+        self.limits.get("www.brico.be").record(error=httpx.ConnectError("refused"))
+        self.limits.get("www.delhaize.be").record(error=httpx.ConnectError("refused"))
+        self.limits.get("kbopub.economie.fgov.be").record(httpx.Response(200))
+        status = self.limits.labelled_status()
+        self.assertEqual(set(status), {"kbopub.economie.fgov.be", "other"})
+        self.assertEqual(status["other"], {"circuit_open": 2, "failures": 2})
+        self.assertEqual(get_host_label("KBOPUB.economie.fgov.be"), "kbopub.economie.fgov.be")
+        self.assertEqual(get_host_label("www.brico.be"), "other")
+
+
+class TestScraperLimits(unittest.IsolatedAsyncioTestCase):
+
+    # Les requêtes vers un hôte sont espacées selon son débit, même lancées ensemble
+    async def test_requests_are_spaced(self):
+        times = []
+
+        def handler(request):
+            times.append(time.monotonic())
+            return httpx.Response(200, json=[], headers={"content-type": "application/json"})
+
+        limits = HostLimits(rates={"nominatim.openstreetmap.org": (20.0, 1)})
+        scraper = CompanyScraper(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache(), ttls={}),
+            limits=limits,
+        )
+        urls = [f"https://nominatim.openstreetmap.org/search?q={i}" for i in range(4)]
+        await asyncio.gather(*(scraper.arun(url) for url in urls))
+        self.assertGreaterEqual(times[-1] - times[0], 0.14)
+
+    # Un hôte throttlé est ralenti, un hôte en panne n'est plus contacté
+    async def test_throttled_then_down(self):
+        statuses = iter([429, 503, 200])
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(next(statuses), text="<p>Brico</p>", headers={"content-type": "text/html"})
+
+        limits = HostLimits(default_rate=(1000.0, 10))
+        scraper = CompanyScraper(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache()),
+            limits=limits,
+        )
+        await scraper.arun("https://www.brico.be/a")
+        self.assertEqual(limits.get("www.brico.be").bucket.rate, 500.0)
+        await scraper.arun("https://www.brico.be/b")
+        documents = await scraper.arun("https://www.brico.be/c")
+        self.assertEqual(documents[0].page_content, "")
+        self.assertEqual(len(requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest, os, re, subprocess, sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# Points d'entrée des workers et des outils en ligne de commande
+ENTRY_POINTS = ["runnable.company_scraper", "runnable.batch", "tools.kbo"]
+
+# Temps d'import cumulé autorisé (environ 0,4 s mesuré, 1,4 s avant les imports différés)
+IMPORT_TIME_BUDGET = 1.0
+
+# Paquets importés seulement à la première utilisation (LLM, traçage, recherche Google, historique financier)
+LAZY_PACKAGES = {"langchain", "langchain_core", "langchain_openai", "langsmith", "openai", "googlesearch", "pandas", "numpy"}
+
+
+def import_times(modules: list) -> dict:
+    """Importe les modules dans un nouvel interpréteur et renvoie {module: secondes cumulées}."""
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise AssertionError(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", line)
+        if match:
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Sans clé OpenAI : les modèles ne sont créés qu'au premier appel
+        cls.times = import_times(ENTRY_POINTS)
+
+    def test_heavy_packages_are_lazy(self):
+        imported = {name.split(".")[0] for name in self.times}
+        self.assertFalse(imported & LAZY_PACKAGES)
+
+    def test_budget(self):
+        total = sum(self.times[module] for module in ENTRY_POINTS if module in self.times)
+        self.assertLess(total, IMPORT_TIME_BUDGET, f"Import time {total:.2f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,292 @@
+import unittest, asyncio, json, threading, time
+from tools.jobs import *
+from tools.stages import notify
+from tools.flight import request_flights
+from runnable.worker import WorkerPool
+from benchmarks.offline import Recordings, FakeLLM, offline
+
+
+class FakeRedis:
+    """Redis factice : chaînes et ensembles triés, partagé par plusieurs files comme entre deux machines."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.values = {}
+        self.zsets = {}
+        self.messages = []
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value, ex=None):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def zadd(self, key: str, mapping: dict):
+        with self.mutex:
+            self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrangebyscore(self, key: str, minimum, maximum, start=0, num=None):
+        with self.mutex:
+            items = sorted((score, member) for member, score in self.zsets.get(key, {}).items() if score <= maximum)
+        return [member.encode() for _, member in items[start:start + num]]
+
+    def zrem(self, key: str, member: str) -> int:
+        with self.mutex:
+            return int(self.zsets.get(key, {}).pop(member, None) is not None)
+
+    def eval(self, script: str, numkeys: int, *args):
+        # Seul le script de déplacement des travaux est exécuté, sous le verrou comme en Redis
+        assert script == MOVE_SCRIPT
+        source, target, member, score = args
+        with self.mutex:
+            if self.zsets.get(source, {}).pop(member, None) is None:
+                return 0
+            self.zsets.setdefault(target, {})[member] = score
+            return 1
+
+    def zcard(self, key: str) -> int:
+        return len(self.zsets.get(key, {}))
+
+    def publish(self, channel: str, message: str):
+        self.messages.append((channel, json.loads(message)))
+
+
+class QueueTests:
+    """Comportement commun aux deux files."""
+
+    def make_queue(self, **kwargs) -> JobQueue:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.queue = self.make_queue(backoff=0.0)
+
+    # Les travaux interactifs passent avant les travaux de nuit, même soumis après
+    def test_priority_lanes(self):
+        batch_id = self.queue.submit({"vat_number": "0423369762"}, lane="batch")
+        interactive_id = self.queue.submit({"vat_number": "0738512604"})
+        self.assertEqual(self.queue.claim()["id"], interactive_id)
+        job = self.queue.claim()
+        self.assertEqual((job["id"], job["status"], job["attempts"]), (batch_id, "running", 1))
+        self.assertIsNone(self.queue.claim())
+        self.assertIsNone(self.queue.claim(["interactive"]))
+        with self.assertRaises(ValueError):
+            self.queue.submit({"vat_number": "0423369762"}, lane="urgent")
+
+    def test_complete(self):
+        job_id = self.queue.submit({"vat_number": "0423369762"}, stages=["website"])
+        job = self.queue.claim()
+        self.assertEqual(job["stages"], ["website"])
+        job["progress"]["legal"] = "done"
+        self.queue.renew(job)
+        self.assertEqual(self.queue.get(job_id)["progress"], {"legal": "done"})
+        self.queue.complete(job, {"name": "Brico"})
+        job = self.queue.get(job_id)
+        self.assertEqual((job["status"], job["result"]), ("done", {"name": "Brico"}))
+        self.assertEqual(self.queue.pending(), 0)
+
+    # Un échec est retenté jusqu'au nombre maximal de tentatives
+    def test_retry(self):
+        job_id = self.queue.submit({"vat_number": "0423369762"}, max_attempts=2)
+        self.assertTrue(self.queue.fail(self.queue.claim(), "timeout"))
+        job = self.queue.claim()
+        self.assertEqual((job["id"], job["attempts"]), (job_id, 2))
+        self.assertFalse(self.queue.fail(job, "timeout"))
+        self.assertEqual(self.queue.get(job_id)["status"], "failed")
+        self.assertEqual(self.queue.stats["interactive"]["retried"], 1)
+
+    def test_backoff(self):
+        queue = self.make_queue(backoff=60.0)
+        queue.submit({"vat_number": "0423369762"})
+        self.assertTrue(queue.fail(queue.claim(), "timeout"))
+        self.assertIsNone(queue.claim())  # Pas avant une minute
+        self.assertEqual(queue.pending(), 1)
+
+    # Un travail dont l'échéance est passée n'est pas lancé, ni retenté
+    def test_deadline(self):
+        job_id = self.queue.submit({"vat_number": "0423369762"}, deadline=-1)
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(job_id)["status"], "expired")
+
+        # La nouvelle tentative arriverait après l'échéance
+        queue = self.make_queue(backoff=5.0)
+        job_id = queue.submit({"vat_number": "0423369762"}, deadline=1)
+        self.assertFalse(queue.fail(queue.claim(), "timeout"))
+        self.assertEqual(queue.get(job_id)["status"], "failed")
+
+    # Le travail d'un worker disparu est remis dans la file à l'expiration de son bail
+    def test_recover(self):
+        queue = self.make_queue(lease=0.0)
+        job_id = queue.submit({"vat_number": "0423369762"})
+        queue.claim()
+        self.assertEqual(queue.recover(), 1)
+        job = queue.claim()
+        self.assertEqual((job["id"], job["attempts"]), (job_id, 2))
+
+    # Un worker arrêté juste après avoir pris un travail ne le perd pas
+    def test_crash_after_claim(self):
+        queue = self.make_queue(lease=0.0)
+        job_id = queue.submit({"vat_number": "0423369762"})
+        queue.save = lambda job: None  # Le worker s'arrête avant d'écrire le travail
+        self.assertIsNotNone(queue.claim())
+        del queue.save
+        self.assertEqual(queue.get(job_id)["status"], "queued")
+        self.assertEqual(queue.recover(), 1)
+        self.assertEqual(queue.claim()["id"], job_id)
+
+    def test_watch(self):
+        job_id = self.queue.submit({"vat_number": "0423369762"})
+
+        def work():
+            job = self.queue.claim()
+            time.sleep(0.05)
+            self.queue.complete(job, {"name": "Brico"})
+
+        watch = self.queue.watch(job_id, timeout=5, interval=0.01)
+        self.assertEqual(next(watch)["status"], "queued")
+        thread = threading.Thread(target=work)
+        thread.start()
+        statuses = [job["status"] for job in watch]
+        thread.join()
+        self.assertEqual(statuses[-1], "done")
+
+
+class TestMemoryJobQueue(QueueTests, unittest.TestCase):
+
+    def make_queue(self, **kwargs) -> JobQueue:
+        return MemoryJobQueue(**kwargs)
+
+
+class TestRedisJobQueue(QueueTests, unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        super().setUp()
+
+    def make_queue(self, **kwargs) -> JobQueue:
+        return RedisJobQueue("redis://fake", client=self.redis, **kwargs)
+
+    # Deux workers sur deux machines ne prennent jamais le même travail
+    def test_shared_queue(self):
+        other = self.make_queue()
+        ids = {self.queue.submit({"vat_number": str(i)}) for i in range(20)}
+        claimed = []
+
+        def work(queue):
+            while (job := queue.claim()) is not None:
+                claimed.append(job["id"])
+
+        threads = [threading.Thread(target=work, args=(queue,)) for queue in (self.queue, other) * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), sorted(ids))
+
+    def test_events(self):
+        job_id = self.queue.submit({"vat_number": "0423369762"})
+        self.queue.complete(self.queue.claim(), None)
+        channels = {channel for channel, _ in self.redis.messages}
+        self.assertEqual(channels, {f"jobs:events:{job_id}"})
+        self.assertEqual([event["status"] for _, event in self.redis.messages], ["queued", "running", "done"])
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = MemoryJobQueue(backoff=0.0)
+
+    def run_pool(self, handler, workers=2):
+        asyncio.run(WorkerPool(self.queue, workers, handler=handler, poll_interval=0.01, heartbeat=0.01).run(drain=True))
+
+    # La progression est écrite pendant le travail, un échec est retenté
+    def test_progress_and_retry(self):
+        progress = []
+
+        async def handler(job):
+            notify("legal", False)
+            await asyncio.sleep(0.05)
+            progress.append(self.queue.get(job["id"])["progress"])
+            if job["attempts"] == 1:
+                raise RuntimeError("KBO indisponible")
+            notify("address", True)
+            return {"vat_number": job["fields"]["vat_number"]}
+
+        job_id = self.queue.submit({"vat_number": "0423369762"})
+        self.run_pool(handler)
+        job = self.queue.get(job_id)
+        self.assertEqual((job["status"], job["attempts"]), ("done", 2))
+        self.assertEqual(job["result"], {"vat_number": "0423369762"})
+        self.assertEqual(job["progress"], {"legal": "done", "address": "reused"})
+        self.assertEqual(progress[0], {"legal": "done"})
+
+    def test_deadline(self):
+        async def handler(job):
+            await asyncio.sleep(1)
+
+        job_id = self.queue.submit({"vat_number": "0423369762"}, deadline=0.1)
+        self.run_pool(handler)
+        self.assertEqual(self.queue.get(job_id)["status"], "expired")
+
+    # Une erreur de la file n'arrête pas les workers, ils réessaient après un délai
+    def test_queue_errors(self):
+        failures = {"claim": 2, "complete": 1}
+
+        def failing(name, method):
+            def call(*args):
+                if failures[name]:
+                    failures[name] -= 1
+                    raise ConnectionError("Redis indisponible")
+                return method(*args)
+            return call
+
+        self.queue.claim = failing("claim", self.queue.claim)
+        self.queue.complete = failing("complete", self.queue.complete)
+        self.queue.lease = 0.0  # Le travail dont le résultat n'a pu être écrit est repris
+
+        async def handler(job):
+            return {"attempts": job["attempts"]}
+
+        job_id = self.queue.submit({"vat_number": "0423369762"})
+        with self.assertLogs(level="ERROR"):
+            self.run_pool(handler, workers=1)
+        job = self.queue.get(job_id)
+        self.assertEqual((job["status"], job["result"]), ("done", {"attempts": 2}))
+
+    # L'échéance arrête aussi le calcul partagé lancé par le travail
+    def test_deadline_cancels_shared_computation(self):
+        states = []
+
+        async def compute():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                states.append("cancelled")
+                raise
+
+        async def handler(job):
+            return await request_flights.ado("run", job["id"], compute)
+
+        async def main():
+            await WorkerPool(self.queue, 1, handler=handler, poll_interval=0.01).run(drain=True)
+            await asyncio.sleep(0.01)
+            return list(states)  # Avant la fermeture de la boucle, qui annule tout
+
+        job_id = self.queue.submit({"vat_number": "0423369762"}, deadline=0.1)
+        self.assertEqual(asyncio.run(main()), ["cancelled"])
+        self.assertEqual(self.queue.get(job_id)["status"], "expired")
+
+    # Enrichissement complet par les workers, sur les réponses enregistrées
+    def test_enrich(self):
+        recordings = Recordings(2)
+        job_ids = [self.queue.submit({"vat_number": company.vat_number}, lane="batch") for company in recordings.companies]
+        with offline(recordings, FakeLLM()):
+            asyncio.run(WorkerPool(self.queue, 2, poll_interval=0.01).run(drain=True))
+        for job_id, company in zip(job_ids, recordings.companies):
+            job = self.queue.get(job_id)
+            self.assertEqual(job["status"], "done")
+            self.assertEqual(job["result"]["name"], company.name)
+            self.assertIn("legal", job["progress"])
+
+
+if __name__ == "__main__":
+    unittest.main()
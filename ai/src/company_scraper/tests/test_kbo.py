@@ -0,0 +1,135 @@
+import unittest, os, shutil, tempfile, zipfile
+from unittest.mock import patch
+from tools.kbo import *
+from tools.format import is_complete_legal_data
+
+DUMPS = os.path.join(os.path.dirname(__file__), "fixtures", "kbo_open_data")
+
+
+class TestKboStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = KboStore(os.path.join(self.directory, "kbo.sqlite"))
+        self.store.import_dump(os.path.join(DUMPS, "full"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Les données légales sont lues dans l'index, sans requête vers kbopub
+    def test_lookup(self):
+        company = self.store.lookup("0423.369.762")
+        self.assertEqual(company.name, "Brico Plan-It")
+        self.assertEqual(company.vat_number, "0423369762")
+        self.assertEqual(company.legal_form, "Société anonyme")
+        self.assertEqual(company.established, "29 juin 1983")
+        self.assertEqual(company.company_type, ["Personne morale"])
+        self.assertEqual(company.contact.website, "https://www.brico-planit.be")
+        self.assertEqual(
+            (company.address.street, company.address.street_number, company.address.postal_code, company.address.city),
+            ("Boulevard du Souverain", "280", "1160", "Auderghem"),
+        )
+        self.assertTrue(is_complete_legal_data(company))
+
+    # Seule la nomenclature la plus récente est reprise, activité principale en premier
+    def test_activities(self):
+        activities = self.store.lookup("0423369762").activities
+        self.assertEqual(activities.nacebel_codes, ["47.520", "46.730"])
+        self.assertEqual(len(activities.company_activities), 2)
+
+    # Nom et rue disponibles uniquement en néerlandais
+    def test_dutch_only_company(self):
+        company = self.store.lookup("0738512604")
+        self.assertEqual(company.name, "Bakkerij Peeters")
+        self.assertEqual((company.address.street, company.address.city), ("Meir", "Anvers"))
+
+    # Les unités d'établissement ne sont pas importées
+    def test_establishments_skipped(self):
+        count = self.store.connection.execute("SELECT COUNT(*) FROM denomination").fetchone()[0]
+        self.assertEqual(count, 4)
+        self.assertIsNone(self.store.lookup("2123456789"))
+
+    # La mise à jour mensuelle est appliquée une seule fois, par-dessus l'import complet
+    def test_update(self):
+        self.assertTrue(self.store.import_dump(os.path.join(DUMPS, "update")))
+        self.assertFalse(self.store.import_dump(os.path.join(DUMPS, "update")))
+        self.assertEqual(self.store.extract_number, 141)
+        self.assertIsNone(self.store.lookup("0456789123"))
+        self.assertEqual(self.store.lookup("0423369762").name, "Brico Plan-It Group")
+        person = self.store.lookup("0789456123")
+        self.assertEqual((person.name, person.is_company), ("Jean Dupont", False))
+
+    # Une fiche sans forme juridique, date de création ou code NACEBEL n'est pas complète
+    def test_incomplete_records(self):
+        company = self.store.lookup("0423369762")
+        for field, value in (("legal_form", ""), ("established", "")):
+            self.assertFalse(is_complete_legal_data(company.model_copy(update={field: value})))
+        activities = company.activities.model_copy(update={"nacebel_codes": []})
+        self.assertFalse(is_complete_legal_data(company.model_copy(update={"activities": activities})))
+        # Une personne physique n'a pas de forme juridique
+        person = company.model_copy(update={"legal_form": "", "is_company": False})
+        self.assertTrue(is_complete_legal_data(person))
+
+    # Un import complet interrompu laisse l'index précédent intact
+    def test_failed_full_import(self):
+        self.store.import_dump(os.path.join(DUMPS, "update"))
+        with patch.object(KboStore, "insert_codes", side_effect=RuntimeError("interrupted")):
+            with self.assertRaises(RuntimeError):
+                self.store.import_dump(os.path.join(DUMPS, "full"))
+        self.assertEqual(self.store.extract_number, 141)
+        self.assertEqual(self.store.lookup("0423369762").name, "Brico Plan-It Group")
+        self.assertEqual(os.listdir(self.directory), ["kbo.sqlite"])
+
+        # Un nouvel import complet remplace l'index
+        self.assertTrue(self.store.import_dump(os.path.join(DUMPS, "full")))
+        self.assertEqual(self.store.lookup("0423369762").name, "Brico Plan-It")
+        self.assertEqual(os.listdir(self.directory), ["kbo.sqlite"])
+
+    # Les archives zip publiées sont lues sans extraction
+    def test_zip_dump(self):
+        path = os.path.join(self.directory, "KboOpenData_0140_2025_06_Full.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            for name in os.listdir(os.path.join(DUMPS, "full")):
+                archive.write(os.path.join(DUMPS, "full", name), name)
+        store = KboStore(os.path.join(self.directory, "zip.sqlite"))
+        store.import_dump(path)
+        self.assertEqual(store.lookup("0423369762").name, "Brico Plan-It")
+
+
+class TestLegalDataFromIndex(unittest.TestCase):
+
+    # Avec l'index local, aucune page n'est téléchargée
+    def test_get_legal_data_without_scraping(self):
+        import runnable.legal_data as legal_data
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = KboStore(os.path.join(directory, "kbo.sqlite"))
+        store.import_dump(os.path.join(DUMPS, "full"))
+        set_kbo_store(store)
+        self.addCleanup(set_kbo_store, None)
+
+        with patch.object(legal_data, "load_pages") as load_pages:
+            company = legal_data.get_legal_data({"vat_number": "0423369762"})
+        load_pages.assert_not_called()
+        self.assertEqual(company.name, "Brico Plan-It")
+
+    # Une fiche incomplète de l'index laisse la place aux pages KBO
+    def test_incomplete_record_is_scraped(self):
+        import runnable.legal_data as legal_data
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = KboStore(os.path.join(directory, "kbo.sqlite"))
+        store.import_dump(os.path.join(DUMPS, "full"))
+        incomplete = store.lookup("0423369762").model_copy(update={"legal_form": ""})
+
+        with patch.object(legal_data, "lookup_kbo", return_value=incomplete), patch.object(
+            legal_data, "load_pages", side_effect=RuntimeError("scraping")
+        ):
+            with self.assertRaisesRegex(RuntimeError, "scraping"):
+                legal_data.get_legal_data({"vat_number": "0423369762"})
+
+
+if __name__ == "__main__":
+    unittest.main()
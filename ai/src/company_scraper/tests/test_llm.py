@@ -0,0 +1,68 @@
+import unittest, asyncio, threading, time
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tools.cache import MemoryCache
+from tests.test_scraper import ThreadCache
+from tools.llm import *
+
+
+class CountingChatModel(FakeListChatModel):
+    """Modèle factice qui compte les appels réellement envoyés."""
+
+    calls: int = 0
+
+    def _generate(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(0.01)
+        return super()._generate(*args, **kwargs)
+
+
+class TestLlmCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.model = CountingChatModel(responses=["https://www.brico.be"] * 10)
+        self.cache = LlmCache(MemoryCache())
+        self.inputs = {"name": "Brico", "requests": [], "activities": ["bricolage"]}
+
+    # Une entrée identique (aux espaces près) n'appelle le modèle qu'une fois
+    def test_identical_input_is_cached(self):
+        first = self.cache.invoke(Prompt.FIND_URL, self.model, self.inputs)
+        second = self.cache.invoke(
+            Prompt.FIND_URL, self.model, {**self.inputs, "name": " Brico\n"}
+        )
+        self.assertEqual(first, "https://www.brico.be")
+        self.assertEqual(second, first)
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(self.cache.stats["FIND_URL"]["hit"], 1)
+
+    # Des requêtes identiques simultanées sont regroupées
+    async def test_concurrent_requests_are_coalesced(self):
+        answers = await asyncio.gather(
+            *(self.cache.ainvoke(Prompt.FIND_URL, self.model, self.inputs) for _ in range(5))
+        )
+        self.assertEqual(set(answers), {"https://www.brico.be"})
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(self.cache.stats["FIND_URL"]["coalesced"], 4)
+
+    # Le chemin asynchrone ne lit ni n'écrit le cache dans la boucle d'événements
+    async def test_async_cache_access_in_thread(self):
+        backend = ThreadCache()
+        cache = LlmCache(backend)
+        for _ in range(2):
+            self.assertEqual(await cache.ainvoke(Prompt.FIND_URL, self.model, self.inputs), "https://www.brico.be")
+        self.assertEqual(len(backend.threads), 3)  # miss, écriture, hit
+        self.assertNotIn(threading.get_ident(), backend.threads)
+        self.assertEqual(self.model.calls, 1)
+
+    # Un autre prompt ou une autre entrée ne partagent pas la même clé
+    def test_key_depends_on_prompt_and_input(self):
+        key = self.cache.get_key(Prompt.FIND_URL, self.model, self.inputs)
+        self.assertNotEqual(
+            key, self.cache.get_key(Prompt.MAKE_DESCRIPTION, self.model, self.inputs)
+        )
+        self.assertNotEqual(
+            key, self.cache.get_key(Prompt.FIND_URL, self.model, {"name": "Petra"})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest, asyncio, json
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from tools.metrics import *
+from tools.metrics import metrics as global_metrics
+from tools.scraper import CompanyScraper
+from tools.cache import HttpCache, MemoryCache
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    # Compteurs et durées exportés au format texte de Prometheus
+    def test_prometheus(self):
+        self.metrics.count("requests", host="kbopub.economie.fgov.be", status=200)
+        self.metrics.count("requests", host="kbopub.economie.fgov.be", status=200)
+        self.metrics.observe("fetch", 0.5, host="kbopub.economie.fgov.be")
+        self.metrics.observe("fetch", 1.5, host="kbopub.economie.fgov.be")
+        text = self.metrics.to_prometheus()
+        self.assertIn("# TYPE company_scraper_requests_total counter", text)
+        self.assertIn('company_scraper_requests_total{host="kbopub.economie.fgov.be",status="200"} 2', text)
+        self.assertIn('company_scraper_fetch_seconds_count{host="kbopub.economie.fgov.be"} 2', text)
+        self.assertIn('company_scraper_fetch_seconds_sum{host="kbopub.economie.fgov.be"} 2', text)
+        self.assertIn('company_scraper_fetch_seconds_max{host="kbopub.economie.fgov.be"} 1.5', text)
+
+    # Les statistiques des caches sont exportées avec le reste
+    def test_collectors(self):
+        stats = {"FIND_URL": {"hit": 3, "miss": 1}}
+        self.metrics.register("llm_cache", lambda: stats, label="prompt")
+        self.metrics.register("http_cache", lambda: {"hit": 5})
+        snapshot = json.loads(self.metrics.to_json())
+        self.assertIn(
+            {"name": "llm_cache", "labels": {"prompt": "FIND_URL", "result": "hit"}, "value": 3}, snapshot["counters"]
+        )
+        self.assertIn('company_scraper_http_cache_total{result="hit"} 5', self.metrics.to_prometheus())
+
+    # Les durées d'une exécution sont collectées dans les tâches et les threads
+    def test_run_timings(self):
+        def parse():
+            with self.metrics.timer("parse"):
+                pass
+
+        async def fetch():
+            async with self.metrics.atimer("fetch", host="kbopub.economie.fgov.be"):
+                await asyncio.sleep(0.01)
+
+        async def main():
+            with track_run() as timings:
+                await asyncio.gather(fetch(), fetch())
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(executor.map(in_context(lambda _: parse()), range(3)))
+            return timings.to_dict()
+
+        timings = asyncio.run(main())
+        self.assertEqual(timings["steps"]["fetch:kbopub.economie.fgov.be"]["count"], 2)
+        self.assertEqual(timings["steps"]["parse"]["count"], 3)
+        self.assertEqual(next(iter(timings["steps"])), "fetch:kbopub.economie.fgov.be")  # La plus lente d'abord
+        self.assertIsNone(current_run.get())
+
+    # Chaque requête est comptée par hôte et par statut, les sites des entreprises sous "other"
+    def test_scraper_requests(self):
+        global_metrics.reset()
+        transport = httpx.MockTransport(
+            lambda request: httpx.Response(404 if "missing" in request.url.path else 200, text="<p>Brico</p>")
+        )
+        scraper = CompanyScraper(client=httpx.Client(transport=transport), cache=HttpCache(MemoryCache()))
+        scraper.run("https://www.brico.be/")
+        scraper.run("https://www.brico.be/missing")
+        counters = {
+            (item["name"], item["labels"].get("status")): item["value"]
+            for item in global_metrics.snapshot()["counters"]
+            if item["labels"].get("host") == "other"
+        }
+        self.assertEqual(counters, {("requests", "200"): 1, ("requests", "404"): 1})
+        hosts = {item["labels"].get("host") for item in global_metrics.snapshot()["counters"]}
+        self.assertNotIn("www.brico.be", hosts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest, asyncio, io
+from contextlib import redirect_stdout
+from benchmarks.offline import *
+from benchmarks.bench_pipeline import percentile, compare
+from unittest.mock import patch
+from runnable.company_scraper import run, arun, aenrich
+from runnable.legal_data import abuild_company_schema
+from tools.flight import request_flights
+
+
+class TestOfflinePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.recordings = Recordings(3)
+        self.llm = FakeLLM()
+
+    def check(self, company_schema, company: Company):
+        self.assertEqual(company_schema.name, company.name)
+        self.assertEqual(company_schema.vat_number, company.vat_number)
+        self.assertEqual(company_schema.address.postal_code, "1160")
+        self.assertEqual(company_schema.financial.company_size, "small")
+        self.assertEqual(company_schema.contact.website, f"https://{company.host}/")
+        self.assertEqual(company_schema.activities.sectors, ["Commerce de détail"])
+
+    # Pipeline complet sur les réponses enregistrées, sans aucun accès réseau
+    def test_run(self):
+        company = self.recordings.companies[1]
+        with offline(self.recordings, self.llm):
+            self.check(run({"vat_number": company.vat_number}), company)
+        # La page KBO est lue sans LLM, seule la description en demande un
+        self.assertEqual(self.llm.calls, {"MAKE_DESCRIPTION": 1})
+        self.assertEqual(self.recordings.requests["consult.cbso.nbb.be"], 2)
+
+    def test_arun(self):
+        async def main():
+            return await asyncio.gather(*(arun({"vat_number": company.vat_number}) for company in companies))
+
+        companies = self.recordings.companies
+        with offline(self.recordings, self.llm):
+            results = asyncio.run(main())
+        for company_schema, company in zip(results, companies):
+            self.check(company_schema, company)
+        self.assertEqual(self.llm.calls["MAKE_DESCRIPTION"], 3)
+
+    # Une demande forcée ne reçoit pas le résultat d'une demande normale en cours
+    def test_forced_arun_is_not_coalesced(self):
+        async def main():
+            fields = {"vat_number": company.vat_number}
+            return await asyncio.gather(arun(fields), arun(fields, force=True), arun(fields))
+
+        company = self.recordings.companies[0]
+        stats = request_flights.stats["run"]
+        computed, coalesced = stats["computed"], stats["coalesced"]
+        with offline(self.recordings, self.llm):
+            for company_schema in asyncio.run(main()):
+                self.check(company_schema, company)
+        self.assertEqual((stats["computed"] - computed, stats["coalesced"] - coalesced), (2, 1))
+
+    # Une erreur sur les données légales annule la lecture des comptes annuels déjà lancée
+    def test_legal_data_error_cancels_financial_task(self):
+        states = []
+
+        async def financial_stage(vat_number, stages):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                states.append("cancelled")
+                raise
+
+        async def legal_data(fields, stages):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("KBO indisponible")
+
+        async def main(func):
+            with self.assertRaises(RuntimeError):
+                await func({"vat_number": "0423369762"})
+            await asyncio.sleep(0.01)
+            return list(states)  # Avant la fermeture de la boucle, qui annule tout
+
+        with patch("runnable.legal_data.aget_financial_stage", financial_stage):
+            with patch("runnable.company_scraper.aget_legal_data", legal_data):
+                self.assertEqual(asyncio.run(main(aenrich)), ["cancelled"])
+            with patch("runnable.legal_data.aget_legal_data", legal_data):
+                self.assertEqual(asyncio.run(main(abuild_company_schema)), ["cancelled", "cancelled"])
+
+    # Une URL non enregistrée répond 404
+    def test_unknown_url(self):
+        response = self.recordings.respond(httpx.Request("GET", "https://www.example.be/"))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestBenchmarkResults(unittest.TestCase):
+
+    def test_percentile(self):
+        values = [0.1 * i for i in range(1, 21)]
+        self.assertAlmostEqual(percentile(values, 50), 1.0)
+        self.assertAlmostEqual(percentile(values, 95), 1.9)
+
+    # Seules la médiane et le débit font échouer la comparaison
+    def test_compare(self):
+        def results(p50, p95, throughput):
+            value = {"p50_ms": p50, "p95_ms": p95, "throughput": throughput}
+            return {"meta": {"date": "2024-01-01"}, "steps": {}, "pipeline": {"arun": {"4": value}}}
+
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(compare(results(100, 300, 10), results(100, 150, 10), 0.1), [])
+            self.assertEqual(
+                compare(results(120, 150, 8), results(100, 150, 10), 0.1), ["arun/4 p50_ms", "arun/4 throughput"]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
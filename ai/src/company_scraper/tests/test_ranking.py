@@ -0,0 +1,85 @@
+import unittest, os
+from unittest.mock import patch
+from tools.document import Document
+from tools.ranking import *
+from tools.format import parse_kbo
+import runnable.company_description as company_description
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+def make_entry(url: str, title: str = "", content: str = "", vat_numbers=()) -> dict:
+    return {"data": {"url": url, "title": title, "website_content": content, "vat_numbers": list(vat_numbers)}}
+
+
+class TestRanking(unittest.TestCase):
+
+    def setUp(self):
+        self.company = parse_kbo(read_fixture("kbo_0423369762.html"))
+        self.website = company_description.parse_page_data(
+            "https://www.brico-planit.be/fr",
+            [Document(read_fixture("website_brico_planit.html"))],
+            self.company.name,
+        )
+
+    # Le numéro de TVA est trouvé dans le pied de page et le JSON-LD
+    def test_find_vat_numbers(self):
+        self.assertEqual(self.website["data"]["vat_numbers"], ["0423369762"])
+        self.assertEqual(find_vat_numbers("Tél. 0471 23 45 67"), [])
+
+    # Le site officiel remporte tous les signaux
+    def test_official_website_wins(self):
+        directory = make_entry("https://www.annuaire-bricolage.be/magasins", "Annuaire des magasins")
+        ranking = rank_websites([directory, self.website], self.company)
+        self.assertGreater(ranking[0]["data"]["score"], 90)
+        winner, contenders = pick_website(ranking)
+        self.assertIs(winner, self.website)
+
+    # Deux candidats proches sont départagés par le LLM
+    def test_close_candidates(self):
+        first = make_entry("https://www.brico-planit.be", "Brico Plan-It")
+        second = make_entry("https://www.bricoplanit.com", "Brico Plan-It")
+        winner, contenders = pick_website(rank_websites([first, second], self.company))
+        self.assertIsNone(winner)
+        self.assertEqual(len(contenders), 2)
+
+    # Les domaines sans chance de gagner ne sont pas téléchargés
+    def test_skip_hopeless_candidates(self):
+        urls = ["https://www.annuaire-bricolage.be/x", "https://www.brico-planit.be/fr"]
+        loaded = []
+
+        def parallel_execution(urls, company_name):
+            loaded.extend(urls)
+            return [self.website] if any("brico-planit" in url for url in urls) else []
+
+        with patch.object(company_description, "parallel_execution", parallel_execution):
+            websites_data = company_description.load_candidates(urls, self.company)
+        self.assertEqual(loaded, ["https://www.brico-planit.be/fr"])
+        self.assertEqual(websites_data, [self.website])
+
+    # Les domaines qui ne pourraient jamais être écartés sont téléchargés dès la première vague
+    def test_first_wave(self):
+        urls = ["https://www.annuaire-bricolage.be/x", "https://www.bricoplanit.com", "https://www.brico-planit.be/fr"]
+        waves = []
+
+        def parallel_execution(urls, company_name):
+            waves.append(list(urls))
+            return [self.website] if any("brico-planit" in url for url in urls) else []
+
+        with patch.object(company_description, "parallel_execution", parallel_execution):
+            company_description.load_candidates(urls, self.company)
+        # L'annuaire ne peut plus égaler le site officiel, il n'est pas téléchargé
+        self.assertEqual(waves, [["https://www.bricoplanit.com", "https://www.brico-planit.be/fr"], []])
+
+        first, others = split_candidates(sort_urls(urls, self.company), self.company)
+        self.assertEqual(others, ["https://www.annuaire-bricolage.be/x"])
+        self.assertEqual(split_candidates([], self.company), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest, os
+from unittest.mock import patch
+from tools.document import Document
+from tools.reduce import *
+from tools.format import parse_html, soup_to_markdown
+from runnable.company_description import parse_page_data
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+# Comptage approximatif, indépendant du téléchargement de l'encodage tiktoken
+@patch("tools.reduce.get_encoding", return_value=None)
+class TestReduceContent(unittest.TestCase):
+
+    def setUp(self):
+        self.html = read_fixture("website_brico_planit.html")
+
+    # Bandeau cookies, navigation et pied de page sont retirés
+    def test_strip_boilerplate(self, _):
+        markdown = soup_to_markdown(strip_boilerplate(parse_html(self.html)))
+        self.assertNotIn("Tout accepter", markdown)
+        self.assertNotIn("Navigation principale", markdown)
+        self.assertIn("le bricolage à portée de main", markdown)
+
+    # Chaque classe est testée séparément, y compris avec plusieurs classes
+    def test_boilerplate_classes(self, _):
+        soup = parse_html(
+            '<div class="main-nav container">Accueil</div><div class="sidebar wide">Liens</div>'
+            '<div class="navigator intro">Produits</div><div id="site_footer">Contact</div>'
+        )
+        self.assertEqual([is_boilerplate(tag) for tag in soup.find_all("div")], [True, True, False, True])
+
+    # Les blocs répétés ne sont gardés qu'une fois, sans les URLs des liens
+    def test_deduplicate_blocks(self, _):
+        markdown = clean_markdown("### [Vis](/p/0)\n\nA\n\n### [Vis](/p/8)\n\nA\n\n![logo](/l.svg)B")
+        self.assertEqual(markdown, "### Vis\n\nA\n\nB")
+
+    # Le contenu tient dans le budget et se termine sur une ligne complète
+    def test_truncate_to_budget(self, _):
+        text = "\n".join(f"Ligne numéro {i} du site" for i in range(200))
+        truncated = truncate_tokens(text, 100)
+        self.assertLessEqual(count_tokens(truncated), 100)
+        self.assertTrue(truncated.endswith("du site"))
+        self.assertEqual(truncate_tokens("court", 100), "court")
+
+    # Les métadonnées restent lues avant la suppression des éléments inutiles
+    def test_page_data(self, _):
+        data = parse_page_data("https://www.brico-planit.be", [Document(self.html)], "Brico Plan-It")["data"]
+        self.assertEqual(data["og_title"], "Brico Plan-It - Tout pour vos projets de bricolage")
+        self.assertLess(count_tokens(data["website_content"]), count_tokens(soup_to_markdown(parse_html(self.html))) / 2)
+
+    # Seule la copie envoyée à FIND_URL est réduite
+    def test_reduce_candidates(self, _):
+        websites_data = [{"data": {"url": "https://a.be", "website_content": "mot " * 5000}}]
+        candidates = reduce_candidates(websites_data, 50)
+        self.assertLessEqual(count_tokens(candidates[0]["data"]["website_content"]), 50)
+        self.assertEqual(len(websites_data[0]["data"]["website_content"]), 20000)
+
+
+if __name__ == "__main__":
+    unittest.main()
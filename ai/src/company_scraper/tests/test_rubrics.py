@@ -0,0 +1,132 @@
+import unittest, os
+import httpx
+from io import StringIO
+from tools.rubrics import *
+from unittest.mock import patch
+from tools.utils import extract_financial_data, get_financial_data, aget_financial_data, load_csv_to_dict, safe_float
+from tools.document import Document
+from tools.financial import parse_rubrics
+from tools.cbso import CbsoClient
+from tools.cache import HttpCache, MemoryCache
+from config.config import asyncio
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as file:
+        return file.read()
+
+
+class TestIterRubrics(unittest.TestCase):
+
+    # Valeurs typées avec la virgule décimale, les lignes de texte sont ignorées
+    def test_typed_values(self):
+        text = '"Enterprise name","BRICO, PLANIT"\n"Model code","m02-f"\n"70","1234,5"\n"10/49","-12.25"\n"9087",""\n'
+        self.assertEqual(
+            list(iter_rubrics(StringIO(text))), [("Model code", "m02-f"), ("70", 1234.5), ("10/49", -12.25)]
+        )
+
+    # La lecture s'arrête dès que tous les codes demandés sont trouvés
+    def test_early_stop(self):
+        lines = StringIO(read_fixture("cbso_account_m02-f.csv"))
+        self.assertEqual(dict(iter_rubrics(lines, ["10/15", "10/49"])), {"10/15": 3456789.01, "10/49": 9876543.21})
+        self.assertTrue(next(lines).startswith('"70/76A"'))  # Ligne suivant "10/49", non lue
+        self.assertGreater(lines.read().count("\n"), 200)
+
+    # Mêmes indicateurs qu'avec le chargement complet du CSV
+    def test_extract_financial_data(self):
+        for name in ("cbso_account_m02-f.csv", "cbso_account_m81-f.csv"):
+            text = read_fixture(name)
+            data = load_csv_to_dict(text)
+            financial_data = extract_financial_data(text)
+            self.assertEqual(financial_data["model"], data["Model code"])
+            self.assertEqual(financial_data["employees"], safe_float(data["1003"]))
+            self.assertEqual(financial_data["total asset"], safe_float(data["10/49"]))
+            self.assertEqual(financial_data["year revenue"], safe_float(data["70"]))
+        self.assertAlmostEqual(
+            extract_financial_data(read_fixture("cbso_account_m02-f.csv"))["gross margin"],
+            12345678.90 + 234567.10 - 7654321.00 - 1987654.32,
+        )
+
+    # Une page vide ou d'erreur ne donne pas des indicateurs à zéro
+    def test_extract_financial_data_without_account(self):
+        self.assertIsNone(extract_financial_data(""))
+        self.assertIsNone(extract_financial_data("<html><body>Service unavailable</body></html>"))
+
+    # Une liste des dépôts vide ou une page d'erreur ne fait pas échouer le pipeline
+    def test_invalid_deposits_list(self):
+        class ErrorPages:
+            def run(self, url):
+                return [Document(page_content="<html>Service unavailable</html>")]
+
+            async def arun(self, url):
+                return [Document(page_content="")]
+
+        with patch("tools.utils.scraper", ErrorPages()), self.assertLogs(level="ERROR"):
+            self.assertIsNone(get_financial_data("0423369762"))
+            self.assertIsNone(asyncio.run(aget_financial_data("0423369762")))
+
+    # Le lecteur incrémental donne le même résultat que la lecture complète
+    def test_reader(self):
+        text = read_fixture("cbso_account_m81-f.csv")
+        reader = RubricReader()
+        for line in text.splitlines():
+            self.assertFalse(reader.feed(line))
+        model, rubrics, values = reader.result()
+        expected_model, expected_rubrics, expected_values = parse_rubrics(text)
+        self.assertEqual((model, rubrics, list(values)), (expected_model, expected_rubrics, list(expected_values)))
+        self.assertEqual(model, "m81-f")
+        self.assertEqual(values[rubrics.index("9900")], 845612.30)
+
+        reader = RubricReader(["70", "10/49"])
+        done = [reader.feed(line) for line in text.splitlines()[:113]]
+        self.assertEqual(done[-2:], [False, True])
+        self.assertEqual(reader.result()[:2], ("m81-f", ["10/49", "70"]))
+
+
+class TestStreamedAccount(unittest.TestCase):
+
+    # Sans mise en cache des CSV, le reste de la réponse n'est pas téléchargé après l'arrêt anticipé
+    def test_partial_download(self):
+        lines = read_fixture("cbso_account_m02-f.csv").splitlines(keepends=True)
+        sent = []
+
+        async def body():
+            for line in lines:
+                sent.append(line)
+                yield line.encode()
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(200, content=body(), headers={"content-type": "text/csv"})
+
+        client = CbsoClient(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache(), ttls={}),
+            concurrency=1,
+        )
+        model, rubrics, values = asyncio.run(client.aget_account("a2023", ["10/15", "10/49"]))
+        self.assertEqual((model, rubrics, list(values)), ("m02-f", ["10/15", "10/49"], [3456789.01, 9876543.21]))
+        self.assertLess(len(sent), len(lines) / 2)
+
+    # Un dépôt publié ne change plus : son CSV n'est téléchargé qu'une fois
+    def test_cached_account(self):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(str(request.url))
+            return httpx.Response(200, text=read_fixture("cbso_account_m02-f.csv"), headers={"content-type": "text/csv"})
+
+        client = CbsoClient(
+            async_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            cache=HttpCache(MemoryCache()),
+            concurrency=1,
+        )
+        results = [asyncio.run(client.aget_account("a2023", codes)) for codes in (["10/49"], ["10/15", "10/49"])]
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(results[0][:2], ("m02-f", ["10/49"]))
+        self.assertEqual(list(results[1][2]), [3456789.01, 9876543.21])
+
+
+if __name__ == "__main__":
+    unittest.main()
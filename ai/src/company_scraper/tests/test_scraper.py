@@ -0,0 +1,116 @@
+import unittest, httpx, threading, time
+from tools.scraper import *
+from tools.cache import *
+from tools.hosts import HostLimits
+
+
+KBO_URL = "https://kbopub.economie.fgov.be/kbopub/zoeknummerform.html?nummer=0423369762"
+
+
+# Serveur simulé : une page HTML, un PDF, une page KBO avec ETag et un hôte en panne
+def handler(request: httpx.Request) -> httpx.Response:
+    if request.url.host == "kbopub.economie.fgov.be":
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers={"etag": '"v1"'})
+        return httpx.Response(200, text="<html>KBO</html>", headers={"etag": '"v1"'})
+    if request.url.host == "down.be":
+        return httpx.Response(503)
+    if request.url.path.endswith(".pdf"):
+        return httpx.Response(
+            200, content=b"%PDF-1.7\x00", headers={"content-type": "application/pdf"}
+        )
+    return httpx.Response(
+        200, text="<html>Société</html>", headers={"content-type": "text/html"}
+    )
+
+
+class ThreadCache(MemoryCache):
+    """Cache qui note le thread de chaque lecture et écriture."""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def get(self, key: str):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key: str, value, ttl: float = None):
+        self.threads.append(threading.get_ident())
+        super().set(key, value, ttl)
+
+
+class TestCompanyScraper(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.requests = []
+
+        def recording_handler(request):
+            self.requests.append(request)
+            return handler(request)
+
+        transport = httpx.MockTransport(recording_handler)
+        self.cache = HttpCache(MemoryCache())
+        self.scraper = CompanyScraper(
+            client=httpx.Client(transport=transport),
+            async_client=httpx.AsyncClient(transport=transport),
+            cache=self.cache,
+            limits=HostLimits(),
+        )
+
+    # Une seule requête GET, sans HEAD préalable
+    def test_single_get_request(self):
+        documents = self.scraper.run("https://example.be/")
+        self.assertEqual(documents[0].page_content, "<html>Société</html>")
+        self.assertEqual([r.method for r in self.requests], ["GET"])
+
+    # Les contenus binaires sont ignorés
+    async def test_binary_content_is_rejected(self):
+        documents = await self.scraper.arun("https://example.be/comptes.pdf")
+        self.assertEqual(documents[0].page_content, "")
+
+    # Un hôte en panne n'est plus interrogé pendant un moment
+    async def test_failed_host_is_skipped(self):
+        await self.scraper.arun("https://down.be/a")
+        documents = await self.scraper.arun("https://down.be/b")
+        self.assertEqual(documents[0].page_content, "")
+        self.assertEqual(len(self.requests), 1)
+
+    # Une page KBO encore fraîche est servie depuis le cache
+    def test_fresh_response_from_cache(self):
+        self.scraper.run(KBO_URL)
+        documents = self.scraper.run(KBO_URL)
+        self.assertEqual(documents[0].page_content, "<html>KBO</html>")
+        self.assertEqual(len(self.requests), 1)
+
+    # Une page KBO expirée est revalidée grâce à son ETag
+    async def test_stale_response_is_revalidated(self):
+        await self.scraper.arun(KBO_URL)
+        key = self.cache.get_key(KBO_URL)
+        self.cache.backend.get(key)["fresh_until"] = time.time() - 1
+
+        documents = await self.scraper.arun(KBO_URL)
+        self.assertEqual(documents[0].page_content, "<html>KBO</html>")
+        self.assertEqual(self.requests[-1].headers["if-none-match"], '"v1"')
+        self.assertEqual(self.cache.stats["revalidated"], 1)
+
+    # Le chargement asynchrone ne lit ni n'écrit le cache dans la boucle d'événements
+    async def test_async_cache_access_in_thread(self):
+        backend = ThreadCache()
+        self.scraper.cache = HttpCache(backend)
+        await self.scraper.arun(KBO_URL)
+        documents = await self.scraper.arun(KBO_URL)
+        self.assertEqual(documents[0].page_content, "<html>KBO</html>")
+        self.assertEqual(len(backend.threads), 3)  # miss, écriture, hit
+        self.assertNotIn(threading.get_ident(), backend.threads)
+
+    # Les paramètres de l'URL sont normalisés
+    def test_normalize_url(self):
+        self.assertEqual(
+            normalize_url("HTTPS://Example.BE/a?b=2&a=1#top"),
+            "https://example.be/a?a=1&b=2",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
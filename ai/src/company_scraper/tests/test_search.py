@@ -0,0 +1,163 @@
+import unittest, asyncio, threading, time, httpx
+from concurrent.futures import ThreadPoolExecutor
+from tools.cache import MemoryCache
+from tools.client import set_clients
+from tools.hosts import HostLimits
+from tools.search import *
+from tests.test_scraper import ThreadCache
+
+RESULTS = {
+    "Brico Plan-It": ["https://www.brico-planit.be/", "https://www.companyweb.be/fr/0423369762"],
+    "Brico Plan-It Deco": ["https://www.planit-deco.be/"],
+}
+
+
+class CountingSearch(StaticSearch):
+    """Fournisseur statique qui compte ses requêtes et peut échouer."""
+
+    def __init__(self, results: dict, name: str = "static", error: Exception = None, delay: float = 0.0, host: str = None):
+        super().__init__(results)
+        self.name = name
+        self.host = host
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, query: str, num_results: int):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return super().search(query, num_results)
+
+    async def asearch(self, query: str, num_results: int):
+        return self.search(query, num_results)
+
+
+class TestProviders(unittest.TestCase):
+
+    # La requête contient le nom de l'entreprise suivi de son adresse
+    def test_static_search(self):
+        provider = StaticSearch(RESULTS)
+        self.assertEqual(provider.search("Brico Plan-It Rue de la Station 1", 5), RESULTS["Brico Plan-It"])
+        self.assertEqual(provider.search("Brico Plan-It Deco Bruxelles", 5), RESULTS["Brico Plan-It Deco"])
+        self.assertEqual(provider.search("Brico Plan-It", 1), RESULTS["Brico Plan-It"][:1])
+        self.assertEqual(provider.search("Inconnue", 5), [])
+
+    def test_searxng_search(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.assertEqual(request.url.path, "/search")
+            self.assertEqual(request.url.params["format"], "json")
+            results = [{"url": "https://www.brico-planit.be/"}, {"title": "Sans URL"}, {"url": "https://a.be/"}]
+            return httpx.Response(200, json={"results": results})
+
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        set_clients(client)
+        try:
+            provider = SearxngSearch("http://localhost:8888/")
+            self.assertEqual(provider.search("Brico Plan-It", 5), ["https://www.brico-planit.be/", "https://a.be/"])
+            self.assertEqual(provider.search("Brico Plan-It", 1), ["https://www.brico-planit.be/"])
+        finally:
+            client.close()  # Le client partagé est recréé au prochain appel
+
+    def test_merge_results(self):
+        merged = merge_results(
+            [["https://www.a.be/", "https://b.be/x"], ["https://a.be", "https://c.be/", "https://d.be/"]], 3
+        )
+        self.assertEqual(merged, ["https://www.a.be/", "https://b.be/x", "https://c.be/"])
+
+
+class TestSearchEngine(unittest.TestCase):
+
+    def make_engine(self, *providers, fan_out=False) -> SearchEngine:
+        limits = HostLimits(rates={}, default_rate=None)
+        return SearchEngine(list(providers), backend=MemoryCache(), ttl=60, fan_out=fan_out, limits=limits)
+
+    # Les résultats sont réutilisés pour la même entreprise, quelle que soit la casse
+    def test_cache(self):
+        provider = CountingSearch(RESULTS)
+        engine = self.make_engine(provider)
+        self.assertEqual(engine.search("Brico Plan-It", "Rue 1"), RESULTS["Brico Plan-It"])
+        self.assertEqual(engine.search(" brico plan-it", "RUE 1 "), RESULTS["Brico Plan-It"])
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(engine.stats, {"hit": 1, "miss": 1})
+
+        # Une recherche sans résultat n'est pas mise en cache
+        engine.search("Inconnue", "Rue 1")
+        engine.search("Inconnue", "Rue 1")
+        self.assertEqual(provider.calls, 3)
+
+    def test_concurrent_searches_share_one_query(self):
+        provider = CountingSearch(RESULTS, delay=0.1)
+        engine = self.make_engine(provider)
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: engine.search("Brico Plan-It", "Rue 1"), range(5)))
+        self.assertEqual(results, [RESULTS["Brico Plan-It"]] * 5)
+        self.assertEqual(provider.calls, 1)
+
+    # Le fournisseur suivant n'est interrogé que si le premier échoue
+    def test_fallback(self):
+        failing = CountingSearch(RESULTS, name="google", error=RuntimeError("429 Too Many Requests"))
+        backup = CountingSearch(RESULTS, name="searxng")
+        engine = self.make_engine(failing, backup)
+        self.assertEqual(engine.search("Brico Plan-It", "Rue 1"), RESULTS["Brico Plan-It"])
+        self.assertEqual((failing.calls, backup.calls), (1, 1))
+        self.assertEqual(engine.provider_stats["google"]["failure"], 1)
+
+        engine = self.make_engine(CountingSearch(RESULTS, name="google"), backup)
+        engine.search("Brico Plan-It", "Rue 1")
+        self.assertEqual(backup.calls, 1)
+
+    # Tant que le circuit de son hôte est ouvert, le fournisseur n'est plus interrogé
+    def test_open_circuit_is_skipped(self):
+        failing = CountingSearch(RESULTS, name="google", error=RuntimeError("blocked"), host="www.google.com")
+        backup = CountingSearch(RESULTS, name="searxng")
+        engine = self.make_engine(failing, backup)
+        engine.limits.thresholds = {"www.google.com": 1}
+        engine.search("Brico Plan-It", "Rue 1")
+        engine.search("Brico Plan-It Deco", "Rue 2")
+        self.assertEqual((failing.calls, backup.calls), (1, 2))
+        self.assertEqual(engine.provider_stats["google"]["skipped"], 1)
+
+    def test_fan_out(self):
+        first = CountingSearch({"Brico": ["https://www.brico-planit.be/", "https://www.companyweb.be/"]}, "google", delay=0.2)
+        second = CountingSearch({"Brico": ["https://brico-planit.be", "https://www.planit-deco.be/"]}, "searxng", delay=0.2)
+        engine = self.make_engine(first, second, fan_out=True)
+        start = time.perf_counter()
+        urls = engine.search("Brico", "Rue 1", num_results=5)
+        self.assertLess(time.perf_counter() - start, 0.35)
+        self.assertEqual(
+            urls, ["https://www.brico-planit.be/", "https://www.companyweb.be/", "https://www.planit-deco.be/"]
+        )
+
+        engine = self.make_engine(first, second, fan_out=True)
+        self.assertEqual(asyncio.run(engine.asearch("Brico", "Rue 1", num_results=5)), urls)
+
+    def test_asearch(self):
+        failing = CountingSearch(RESULTS, name="google", error=RuntimeError("blocked"))
+        engine = self.make_engine(failing, CountingSearch(RESULTS, name="searxng"))
+
+        async def search():
+            return await asyncio.gather(*(engine.asearch("Brico Plan-It", "Rue 1") for _ in range(3)))
+
+        self.assertEqual(asyncio.run(search()), [RESULTS["Brico Plan-It"]] * 3)
+        self.assertEqual(failing.calls, 1)
+
+    # La recherche asynchrone ne lit ni n'écrit le cache dans la boucle d'événements
+    def test_asearch_cache_in_thread(self):
+        backend = ThreadCache()
+        limits = HostLimits(rates={}, default_rate=None)
+        engine = SearchEngine([CountingSearch(RESULTS)], backend=backend, ttl=60, limits=limits)
+
+        async def search():
+            results = [await engine.asearch("Brico Plan-It", "Rue 1") for _ in range(2)]
+            return results, threading.get_ident()
+
+        results, loop_thread = asyncio.run(search())
+        self.assertEqual(results, [RESULTS["Brico Plan-It"]] * 2)
+        self.assertEqual(len(backend.threads), 3)
+        self.assertNotIn(loop_thread, backend.threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
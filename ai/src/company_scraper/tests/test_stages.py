@@ -0,0 +1,164 @@
+import unittest
+from unittest.mock import patch
+from tools.cache import MemoryCache
+from tools.stages import *
+from runnable.company_description import describe_company
+from runnable.legal_data import get_financial_stage
+from schema.company_schema import *
+
+
+def make_schema() -> CompanySchema:
+    return CompanySchema(
+        name="Brico",
+        vat_number="0423369762",
+        address=AddressSchema(street="Rue de l'Industrie", street_number="12", postal_code="1400"),
+        activities=ActivitiesSchema(),
+        financial=FinancialSchema(),
+        contact=ContactSchema(),
+    )
+
+
+class TestStageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StageStore(MemoryCache())
+
+    # Une étape dont l'empreinte est inchangée est reprise de l'exécution précédente
+    def test_reuse(self):
+        stages = self.store.start("0423.369.762")
+        self.assertEqual(stages.reuse("financial", fingerprint("d1")), (False, None))
+        stages.record("financial", fingerprint("d1"), ["small", {"employees": 12}])
+        stages.save()
+
+        stages = self.store.start("0423369762")
+        self.assertEqual(stages.reuse("financial", fingerprint("d1")), (True, ["small", {"employees": 12}]))
+        self.assertEqual(stages.reuse("address", fingerprint("d1")), (False, None))
+        self.assertFalse(self.store.start("0423369762", force=True).reuse("financial", fingerprint("d1"))[0])
+        self.assertFalse(self.store.start("0423369762").reuse("financial", fingerprint("d2"))[0])
+        self.assertEqual(self.store.stats["financial"], {"computed": 1, "reused": 1})
+
+    # Les étapes non exécutées restent enregistrées
+    def test_partial_run_keeps_previous_stages(self):
+        stages = self.store.start("0423369762")
+        stages.record("legal", "a", {})
+        stages.record("address", "b", {})
+        stages.save()
+        stages = self.store.start("0423369762")
+        stages.record("address", "c", {})
+        stages.save()
+        self.assertEqual(set(self.store.load("0423369762")), {"legal", "address"})
+        self.assertEqual(self.store.load("0423369762")["address"]["fingerprint"], "c")
+
+    # Sans numéro de TVA, rien n'est enregistré
+    def test_without_vat_number(self):
+        stages = self.store.start(None)
+        stages.record("legal", "a", {})
+        stages.save()
+        self.assertEqual(stages.reuse("legal", "a"), (False, None))
+
+    # Seules les étapes demandées sont recalculées, chaque étape terminée est signalée
+    def test_forced_stages_and_listener(self):
+        stages = self.store.start("0423369762")
+        stages.record("legal", "a", {})
+        stages.record("address", "b", {})
+        stages.save()
+
+        events = []
+        with track_stages(lambda stage, reused, fragment: events.append((stage, reused))):
+            stages = self.store.start("0423369762", force=["address"])
+            self.assertTrue(stages.reuse("legal", "a")[0])
+            self.assertFalse(stages.reuse("address", "b")[0])
+            stages.record("address", "b", {})
+        self.assertEqual(events, [("legal", True), ("address", False)])
+
+    def test_content_hash_ignores_whitespace(self):
+        self.assertEqual(content_hash("Brico  Planit\n"), content_hash("Brico Planit"))
+
+
+class TestIncrementalStages(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StageStore(MemoryCache())
+        self.content = "Vente de matériel de bricolage"
+        self.description = {"description": "Magasin de bricolage", "sectors": ["Commerce"], "services": []}
+
+    def load_website(self, url: str) -> dict:
+        return {"data": {"url": url, "website_content": self.content}}
+
+    def describe(self, find_website, get_description):
+        with patch("runnable.company_description.find_website", find_website), patch(
+            "runnable.company_description.get_company_description", get_description
+        ), patch("runnable.company_description.load_website_data", self.load_website):
+            stages = self.store.start("0423369762")
+            result = describe_company(make_schema(), stages)
+            stages.save()
+            return result
+
+    # Deuxième exécution : ni recherche du site ni appel au LLM si le contenu est inchangé
+    def test_unchanged_website_is_not_described_again(self):
+        calls = {"find": 0, "describe": 0}
+
+        def find_website(company_schema):
+            calls["find"] += 1
+            return self.load_website("https://www.brico.be")
+
+        def get_description(content):
+            calls["describe"] += 1
+            return self.description
+
+        first = self.describe(find_website, get_description)
+        second = self.describe(find_website, get_description)
+        self.assertEqual(first, second)
+        self.assertEqual(calls, {"find": 1, "describe": 1})
+
+        # Le contenu du site a changé : la description est refaite, pas la recherche
+        self.content = "Vente et location de matériel de bricolage"
+        self.describe(find_website, get_description)
+        self.assertEqual(calls, {"find": 1, "describe": 2})
+
+    # Un site introuvable (recherche limitée, bloquée) est recherché à nouveau à l'exécution suivante
+    def test_website_not_found_is_not_stored(self):
+        calls = []
+
+        def find_website(company_schema):
+            calls.append(company_schema.name)
+            return None
+
+        self.assertIsNone(self.describe(find_website, lambda content: self.description))
+        self.assertIsNone(self.describe(find_website, lambda content: self.description))
+        self.assertEqual(len(calls), 2)
+        self.assertNotIn("website", self.store.load("0423369762"))
+
+    # Un échec de lecture des dépôts ou des comptes annuels n'est pas enregistré
+    def test_failed_financial_lookup_is_not_stored(self):
+        for deposit_id, data in ((None, None), ("2023-001", None)):
+            with patch("runnable.legal_data.get_latest_deposit_id", lambda vat: deposit_id), patch(
+                "runnable.legal_data.get_size_and_financial_data", lambda vat, deposit: data
+            ):
+                stages = self.store.start("0423369762")
+                self.assertIsNone(get_financial_stage("0423369762", stages))
+                stages.save()
+            self.assertNotIn("financial", self.store.load("0423369762"))
+
+    # Les données financières ne sont relues qu'après un nouveau dépôt
+    def test_financial_stage(self):
+        deposits = ["2023-001"]
+        calls = []
+
+        def get_data(vat_number, deposit_id):
+            calls.append(deposit_id)
+            return ["small", {"employees": 12, "gross margin": 1000}]
+
+        with patch("runnable.legal_data.get_latest_deposit_id", lambda vat: deposits[-1]), patch(
+            "runnable.legal_data.get_size_and_financial_data", get_data
+        ):
+            for deposit in ["2023-001", "2023-001", "2024-001"]:
+                deposits.append(deposit)
+                stages = self.store.start("0423369762")
+                self.assertEqual(get_financial_stage("0423369762", stages)[0], "small")
+                stages.save()
+        self.assertEqual(calls, ["2023-001", "2024-001"])
+
+
+if __name__ == "__main__":
+    unittest.main()
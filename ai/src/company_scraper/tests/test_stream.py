@@ -0,0 +1,74 @@
+import unittest, asyncio, json
+from unittest.mock import patch
+from benchmarks.offline import Recordings, FakeLLM, offline
+from runnable.stream import *
+
+
+async def collect(stream) -> list:
+    return [event async for event in stream]
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.recordings = Recordings(1)
+        self.company = self.recordings.companies[0]
+
+    def stream(self, fields: dict) -> list:
+        with offline(self.recordings, FakeLLM()):
+            return asyncio.run(collect(astream(fields)))
+
+    # Les données légales arrivent d'abord, puis chaque étape, et le schéma complet à la fin
+    def test_patches(self):
+        events = self.stream({"vat_number": self.company.vat_number})
+        stages = [event["stage"] for event in events if event["event"] == "patch"]
+        self.assertEqual(stages[0], "legal")
+        self.assertEqual(set(stages), {"legal", "address", "financial", "website", "description"})
+        self.assertEqual(len(stages), 5)
+        self.assertLess(stages.index("website"), stages.index("description"))
+
+        done = events[-1]
+        self.assertEqual(done["event"], "done")
+        self.assertEqual(done["data"]["name"], self.company.name)
+        self.assertIn("stage:legal", done["timings"]["steps"])
+
+        # Les patchs appliqués les uns après les autres donnent le schéma complet
+        data = {}
+        for event in events[:-1]:
+            merge_patch(data, event["data"])
+        self.assertEqual(data, done["data"])
+        self.assertEqual(data["financial"]["company_size"], "small")
+        self.assertEqual(data["contact"]["website"], f"https://{self.company.host}/")
+
+    def test_company_not_found(self):
+        with patch("runnable.company_scraper.aget_legal_data", return_value=None):
+            events = self.stream({"vat_number": "0000000000"})
+        self.assertEqual([event["event"] for event in events], ["error"])
+
+    # Une erreur du pipeline termine le flux SSE par un événement "error"
+    def test_sse(self):
+        with offline(self.recordings, FakeLLM()):
+            chunks = asyncio.run(collect(astream_sse({"vat_number": self.company.vat_number})))
+        self.assertTrue(chunks[0].startswith("id: 0\nevent: patch\ndata: {"))
+        self.assertTrue(all(chunk.endswith("\n\n") and chunk.count("\n") == 4 for chunk in chunks))
+        self.assertEqual(json.loads(chunks[0].split("data: ", 1)[1])["stage"], "legal")
+        self.assertTrue(chunks[-1].startswith(f"id: {len(chunks) - 1}\nevent: done\n"))
+
+        async def fail(*args):
+            raise RuntimeError("KBO indisponible")
+
+        with patch("runnable.company_scraper.aget_legal_data", fail):
+            chunks = asyncio.run(collect(astream_sse({"vat_number": self.company.vat_number})))
+        self.assertEqual(chunks, ['id: 0\nevent: error\ndata: {"data": {"message": "KBO indisponible"}}\n\n'])
+
+    def test_merge_patch(self):
+        data = {"address": {"city": "Auderghem", "region": ""}, "name": "Brico"}
+        merge_patch(data, {"address": {"region": "Bruxelles"}, "contact": {"website": "https://brico.be"}})
+        self.assertEqual(
+            data,
+            {"address": {"city": "Auderghem", "region": "Bruxelles"}, "name": "Brico", "contact": {"website": "https://brico.be"}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
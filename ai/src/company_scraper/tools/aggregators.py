@@ -0,0 +1,98 @@
+from config.aggregators import *
+from urllib.parse import urlsplit
+import hashlib, logging, re, threading
+
+VERSION_HEADER = re.compile(r"#\s*version\s*:\s*(\S+)", re.IGNORECASE)
+
+
+def normalize_domain(value: str) -> str:
+    """Lowercase host of a domain or URL, without "www." nor trailing dot ("" when invalid)."""
+    value = value.strip().casefold()
+    if "/" in value:
+        value = urlsplit(value if "//" in value else f"//{value}").hostname or ""
+    value = value.rstrip(".")
+    while value.startswith("www."):
+        value = value[4:]
+    return value
+
+
+def is_public_suffix(domain: str) -> bool:
+    return "." not in domain or domain in PUBLIC_SUFFIXES
+
+
+class DomainIndex:
+    """
+    Blocklist of domains matched by suffix: "kompass.com" also blocks "be.kompass.com".
+    A lookup costs one set membership test by label of the host, whatever the size of the list.
+    """
+
+    def __init__(self, domains=(), version: str = None):
+        self.domains = set()
+        self.version = version
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain: str) -> bool:
+        """Add a domain, public suffixes are rejected since they would block everything under them."""
+        domain = normalize_domain(domain)
+        if not domain or is_public_suffix(domain):
+            logging.warning(f"Invalid aggregator domain ignored: {domain!r}")
+            return False
+        self.domains.add(domain)
+        return True
+
+    def load(self, path: str):
+        """
+        Read a blocklist file: one domain per line, "#" comments and an optional "# version: X" header.
+        Without header, the version is a hash of the domains.
+        """
+        version = None
+        try:
+            with open(path, encoding="utf-8-sig") as file:
+                for line in file:
+                    line = line.strip()
+                    if line.startswith("#"):
+                        match = VERSION_HEADER.match(line)
+                        if match and version is None:
+                            version = match.group(1)
+                    elif line:
+                        self.add(line)
+        except OSError as e:
+            logging.warning(f"Aggregators file {path} unavailable, no URL is filtered by domain: {e}")
+        self.version = version or hashlib.sha256("\n".join(sorted(self.domains)).encode()).hexdigest()[:12]
+
+    def __contains__(self, host: str) -> bool:
+        """Whether the host or one of its parent domains is listed, e.g. for an URL `hostname`."""
+        host = host.rstrip(".").casefold()
+        start = 0
+        # The suffixes of the host, but not its top-level domain
+        while (dot := host.find(".", start)) >= 0:
+            if host[start:] in self.domains:
+                return True
+            start = dot + 1
+        return False
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+
+_lock = threading.Lock()
+_aggregators = None
+
+
+def get_aggregators() -> DomainIndex:
+    """Return the aggregators blocklist, loaded from `AGGREGATORS_FILE` on first use."""
+    global _aggregators
+    with _lock:
+        if _aggregators is None:
+            _aggregators = DomainIndex()
+            _aggregators.load(AGGREGATORS_FILE)
+        return _aggregators
+
+
+def set_aggregators(aggregators: DomainIndex):
+    """Replace the aggregators blocklist, e.g. after loading a larger file."""
+    global _aggregators
+    with _lock:
+        _aggregators = aggregators
+
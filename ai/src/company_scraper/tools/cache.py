@@ -0,0 +1,341 @@
+from .metrics import metrics
+from config.cache import *
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from email.utils import formatdate
+import asyncio, copy, json, logging, os, sqlite3, threading, time, weakref, httpx
+
+
+class CacheBackend:
+    """Key/value store of JSON serializable values with an optional time to live (seconds)."""
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Backend that never stores anything, used when the cache is disabled."""
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value, ttl: float = None):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """In-process backend, mainly for tests."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key: str):
+        value, expires_at = self.entries.get(key, (None, None))
+        if expires_at is not None and expires_at < time.time():
+            self.entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value, ttl: float = None):
+        self.entries[key] = (value, time.time() + ttl if ttl is not None else None)
+
+    def delete(self, key: str):
+        self.entries.pop(key, None)
+
+
+class SQLiteCache(CacheBackend):
+    """On-disk backend stored in a single SQLite file, shared by the threads of the process."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+        self.purge()
+
+    def purge(self):
+        """Evict the expired entries."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),),
+            )
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def delete(self, key: str):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisCache(CacheBackend):
+    """Backend stored in Redis, shared between worker processes."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        value = self.redis.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value, ttl: float = None):
+        self.redis.set(key, json.dumps(value), ex=int(ttl) if ttl is not None else None)
+
+    def delete(self, key: str):
+        self.redis.delete(key)
+
+
+def create_cache(url: str) -> CacheBackend:
+    """
+    Create the cache backend described by an URL.
+
+    :param url: "sqlite:///path", "redis://..." or "none".
+    :return CacheBackend: The cache backend.
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url)
+    return NullCache()
+
+
+_lock = threading.Lock()
+_cache = None
+
+
+def get_cache() -> CacheBackend:
+    """Return the process-wide cache backend configured by `CACHE_URL`."""
+    global _cache
+    with _lock:
+        if _cache is None:
+            try:
+                _cache = create_cache(CACHE_URL)
+            except Exception as e:
+                logging.error(f"Cache disabled, {CACHE_URL} is not available: {e}")
+                _cache = NullCache()
+        return _cache
+
+
+def set_cache(cache: CacheBackend):
+    """Replace the process-wide cache backend."""
+    global _cache
+    with _lock:
+        _cache = cache
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key onto a single execution.
+    The caller which computed the result gets it, the others each get a deep copy of it.
+    """
+
+    class Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    class AsyncCall:
+        def __init__(self, future: asyncio.Future):
+            self.future = future
+            self.waiters = 0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = weakref.WeakKeyDictionary()  # Pending futures of each event loop
+
+    def do(self, key: str, func):
+        """
+        Call `func` unless another thread is already computing the same key.
+
+        :return: (result, shared) where shared tells if the result comes from another call.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self.Call()
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result, False
+
+    async def ado(self, key: str, func):
+        """
+        Asynchronous version of `do`, `func` returns the coroutine to await.
+        Cancelling a caller does not cancel the computation shared with the others,
+        the computation is cancelled once every caller is.
+
+        :return: (result, shared) where shared tells if the result comes from another call.
+        """
+        calls = self.async_calls.setdefault(asyncio.get_running_loop(), {})
+        call = calls.get(key)
+        shared = call is not None
+        if not shared:
+            call = calls[key] = self.AsyncCall(asyncio.ensure_future(func()))
+            call.future.add_done_callback(lambda _: self.forget(calls, key, call))
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.future)
+            return (copy.deepcopy(result) if shared else result), shared
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.future.done():
+                self.forget(calls, key, call)  # A new caller starts a new computation
+                call.future.cancel()
+
+    @staticmethod
+    def forget(calls: dict, key: str, call: "SingleFlight.AsyncCall"):
+        if calls.get(key) is call:
+            del calls[key]
+
+
+def normalize_url(url: str) -> str:
+    """Normalize an URL (case of the scheme and host, order of the query parameters, no fragment)."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(
+        (parts.scheme.casefold(), parts.netloc.casefold(), parts.path or "/", query, "")
+    )
+
+
+class HttpCache:
+    """
+    Cache of HTTP responses, keyed by normalized URL, with a freshness per source
+    (`HTTP_CACHE_TTL`). Stale responses having an ETag or a Last-Modified header
+    are revalidated with a conditional request.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttls: dict = HTTP_CACHE_TTL):
+        self._backend = backend
+        self.ttls = ttls
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0}
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache()
+
+    def get_ttl(self, url: str):
+        """
+        Return the freshness of the URL's source.
+
+        :return: (cacheable, ttl) where a ttl of None means the response never expires.
+        """
+        parts = urlsplit(url)
+        location = parts.netloc.casefold() + parts.path
+        for prefix, ttl in self.ttls.items():
+            if location.startswith(prefix):
+                return True, ttl
+        return False, None
+
+    def get_key(self, url: str) -> str:
+        return "http:" + normalize_url(url)
+
+    def lookup(self, url: str):
+        """
+        Look for a cached response of the URL.
+
+        :return: (entry, fresh) where entry is None when nothing is cached.
+        """
+        cacheable, _ = self.get_ttl(url)
+        if not cacheable:
+            return None, False
+        entry = self.backend.get(self.get_key(url))
+        if entry is None:
+            self.stats["miss"] += 1
+            return None, False
+        fresh = entry["fresh_until"] is None or entry["fresh_until"] >= time.time()
+        if fresh:
+            self.stats["hit"] += 1
+        return entry, fresh
+
+    def conditional_headers(self, entry: dict) -> dict:
+        """Return the headers revalidating a stale entry."""
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url: str, response: httpx.Response, content: str, entry: dict = None) -> dict:
+        """
+        Store a successful response, or renew the stale entry confirmed by a 304 response.
+
+        :return dict: The stored entry.
+        """
+        cacheable, ttl = self.get_ttl(url)
+        if not cacheable:
+            return entry
+        validators = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+        if response.status_code == 304 and entry:
+            # The stale entry is still valid, only its freshness is renewed
+            self.stats["revalidated"] += 1
+            content = entry["content"]
+            validators = {key: value or entry.get(key) for key, value in validators.items()}
+
+        entry = {
+            "content": content,
+            **validators,
+            "stored_at": formatdate(usegmt=True),
+            "fresh_until": time.time() + ttl if ttl is not None else None,
+        }
+        # Without validators, a stale entry is useless
+        retention = None
+        if ttl is not None:
+            has_validators = any(validators.values())
+            retention = ttl + (HTTP_CACHE_STALE_RETENTION if has_validators else 0)
+        self.backend.set(self.get_key(url), entry, retention)
+        return entry
+
+
+http_cache = HttpCache()
+metrics.register("http_cache", lambda: http_cache.stats)
@@ -0,0 +1,267 @@
+from .client import get_async_client, get_host, host_semaphore
+from .cache import HttpCache, http_cache
+from .hosts import HostLimits, get_host_limits, get_retry_after, THROTTLE_STATUSES
+from .metrics import metrics
+from .rubrics import RubricReader
+from .financial import FinancialHistory, read_deposits_page, is_last_page, select_deposits
+from .utils import get_deposits_url, get_deposit_csv_url
+from config.config import *
+from typing import AsyncIterator, Iterable
+import asyncio, datetime, random, weakref, httpx
+
+# Statuses of the requests rejected because of the rate limits, retried after a delay
+RETRY_STATUSES = THROTTLE_STATUSES
+
+
+def read_account(content: str, codes: Iterable[str] = None) -> tuple:
+    """Read the rubrics of an annual account CSV, see `RubricReader`."""
+    reader = RubricReader(codes)
+    for line in content.splitlines():
+        if reader.feed(line):
+            break
+    return reader.result()
+
+
+class CbsoError(Exception):
+    """A CBSO request still failing after all its retries."""
+
+
+class CbsoClient:
+    """
+    Client of the NBB CBSO API for bulk backfills. The deposits are paginated lazily,
+    the annual accounts are fetched concurrently and streamed line by line into the parser.
+    """
+
+    def __init__(
+        self,
+        async_client: httpx.AsyncClient = None,
+        cache: HttpCache = None,
+        concurrency: int = None,
+        max_retries: int = CBSO_MAX_RETRIES,
+        backoff: float = CBSO_BACKOFF,
+        limits: HostLimits = None,
+    ):
+        """
+        :param concurrency: The maximum number of simultaneous requests of this client,
+            the per-host limit of `HOST_CONCURRENCY` by default.
+        :param max_retries: The retries of a request rejected with 429/503 or failing on a transport error.
+        :param backoff: The first delay (seconds) of the exponential backoff, without Retry-After header.
+        :param limits: The rate limits and circuit breakers of the hosts, the process-wide ones by default.
+        """
+        self._async_client = async_client
+        self.cache = cache or http_cache
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._limits = limits
+        self.semaphores = weakref.WeakKeyDictionary()  # Semaphore of each event loop
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        return self._async_client or get_async_client()
+
+    @property
+    def limits(self) -> HostLimits:
+        return self._limits or get_host_limits()
+
+    def semaphore(self, url: str) -> asyncio.Semaphore:
+        if self.concurrency is None:
+            return host_semaphore(url)
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[loop]
+
+    def get_delay(self, attempt: int, retry_after: float = None) -> float:
+        """Delay before the next attempt, jittered so that the rejected requests do not retry together."""
+        if retry_after is None:
+            retry_after = min(self.backoff * 2**attempt, CBSO_MAX_BACKOFF)
+        return retry_after * random.uniform(1, 1 + CBSO_JITTER)
+
+    async def request(self, url: str, read, headers: dict = None):
+        """
+        Send a GET request and pass the streamed response to `read`, retrying the
+        rate-limited requests and the transport errors. While the circuit of the host
+        is open, the request waits for its cooldown instead of being skipped.
+
+        :param url: The URL to request.
+        :param read: Coroutine function reading the successful (or 304) response.
+        :param headers: Additional request headers.
+        :return: The result of `read`, or None for an HTTP error status (e.g. 404).
+        :raises CbsoError: When the request still fails after `max_retries` retries.
+        """
+        host = get_host(url)
+        limiter = self.limits.get(host)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            if not await limiter.await_turn():
+                retry_after = limiter.breaker.retry_in()
+                reason = "The host failed recently"
+            else:
+                try:
+                    async with self.semaphore(url), metrics.atimer("fetch", host=limiter.label), self.async_client.stream(
+                        "GET", url, headers=headers
+                    ) as response:
+                        limiter.record(response)
+                        self.stats["requests"] += 1
+                        metrics.count("requests", host=limiter.label, status=response.status_code)
+                        if response.status_code not in RETRY_STATUSES:
+                            if not response.is_success and response.status_code != 304:
+                                logging.error(f"HTTP status {response.status_code} for the URL {url}")
+                                self.stats["failures"] += 1
+                                return None
+                            return await read(response)
+                        retry_after = get_retry_after(response)
+                        reason = f"HTTP status {response.status_code}"
+                except httpx.TransportError as e:
+                    limiter.record(error=e)
+                    metrics.count("requests", host=limiter.label, status="error")
+                    reason = str(e) or type(e).__name__
+            if attempt == self.max_retries:
+                break
+            delay = self.get_delay(attempt, retry_after)
+            self.stats["retries"] += 1
+            logging.warning(f"{reason} for the URL {url}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)  # Outside of the semaphore, other requests go on meanwhile
+
+        self.stats["failures"] += 1
+        raise CbsoError(f"Giving up the URL {url} after {self.max_retries} retries: {reason}")
+
+    async def revalidate(self, url: str, read, entry: dict):
+        """`request` of a cached URL, the stale entry (if any) is kept when the request fails."""
+        try:
+            return await self.request(url, read, self.cache.conditional_headers(entry))
+        except CbsoError:
+            if not entry:
+                raise
+            logging.warning(f"Serving the stale cache entry of {url}")
+            return None
+
+    async def aget_deposits_page(self, vat_number: str, page: int, page_size: int) -> dict:
+        """Request a page of the published deposits, through the HTTP cache (read and written in a thread)."""
+        url = get_deposits_url(vat_number, page, page_size)
+        entry, fresh = await asyncio.to_thread(self.cache.lookup, url)
+        if not fresh:
+
+            async def read(response: httpx.Response) -> dict:
+                if response.status_code == 304:
+                    return await asyncio.to_thread(self.cache.store, url, response, None, entry)
+                text = (await response.aread()).decode(response.encoding or "utf-8")
+                return await asyncio.to_thread(self.cache.store, url, response, text) or {"content": text}
+
+            entry = await self.revalidate(url, read, entry) or entry
+        return read_deposits_page(entry["content"]) if entry else None
+
+    async def aiter_deposits(
+        self, vat_number: str, since: str = None, page_size: int = DEPOSITS_PAGE_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Yield the published deposits of a company, most recent period first.
+        The next page is only requested once the previous one has been consumed.
+
+        :param vat_number: The VAT number of the company.
+        :param since: Stop at the first period ending before this date ("YYYY-MM-DD").
+        :param page_size: The number of deposits by page.
+        """
+        page = 0
+        while True:
+            response = await self.aget_deposits_page(vat_number, page, page_size)
+            if not response:
+                return
+            for deposit in response.get("content") or []:
+                if since and (deposit.get("periodEndDate") or "") < since:
+                    return
+                yield deposit
+            if is_last_page(response, page):
+                return
+            page += 1
+
+    async def aget_account(self, deposit_id: str, codes: Iterable[str] = None) -> tuple:
+        """
+        Read the CSV export of an annual account with a `RubricReader`, through the HTTP cache:
+        a deposit never changes once published, its CSV is only downloaded once.
+
+        :param codes: The rubric codes to extract, all the amounts by default. When the CSV is
+            not cached (see `HTTP_CACHE_TTL`), the rest of the response is not downloaded once
+            all of them have been read.
+        :return tuple: (model, rubrics, values), or None for an HTTP error status.
+        :raises CbsoError: When the request still fails after its retries.
+        """
+        url = get_deposit_csv_url(deposit_id)
+        entry, fresh = await asyncio.to_thread(self.cache.lookup, url)
+        cacheable, _ = self.cache.get_ttl(url)
+
+        async def read(response: httpx.Response):
+            if response.status_code == 304:
+                return await asyncio.to_thread(self.cache.store, url, response, None, entry)
+            if cacheable:
+                text = (await response.aread()).decode(response.encoding or "utf-8")
+                return await asyncio.to_thread(self.cache.store, url, response, text)
+            reader = RubricReader(codes)
+            async for line in response.aiter_lines():
+                if reader.feed(line):
+                    break  # Leaving the stream closes the connection
+            return reader.result()
+
+        if not fresh:
+            result = await self.revalidate(url, read, entry)
+            if not cacheable:
+                return result
+            entry = result or entry
+        return read_account(entry["content"], codes) if entry else None
+
+    async def abackfill_company(
+        self, vat_number: str, history: FinancialHistory, since: str = None, codes: Iterable[str] = None
+    ):
+        """
+        Add the annual accounts of a company to the history, all fetched concurrently.
+        Nothing is added when one of them cannot be loaded, the error is raised.
+        """
+        deposits = select_deposits([deposit async for deposit in self.aiter_deposits(vat_number, since)])
+        accounts = await asyncio.gather(
+            *(self.aget_account(deposit["id"], codes) for deposit in deposits), return_exceptions=True
+        )
+        for account in accounts:
+            if isinstance(account, BaseException):
+                raise account
+        for deposit, account in zip(deposits, accounts):
+            if account:
+                history.add_rubrics(vat_number, deposit, *account)
+
+    async def abackfill(
+        self,
+        vat_numbers: Iterable[str],
+        years: int = None,
+        concurrency: int = BACKFILL_CONCURRENCY,
+        codes: Iterable[str] = None,
+    ) -> FinancialHistory:
+        """
+        Load the annual accounts of many companies into a `FinancialHistory`.
+        The companies whose accounts could not be loaded are listed in its `failed` attribute,
+        to be retried later.
+
+        :param vat_numbers: The VAT numbers of the companies.
+        :param years: The number of past years to load, all the deposits by default.
+        :param concurrency: The number of companies processed at the same time.
+        :param codes: The rubric codes to load, e.g. `RUBRICS.values()` for the ratios only. All by default.
+        """
+        since = f"{datetime.date.today().year - years}-01-01" if years else None
+        history = FinancialHistory()
+        pending = iter(dict.fromkeys(vat_numbers))
+
+        async def work():
+            for vat_number in pending:  # Shared iterator, each worker takes the next company
+                try:
+                    await self.abackfill_company(vat_number, history, since, codes)
+                except Exception as e:
+                    logging.error(f"Backfill failed for VAT number {vat_number}: {e}")
+                    history.failed.append(vat_number)
+
+        await asyncio.gather(*(work() for _ in range(concurrency)))
+        return history
+
+
+async def aload_financial_history(vat_numbers: Iterable[str], years: int = None) -> FinancialHistory:
+    """Asynchronous version of `load_financial_history`, through a `CbsoClient`."""
+    return await CbsoClient().abackfill(vat_numbers, years)
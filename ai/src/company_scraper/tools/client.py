@@ -0,0 +1,118 @@
+from config.hosts import *
+from urllib.parse import urlparse
+import asyncio, importlib.util, threading, weakref, httpx
+
+# HTTP/2 is only negotiated when the optional `h2` package is installed (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_lock = threading.Lock()
+_client = None
+# httpx.AsyncClient connections belong to an event loop, so each loop gets its own client
+_async_clients = weakref.WeakKeyDictionary()
+_host_semaphores = weakref.WeakKeyDictionary()
+_host_thread_semaphores = {}
+
+
+def get_timeout() -> httpx.Timeout:
+    """Build the timeout configuration of the shared clients."""
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def get_limits() -> httpx.Limits:
+    """Build the connection pool limits of the shared clients."""
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client() -> httpx.Client:
+    """
+    Return the process-wide HTTP client.
+    Connections are kept alive and reused between requests to the same host.
+    """
+    global _client
+    with _lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(
+                timeout=get_timeout(),
+                follow_redirects=True,
+                transport=httpx.HTTPTransport(
+                    http2=HTTP2_AVAILABLE, limits=get_limits(), retries=HTTP_RETRIES
+                ),
+            )
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the HTTP client shared by every coroutine of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=get_timeout(),
+            follow_redirects=True,
+            transport=httpx.AsyncHTTPTransport(
+                http2=HTTP2_AVAILABLE, limits=get_limits(), retries=HTTP_RETRIES
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def set_clients(client: httpx.Client = None, async_client: httpx.AsyncClient = None):
+    """
+    Replace the shared clients, e.g. by clients using a `httpx.MockTransport` in tests.
+    The asynchronous client is registered for the running event loop.
+    """
+    global _client
+    if client is not None:
+        with _lock:
+            _client = client
+    if async_client is not None:
+        _async_clients[asyncio.get_running_loop()] = async_client
+
+
+async def aclose_clients():
+    """Close the HTTP clients of the running event loop and the synchronous client."""
+    global _client
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_host(url: str) -> str:
+    """Return the host of the URL, used as key of the per-host limits."""
+    return urlparse(url).netloc.casefold()
+
+
+def host_semaphore(url: str) -> asyncio.Semaphore:
+    """
+    Return the semaphore limiting the concurrent requests sent to the host of the URL.
+
+    :param url: The URL about to be requested.
+    :return: The semaphore of the host, limited by `HOST_CONCURRENCY`.
+    """
+    host = get_host(url)
+    semaphores = _host_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if host not in semaphores:
+        semaphores[host] = asyncio.Semaphore(
+            HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+        )
+    return semaphores[host]
+
+
+def host_thread_semaphore(url: str) -> threading.BoundedSemaphore:
+    """Same as `host_semaphore` for requests sent from threads."""
+    host = get_host(url)
+    with _lock:
+        if host not in _host_thread_semaphores:
+            _host_thread_semaphores[host] = threading.BoundedSemaphore(
+                HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+            )
+        return _host_thread_semaphores[host]
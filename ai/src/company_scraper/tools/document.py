@@ -0,0 +1,14 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Document:
+    """
+    A loaded page: its content and metadata (the "source" URL).
+
+    Same attributes as langchain's `Document`, which is only used as a container by the
+    pipeline while importing it loads the whole langchain_core runtime.
+    """
+
+    page_content: str
+    metadata: dict = field(default_factory=dict)
@@ -0,0 +1,191 @@
+from .rubrics import RubricReader, iter_rubrics
+from .utils import scraper, get_deposits_url, get_deposit_csv_url
+from config.config import *
+from typing import Iterable
+from io import StringIO
+import numpy as np
+import pandas as pd
+
+
+def read_deposits_page(content: str) -> dict:
+    """Decode a page of the published-deposits API, None when the response is invalid."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        logging.error("error: Invalid JSON response from the published-deposits API")
+        return None
+
+
+def is_last_page(response: dict, page: int) -> bool:
+    return response.get("last", True) or page + 1 >= response.get("totalPages", 0)
+
+
+def get_all_deposits(vat_number: str, page_size: int = DEPOSITS_PAGE_SIZE) -> List[dict]:
+    """
+    Retrieve every published deposit of a company, going through all the pages of the API.
+
+    :param vat_number: The VAT number of the company.
+    :return List[dict]: The deposits, most recent period first.
+    """
+    deposits, page = [], 0
+    while True:
+        content = scraper.run(get_deposits_url(vat_number, page, page_size))[0].page_content
+        response = read_deposits_page(content)
+        if not response:
+            return deposits
+        deposits += response.get("content") or []
+        if is_last_page(response, page):
+            return deposits
+        page += 1
+
+
+def select_deposits(deposits: List[dict]) -> List[dict]:
+    """
+    Keep the structured deposits (no PDF), and only the latest deposit of each period
+    when an annual account has been corrected.
+    """
+    deposits = sorted(
+        deposits,
+        key=lambda deposit: (deposit.get("periodEndDate") or "", deposit.get("depositDate") or ""),
+        reverse=True,
+    )
+    selected, periods = [], set()
+    for deposit in deposits:
+        period = deposit.get("periodEndDate")
+        if deposit.get("importFileType") == "PDF" or not period or period in periods:
+            continue
+        periods.add(period)
+        selected.append(deposit)
+    return selected
+
+
+def parse_rubrics(annual_account: str, codes: Iterable[str] = None) -> tuple:
+    """
+    Read the model and amounts of an annual account CSV (see `RubricReader.result`).
+
+    :param codes: The rubric codes to extract, all the amounts by default.
+    """
+    reader = RubricReader(codes)
+    for code, value in iter_rubrics(StringIO(annual_account), reader.wanted):
+        reader.add(code, value)
+    return reader.result()
+
+
+class FinancialHistory:
+    """
+    Columnar store of the annual accounts of many companies, in long format
+    (enterprise, period, rubric) -> value, with vectorized multi-year ratios.
+    """
+
+    def __init__(self):
+        self.accounts = []  # One entry by annual account: enterprise, period, deposit id and model
+        self.parts = []  # Rubrics of each annual account, concatenated on demand
+        self._values = None
+        self.failed = []  # Enterprises whose accounts could not be loaded
+
+    def add(self, enterprise: str, deposit: dict, annual_account: str):
+        """Add the annual account CSV of a deposit returned by the published-deposits API."""
+        self.add_rubrics(enterprise, deposit, *parse_rubrics(annual_account))
+
+    def add_rubrics(self, enterprise: str, deposit: dict, model: str, rubrics: List[str], values: np.ndarray):
+        """Add the already parsed amounts of a deposit."""
+        if not rubrics:
+            return
+        period = pd.Timestamp(deposit["periodEndDate"])
+        self.accounts.append(
+            {"enterprise": enterprise, "period": period, "deposit_id": deposit.get("id"), "model": model}
+        )
+        self.parts.append(
+            pd.DataFrame(
+                {"enterprise": enterprise, "period": period, "rubric": rubrics, "value": values}
+            )
+        )
+        self._values = None
+
+    @property
+    def values(self) -> pd.DataFrame:
+        """All the amounts, indexed by (enterprise, period, rubric)."""
+        if self._values is None:
+            if self.parts:
+                values = pd.concat(self.parts, ignore_index=True)
+            else:
+                values = pd.DataFrame(
+                    {
+                        "enterprise": pd.Series(dtype=str),
+                        "period": pd.Series(dtype="datetime64[ns]"),
+                        "rubric": pd.Series(dtype=str),
+                        "value": pd.Series(dtype=np.float64),
+                    }
+                )
+            values["enterprise"] = values["enterprise"].astype("category")
+            values["rubric"] = values["rubric"].astype("category")
+            self._values = values.set_index(["enterprise", "period", "rubric"]).sort_index()
+        return self._values
+
+    def pivot(self, rubrics: List[str] = None) -> pd.DataFrame:
+        """
+        Amounts with one column by rubric, indexed by (enterprise, period).
+
+        :param rubrics: The rubric codes to keep, all of them by default.
+        """
+        values = self.values["value"]
+        if rubrics is not None:
+            values = values[values.index.get_level_values("rubric").isin(rubrics)]
+        wide = values.unstack("rubric")
+        wide.columns = wide.columns.astype(str)
+        wide = wide.reindex(columns=rubrics) if rubrics is not None else wide
+        wide.index = wide.index.remove_unused_levels()
+        return wide.sort_index()
+
+    def ratios(self) -> pd.DataFrame:
+        """
+        Compute the multi-year indicators of every company at once.
+
+        :return pd.DataFrame: Indexed by (enterprise, period), with the revenue, its growth,
+            the gross margin and its rate, the solvency, the employees and their yearly variation.
+        """
+        wide = self.pivot(list(RUBRICS.values()))
+        column = {name: wide[code] for name, code in RUBRICS.items()}
+
+        # Abbreviated and micro models only publish the gross margin, it is computed for the others
+        income = wide[[RUBRICS["revenue"], RUBRICS["other_operating_income"]]].sum(axis=1, min_count=1)
+        costs = wide[[RUBRICS["purchases"], RUBRICS["services"]]].sum(axis=1)
+        gross_margin = column["gross_margin"].fillna(income - costs)
+        employees = column["employees"].fillna(column["average_employees"])
+        revenue = column["revenue"]
+        by_enterprise = wide.index.get_level_values("enterprise")
+
+        return pd.DataFrame(
+            {
+                "revenue": revenue,
+                "revenue_growth": revenue.groupby(by_enterprise, observed=True).pct_change(fill_method=None),
+                "gross_margin": gross_margin,
+                "gross_margin_rate": gross_margin / revenue.replace(0, np.nan),
+                "solvency": column["equity"] / column["total_assets"].replace(0, np.nan),
+                "employees": employees,
+                "employees_trend": employees.groupby(by_enterprise, observed=True).diff(),
+            },
+            index=wide.index,
+        )
+
+
+def load_financial_history(vat_numbers: Iterable[str], max_workers: int = 8) -> FinancialHistory:
+    """
+    Download all the annual accounts of many companies into a `FinancialHistory`.
+    The CSV exports never change once published and are served from the HTTP cache after the first run.
+
+    :param vat_numbers: The VAT numbers of the companies.
+    :param max_workers: The number of concurrent requests (also limited per host).
+    """
+    vat_numbers = list(dict.fromkeys(vat_numbers))
+    history = FinancialHistory()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        deposits = executor.map(lambda vat: select_deposits(get_all_deposits(vat)), vat_numbers)
+        jobs = [(vat, deposit) for vat, selected in zip(vat_numbers, deposits) for deposit in selected]
+        contents = executor.map(
+            lambda job: scraper.run(get_deposit_csv_url(job[1]["id"]))[0].page_content, jobs
+        )
+        for (vat, deposit), content in zip(jobs, contents):
+            if content:
+                history.add(vat, deposit, content)
+    return history
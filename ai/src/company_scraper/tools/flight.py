@@ -0,0 +1,243 @@
+from .cache import SingleFlight
+from .metrics import metrics
+from config.cache import *
+from schema.company_schema import CompanySchema
+from collections import defaultdict
+import asyncio, hashlib, json, logging, re, threading, time
+
+
+def get_flight_key(*parts) -> str:
+    """
+    Key of a request, the VAT numbers being reduced to their digits so that
+    "BE 0423.369.762" and "0423369762" share the same computation.
+    """
+
+    def normalize(value):
+        if isinstance(value, dict):
+            return {
+                key: re.sub(r"[^\d]", "", item) if key == "vat_number" and isinstance(item, str) else normalize(item)
+                for key, item in value.items()
+            }
+        return value
+
+    payload = json.dumps([normalize(part) for part in parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_request_key(fields: dict, force=False) -> str:
+    """
+    Key of a pipeline request, None (no coalescing) without VAT number.
+    A forced refresh does not join a normal request, which may reuse stale stages.
+
+    :param force: The `force` argument of the request (see `STAGES`).
+    """
+    if not fields or not fields.get("vat_number"):
+        return None
+    if not force:
+        return get_flight_key(fields)
+    return get_flight_key(fields, True if force is True else sorted(force))
+
+
+def dump_schema(company_schema: CompanySchema) -> dict:
+    return company_schema.model_dump()
+
+
+def load_schema(value: dict) -> CompanySchema:
+    return CompanySchema.model_validate(value)
+
+
+class RedisFlight:
+    """
+    Single-flight shared by the worker processes: the first one takes a Redis lock and
+    publishes its result, the others wait for that result instead of computing it again.
+    If the leader fails or dies, its lock is released (or expires) and a waiting worker takes over.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        lock_ttl: float = FLIGHT_LOCK_TTL,
+        result_ttl: float = FLIGHT_RESULT_TTL,
+        poll_interval: float = FLIGHT_POLL_INTERVAL,
+        wait_timeout: float = FLIGHT_WAIT_TIMEOUT,
+        client=None,
+    ):
+        """
+        :param url: The Redis URL.
+        :param lock_ttl: Expiry of the lock (seconds), longer than the slowest computation.
+        :param result_ttl: How long the result stays available to the waiting workers.
+        :param wait_timeout: After this delay, a waiting worker computes the result itself.
+        :param client: An already created Redis client, e.g. in tests.
+        """
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.redis = client
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+
+    def load(self, key: str):
+        """:return: (found, value) of the published result."""
+        value = self.redis.get(f"flight:result:{key}")
+        if value is None:
+            return False, None
+        return True, json.loads(value)["value"]
+
+    def publish(self, key: str, value):
+        try:
+            self.redis.set(f"flight:result:{key}", json.dumps({"value": value}), ex=int(self.result_ttl))
+        except Exception as e:  # The waiting workers will compute the result themselves
+            logging.warning(f"Single-flight result of {key} not published: {e}")
+
+    def try_lock(self, key: str):
+        """Return the acquired lock, None when another worker holds it."""
+        lock = self.redis.lock(f"flight:lock:{key}", timeout=self.lock_ttl)
+        return lock if lock.acquire(blocking=False) else None
+
+    def unlock(self, lock):
+        try:
+            lock.release()
+        except Exception as e:  # Expired lock, taken over by another worker
+            logging.warning(f"Single-flight lock lost: {e}")
+
+    def do(self, key: str, func, dump, load):
+        """
+        Call `func` unless another worker is already computing the same key.
+
+        :param dump: Convert the result into a JSON serializable value.
+        :param load: Rebuild the result from that value.
+        :return: (result, shared) where shared tells if the result comes from another worker.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            try:
+                found, value = self.load(key)
+                lock = None if found else self.try_lock(key)
+            except Exception as e:
+                logging.warning(f"Single-flight across workers unavailable: {e}")
+                break
+            if found:
+                return load(value) if value is not None else None, True
+            if lock:
+                try:
+                    result = func()
+                    self.publish(key, dump(result) if result is not None else None)
+                    return result, False
+                finally:
+                    self.unlock(lock)
+            time.sleep(self.poll_interval)
+        else:
+            logging.warning(f"Single-flight {key} still running after {self.wait_timeout}s, computing it locally")
+        return func(), False
+
+    async def ado(self, key: str, func, dump, load):
+        """Asynchronous version of `do`, `func` returns the coroutine to await."""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            try:
+                found, value = await asyncio.to_thread(self.load, key)
+                lock = None if found else await asyncio.to_thread(self.try_lock, key)
+            except Exception as e:
+                logging.warning(f"Single-flight across workers unavailable: {e}")
+                break
+            if found:
+                return load(value) if value is not None else None, True
+            if lock:
+                try:
+                    result = await func()
+                    value = dump(result) if result is not None else None
+                    await asyncio.to_thread(self.publish, key, value)
+                    return result, False
+                finally:
+                    await asyncio.to_thread(self.unlock, lock)
+            await asyncio.sleep(self.poll_interval)
+        else:
+            logging.warning(f"Single-flight {key} still running after {self.wait_timeout}s, computing it locally")
+        return await func(), False
+
+
+def identity(value):
+    return value
+
+
+class RequestFlights:
+    """
+    Coalesce the concurrent pipeline requests for the same company onto one computation:
+    in-process with `SingleFlight`, and across worker processes through `RedisFlight`
+    when `FLIGHT_URL` is set. Every caller receives its own copy of the shared result.
+    """
+
+    def __init__(self, url: str = FLIGHT_URL, remote: RedisFlight = None):
+        self.url = url
+        self._remote = remote
+        self.lock = threading.Lock()
+        self.local = SingleFlight()
+        # Counters by operation: computed, coalesced (same process) and remote (other worker)
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def remote(self) -> RedisFlight:
+        with self.lock:
+            if self._remote is None and self.url:
+                try:
+                    self._remote = RedisFlight(self.url)
+                except Exception as e:
+                    logging.warning(f"Single-flight across workers disabled, {self.url} is not available: {e}")
+                    self.url = ""
+            return self._remote
+
+    def count(self, name: str, shared: bool, remote: bool):
+        self.stats[name]["remote" if remote else "coalesced" if shared else "computed"] += 1
+
+    def do(self, name: str, key: str, func, dump=identity, load=identity):
+        """
+        Call `func` once for all the concurrent callers of the same operation and key.
+
+        :param name: The operation ("run", "company_schema", ...).
+        :param key: The request key (see `get_flight_key`), None to call `func` directly.
+        :param dump: Convert the result into a JSON serializable value, for the other workers.
+        :param load: Rebuild the result from that value.
+        :return: The result, a copy of it for all the callers but the one which computed it.
+        """
+        if key is None:
+            return func()
+        key = f"{name}:{key}"
+        remote = self.remote
+        remote_shared = False
+
+        def compute():
+            nonlocal remote_shared
+            if remote is None:
+                return func()
+            result, remote_shared = remote.do(key, func, dump, load)
+            return result
+
+        result, shared = self.local.do(key, compute)
+        self.count(name, shared, remote_shared)
+        return result
+
+    async def ado(self, name: str, key: str, func, dump=identity, load=identity):
+        """Asynchronous version of `do`, `func` returns the coroutine to await."""
+        if key is None:
+            return await func()
+        key = f"{name}:{key}"
+        remote = self.remote
+        remote_shared = False
+
+        async def compute():
+            nonlocal remote_shared
+            if remote is None:
+                return await func()
+            result, remote_shared = await remote.ado(key, func, dump, load)
+            return result
+
+        result, shared = await self.local.ado(key, compute)
+        self.count(name, shared, remote_shared)
+        return result
+
+
+request_flights = RequestFlights()
+metrics.register("flights", lambda: request_flights.stats, label="operation")
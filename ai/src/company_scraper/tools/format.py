@@ -1,29 +1,56 @@
-from langchain_community.document_transformers import MarkdownifyTransformer
+from markdownify import MarkdownConverter
 from .utils import safe_execution
-import re
+from .document import Document
+from .metrics import metrics
+from .aggregators import get_aggregators
+from functools import lru_cache
+import re, importlib.util
 from config.config import *
-transformer = MarkdownifyTransformer()
+from bs4 import NavigableString, Comment
+
+# C-backed lxml parser when installed, several times faster than the pure Python "html.parser"
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Same options as langchain's MarkdownifyTransformer, but converting already parsed trees
+converter = MarkdownConverter(autolinks=True, heading_style="ATX")
+
+
+def parse_html(html: str) -> BeautifulSoup:
+    """Parse an HTML document with the fastest available parser."""
+    with metrics.timer("parse"):
+        return BeautifulSoup(html, HTML_PARSER)
+
+
+def soup_to_markdown(soup: BeautifulSoup) -> str:
+    """Convert a parsed HTML tree into cleaned Markdown."""
+    with metrics.timer("markdown"):
+        markdown = converter.convert_soup(soup).replace("\xa0", " ").strip()
+        return re.sub(r"\n\s*\n", "\n\n", markdown)
 
 
 # Needs review and improvement for better performance
-def kbo_format(documents):
+def kbo_format(documents, soup: BeautifulSoup = None):
     """
     Formats the HTML from the Belgian Company Database (BCE), keeping tables but removing all links.
 
     :param documents: A list of documents to be processed, where the first document contains the HTML content.
+    :param soup: The already parsed HTML of the first document, modified in place.
     :return: The modified documents with cleaned-up content.
     """
-    html = documents[0].page_content
-    soup = BeautifulSoup(html, "html.parser")
+    if soup is None:
+        soup = parse_html(documents[0].page_content)
     table_div = soup.find("div", id="table")
 
     if not table_div:
         return documents
 
     # Replace activity section title for easier LLM extraction
+    activity_tables = []
     for h2 in soup.find_all("h2"):
         if "Activités" in h2.text:
             h2.string = "Activités"
+            if h2.find_parent("td", class_="I"):
+                activity_tables.append(h2.find_parent("table"))
 
     # replace tags with class 'upd' content
     for tag in soup.find_all(class_="upd"):
@@ -37,7 +64,7 @@ def kbo_format(documents):
             td.string = "Name"
 
     # Add Nacebel code for easier LLM extraction
-    for table in soup.select('table:has(td.I h2:-soup-contains("Activités"))'):
+    for table in filter(None, activity_tables):
         for a in table.find_all("a"):
             code = a.text.strip()
             if code.count(".") == 1 and len(code) == 6:  # Check for the format XX.XXX
@@ -62,18 +89,167 @@ def kbo_format(documents):
     return documents
 
 
+# KBO table labels and the CompanySchema field they fill
+KBO_FIELDS = {
+    "Numéro d'entreprise:": "vat_number",
+    "Date de début:": "established",
+    "Dénomination:": "name",
+    "Adresse du siège:": "address",
+    "Type d'entité:": "company_type",
+    "Forme légale:": "legal_form",
+    "Numéro de téléphone:": "phone",
+    "E-mail:": "email",
+    "Adresse web:": "website",
+}
+
+KBO_NO_DATA = "Pas de données reprises dans la BCE."
+POSTAL_BOX = r"(?:boîte|bte|bus|box)"
+
+
+def get_cell_lines(td) -> List[str]:
+    """
+    Return the text lines of a KBO table cell, without the history notes (class 'upd').
+    The tree is not modified, so it can still be formatted by `kbo_format`.
+    """
+    parts = []
+    for element in td.descendants:
+        if element.name == "br":
+            parts.append("\n")
+        elif isinstance(element, NavigableString) and not isinstance(element, Comment):
+            if not element.find_parent(class_="upd"):
+                parts.append(str(element))
+    lines = [" ".join(line.split()) for line in "".join(parts).split("\n")]
+    return [line for line in lines if line and line != KBO_NO_DATA]
+
+
+def parse_kbo_address(lines: List[str]) -> AddressSchema:
+    """
+    Parse the lines of a KBO address, e.g. ["Boulevard du Souverain 280", "1160 Auderghem"].
+    """
+    address = AddressSchema()
+    for line in lines:
+        if match := re.fullmatch(r"(\d{4}) (.+)", line):
+            address.postal_code, address.city = match.groups()
+        elif match := re.fullmatch(POSTAL_BOX + r" ?(.+)", line, re.IGNORECASE):
+            address.postal_box = match.group(1)
+        elif not address.street:
+            match = re.fullmatch(
+                r"(.*?) (\d+\S*)(?: " + POSTAL_BOX + r" ?(\S+))?", line, re.IGNORECASE
+            )
+            if match:
+                address.street, address.street_number = match.group(1), match.group(2)
+                address.postal_box = match.group(3) or address.postal_box
+            else:
+                address.street = line
+    return address
+
+
+def parse_kbo_activities(soup) -> tuple:
+    """
+    Collect the NACEBEL codes and activity descriptions listed under the "Activités" titles.
+
+    :return tuple: (nacebel_codes, activities) without duplicates, in page order.
+    """
+    codes, activities = [], []
+    for h2 in soup.find_all("h2"):
+        if "Activités" not in h2.text:
+            continue
+        for tr in h2.find_parent("tr").find_next_siblings("tr"):
+            if tr.find("h2"):
+                break  # Next section
+            for a in tr.find_all("a"):
+                code = a.text.strip()
+                if not re.fullmatch(r"\d{2}\.\d{3}", code):
+                    continue
+                # The description follows the code link: "47.520 - Commerce de détail..."
+                description = a.next_sibling if isinstance(a.next_sibling, str) else ""
+                description = " ".join(description.split()).lstrip("- ")
+                if code not in codes:
+                    codes.append(code)
+                if description and description not in activities:
+                    activities.append(description)
+    return codes, activities
+
+
+def parse_kbo(html: str, soup: BeautifulSoup = None) -> CompanySchema:
+    """
+    Fill a CompanySchema directly from the table of a KBO (BCE) company page.
+
+    :param html: The HTML of the KBO page.
+    :param soup: The already parsed HTML, left unchanged.
+    :return CompanySchema: The legal data of the company, or None if the page has no data table.
+    """
+    if soup is None:
+        soup = parse_html(html)
+    table_div = soup.find("div", id="table")
+    if not table_div:
+        return None
+
+    values = {}
+    for tr in table_div.find_all("tr"):
+        cells = tr.find_all("td", recursive=False)
+        if len(cells) < 2:
+            continue
+        field = KBO_FIELDS.get(" ".join(cells[0].get_text().split()))
+        if field and field not in values:
+            values[field] = get_cell_lines(cells[1])
+
+    def first(field: str) -> str:
+        return values[field][0] if values.get(field) else ""
+
+    codes, activities = parse_kbo_activities(soup)
+    company_type = values.get("company_type", [])
+    website = first("website")
+    if website and not website.startswith(("http://", "https://")):
+        website = "https://" + website
+
+    return CompanySchema(
+        name=first("name"),
+        vat_number=first("vat_number"),
+        established=first("established"),
+        legal_form=first("legal_form"),
+        company_type=company_type,
+        is_company="Personne morale" in company_type,
+        address=parse_kbo_address(values.get("address", [])),
+        activities=ActivitiesSchema(nacebel_codes=codes, company_activities=activities),
+        financial=FinancialSchema(),
+        contact=ContactSchema(
+            email=first("email"), phone=first("phone"), website=website
+        ),
+    )
+
+
+def is_complete_legal_data(company_schema: CompanySchema) -> bool:
+    """
+    Check if the KBO data (index or parsed page) is complete enough to skip the scraping and
+    the LLM extraction. Natural persons have no legal form.
+    """
+    return bool(
+        company_schema
+        and company_schema.name
+        and company_schema.vat_number
+        and company_schema.company_type
+        and (company_schema.legal_form or not company_schema.is_company)
+        and company_schema.established
+        and company_schema.activities.nacebel_codes
+        and company_schema.address.postal_code
+        and company_schema.address.city
+    )
+
+
 # Needs review and improvement for better performance
-def company_tracker_format(documents):
+def company_tracker_format(documents, soup: BeautifulSoup = None):
     """
     Formats the HTML from the companyTracker website.
     Extracts the first two <div> elements with the class 'panel-body' from the given HTML
     and returns a formatted HTML containing only these two <div> elements.
 
     :param documents: List of documents containing the HTML content to be formatted.
+    :param soup: The already parsed HTML of the first document.
     :return: A list of documents with formatted HTML containing only the first two <div class="panel-body"> elements.
     """
-    html = documents[0].page_content
-    soup = BeautifulSoup(html, "html.parser")
+    if soup is None:
+        soup = parse_html(documents[0].page_content)
 
     # Find all <div> elements with the class 'panel-body'
     panel_primary = soup.find_all("div", class_="panel panel-primary")
@@ -105,11 +281,10 @@ def convert_html_to_markdown(documents: List[object]) -> List[object]:
     :param documents: A list of document objects containing HTML content.
     :return: A list of documents, where each document is the converted Markdown document.
     """
-    converted = transformer.transform_documents(
-        documents
-    )  # Apply the transformation from HTML to Markdown
-
-    return converted
+    return [
+        Document(soup_to_markdown(parse_html(document.page_content)), metadata=document.metadata)
+        for document in documents
+    ]
 
 
 def format_vat(vat_number: str) -> str:
@@ -122,6 +297,31 @@ def is_valid_vat(vat: str) -> bool:
     return bool(re.fullmatch(r"\d{10}", vat))
 
 
+NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]")
+
+
+class CompanyFilter:
+    """The VAT number and name of a company, normalized once to filter all its candidate URLs."""
+
+    def __init__(self, vat_number: str, company_name: str):
+        self.vat_numbers = ()
+        if isinstance(vat_number, str) and is_valid_vat(vat_number):
+            self.vat_numbers = (vat_number, format_vat(vat_number))
+        # Without spaces, dashes and underscores. An empty name would match every path.
+        self.name = NON_ALPHANUMERIC.sub("", company_name.casefold()) if isinstance(company_name, str) else ""
+
+    def is_listing(self, path: str) -> bool:
+        """Checks if the URL path contains the VAT number or the name of the company, like directory pages."""
+        if any(vat in path for vat in self.vat_numbers):
+            return True
+        return bool(self.name) and self.name in NON_ALPHANUMERIC.sub("", path.casefold())
+
+
+@lru_cache(maxsize=1024)
+def get_company_filter(vat_number: str, company_name: str) -> CompanyFilter:
+    return CompanyFilter(vat_number, company_name)
+
+
 def is_aggregator(url: str, vat_number: str, company_name: str) -> bool:
     """Checks if the URL belongs to a known aggregator or contains company VAT number or name in its path."""
     if not isinstance(url, str) or not url.strip():
@@ -129,27 +329,13 @@ def is_aggregator(url: str, vat_number: str, company_name: str) -> bool:
 
     # Parse URL components
     parsed_url = urlparse(url)
-    domain = parsed_url.netloc.replace("www.", "").casefold()
-    path = parsed_url.path
-
-    # Vérifie si le domaine est dans la liste des agrégateurs
-    if domain in AGGREGATORS_DOMAINS:
-        return True
-
-    # Vérifie si le numéro de TVA est présent dans le chemin de l'URL
-    if is_valid_vat(vat_number):
-        formatted_vat = format_vat(vat_number)
-        if vat_number in path or formatted_vat in path:
-            return True
-
-    # Vérifie si le chemin de l'URL contient le nom de l'entreprise (sans espaces, tirets et underscores)
-    normalized_company_name = re.sub(r"[^a-zA-Z0-9]", "", company_name.casefold())
-    normalized_path = re.sub(r"[^a-zA-Z0-9]", "", path.casefold())
 
-    if normalized_company_name in normalized_path:
+    # Vérifie si le domaine, ou un domaine parent (be.kompass.com), est dans la liste des agrégateurs
+    if (parsed_url.hostname or "") in get_aggregators():
         return True
 
-    return False
+    # Vérifie si le numéro de TVA ou le nom de l'entreprise est présent dans le chemin de l'URL
+    return get_company_filter(vat_number, company_name).is_listing(parsed_url.path)
 
 
 def remove_aggregators_url(
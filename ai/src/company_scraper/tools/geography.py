@@ -0,0 +1,103 @@
+from config.geography import *
+import csv, hashlib, io, logging, threading
+
+
+class PostalCodes:
+    """
+    Offline table of the Belgian postal codes, giving the city, province, region and
+    country of an address without any request. The codes listed in the file are resolved
+    with their city; the province and region of the other Belgian codes are given by
+    `POSTAL_CODE_RANGES` (see `lookup_postal_area`).
+    """
+
+    def __init__(self, path: str = POSTAL_CODES_FILE, ranges: list = POSTAL_CODE_RANGES):
+        self.ranges = ranges
+        # (city, province, region) by listed postal code, for O(1) lookups
+        self.entries = {}
+        self.version = ""
+        if path:
+            self.load(path)
+
+    def get_area(self, postal_code) -> tuple:
+        """(province, region) of the range of a postal code, None outside of the Belgian ranges."""
+        try:
+            code = int(str(postal_code).strip())
+        except ValueError:
+            return None
+        for start, end, province, region in self.ranges:
+            if start <= code <= end:
+                return province, region
+        return None
+
+    def load(self, path: str):
+        """
+        Read the cities (and optionally the provinces and regions) of a postal codes file.
+        The version of the table is a hash of the file, it changes with its content.
+        """
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+        except OSError as e:
+            logging.warning(f"Postal codes file {path} unavailable, cities are unknown: {e}")
+            return
+        self.version = hashlib.sha256(content).hexdigest()[:12]
+        for row in csv.DictReader(io.StringIO(content.decode("utf-8-sig"), newline="")):
+            code = row["postal_code"].strip()
+            province, region = self.get_area(code) or ("", "")
+            self.entries[code] = (
+                row.get("city", "").strip(),
+                row.get("province") or province,
+                row.get("region") or region,
+            )
+
+    def lookup(self, postal_code) -> dict:
+        """
+        Find the location of a Belgian postal code listed in the table.
+
+        :param postal_code: The postal code, as string or integer.
+        :return dict: The city, province, region and country, or None for an unlisted code.
+        """
+        entry = self.entries.get(str(postal_code).strip())
+        if entry is None:
+            return None
+        city, province, region = entry
+        return {"city": city, "province": province, "region": region, "country": COUNTRY}
+
+    def lookup_area(self, postal_code) -> dict:
+        """
+        Province, region and country of any Belgian postal code, from its range.
+
+        :return dict: The location without city, or None for an invalid or foreign code.
+        """
+        area = self.get_area(postal_code)
+        if area is None:
+            return None
+        province, region = area
+        return {"city": "", "province": province, "region": region, "country": COUNTRY}
+
+
+_lock = threading.Lock()
+_postal_codes = None
+
+
+def get_postal_codes() -> PostalCodes:
+    """Return the postal codes table, loaded on first use."""
+    global _postal_codes
+    with _lock:
+        if _postal_codes is None:
+            _postal_codes = PostalCodes()
+        return _postal_codes
+
+
+def lookup_postal_code(postal_code) -> dict:
+    """Location of a Belgian postal code from the offline table, None when it is not listed."""
+    if not postal_code:
+        return None
+    return get_postal_codes().lookup(postal_code)
+
+
+def lookup_postal_area(postal_code) -> dict:
+    """Province and region of a Belgian postal code from its range, None when invalid."""
+    if not postal_code:
+        return None
+    return get_postal_codes().lookup_area(postal_code)
@@ -0,0 +1,299 @@
+from .metrics import metrics
+from config.hosts import *
+from config.search import SEARXNG_URL
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import asyncio, logging, threading, time, httpx
+
+# Statuses of the requests rejected because of the rate limits
+THROTTLE_STATUSES = (429, 503)
+
+# Hosts keeping their own label in the metrics: the public sources and the search providers
+LABELLED_HOSTS = METRICS_HOSTS | {urlsplit(SEARXNG_URL).netloc.casefold()}
+
+
+def get_host_label(host: str) -> str:
+    """The `host` label of the metrics of a request, "other" for the company websites."""
+    host = host.casefold()
+    return host if host in LABELLED_HOSTS else "other"
+
+
+def get_retry_after(response: httpx.Response) -> float:
+    """Read the Retry-After header (seconds or HTTP date), None when absent or invalid."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket with AIMD adaptation: the rate is cut by `HOST_RATE_DECREASE` when the host
+    throttles us and grows back additively, up to the configured rate, as requests succeed.
+    A rate of None means no limit.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, return the delay to wait before using it (seconds)."""
+        if self.max_rate is None:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def decrease(self, retry_after: float = None):
+        """Slow down after a throttled request, at least until `retry_after` seconds."""
+        if self.max_rate is None:
+            return
+        with self.lock:
+            self.rate = max(HOST_MIN_RATE, self.rate * HOST_RATE_DECREASE)
+            # No burst until the host recovers, and no request before Retry-After
+            self.tokens = min(self.tokens, -(retry_after or 0) * self.rate)
+
+    def increase(self):
+        if self.max_rate is None:
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * HOST_RATE_INCREASE)
+
+
+class CircuitBreaker:
+    """
+    Fail fast while a host is down: after `threshold` consecutive failures the circuit opens
+    and the host is not requested during `cooldown` seconds, then a single request probes it
+    ("half_open"). Its success closes the circuit, its failure opens it again. A probe whose
+    outcome is never reported (cancelled request) is replaced after another cooldown.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_FAILURE_THRESHOLD, cooldown: float = FAILED_HOST_TTL):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probed_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be sent, the caller then reports its outcome."""
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() < self.opened_at + self.cooldown:
+                    return False
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open":
+                now = time.monotonic()
+                if self.probing and now < self.probed_at + self.cooldown:
+                    return False
+                self.probing = True
+                self.probed_at = now
+            return True
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a request probe the host, None when it is not open."""
+        with self.lock:
+            if self.state != "open":
+                return None
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def failure(self) -> bool:
+        """Record a failure, return True when it opens the circuit."""
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                opened = self.state != "open"
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                return opened
+            return False
+
+
+class HostLimiter:
+    """Rate limit and circuit breaker of one host."""
+
+    def __init__(self, host: str, bucket: TokenBucket, breaker: CircuitBreaker):
+        self.host = host
+        self.label = get_host_label(host)
+        self.bucket = bucket
+        self.breaker = breaker
+
+    def acquire(self) -> float:
+        """
+        Ask to send a request.
+
+        :return: The delay to wait before sending it, or None when the circuit is open.
+        """
+        if not self.breaker.allow():
+            metrics.count("requests", host=self.label, status="rejected")
+            return None
+        return self.bucket.reserve()
+
+    def wait(self) -> bool:
+        """Wait for the turn of a request, False when the host must not be requested."""
+        delay = self.acquire()
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def await_turn(self) -> bool:
+        """Asynchronous version of `wait`."""
+        delay = self.acquire()
+        if delay is None:
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return True
+
+    def success(self):
+        self.breaker.success()
+        self.bucket.increase()
+
+    def throttled(self, retry_after: float = None):
+        """The host rejected a request because of its rate limit (429, 503)."""
+        self.bucket.decrease(retry_after)
+        metrics.count("throttled", host=self.label)
+        if self.bucket.rate is not None:
+            logging.warning(f"{self.host} is throttling the requests, rate lowered to {self.bucket.rate:.2f}/s")
+
+    def failure(self):
+        """The host failed to answer (connection error, timeout, 5xx)."""
+        if self.breaker.failure():
+            metrics.count("circuit_opened", host=self.label)
+            logging.error(f"{self.host} is failing, not requested during {self.breaker.cooldown:.0f}s")
+
+    def record(self, response: httpx.Response = None, error: Exception = None):
+        """Adapt the limits to the outcome of a request: its response or its error."""
+        if error is not None:
+            self.failure()
+        elif response.status_code in THROTTLE_STATUSES:
+            self.throttled(get_retry_after(response))
+            if response.status_code == 503:
+                self.failure()
+            else:
+                self.breaker.success()  # The host is up, only busy
+        elif response.status_code >= 500:
+            self.failure()
+        else:
+            self.success()
+
+    def status(self) -> dict:
+        return {
+            "rate": self.bucket.rate if self.bucket.rate is not None else -1,
+            "circuit_open": int(self.breaker.state == "open"),
+            "failures": self.breaker.failures,
+        }
+
+
+class HostLimits:
+    """Limiters of every host, created on first request from the per-host configuration."""
+
+    def __init__(
+        self,
+        rates: dict = HOST_RATES,
+        default_rate: tuple = DEFAULT_HOST_RATE,
+        thresholds: dict = HOST_FAILURE_THRESHOLD,
+        default_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = FAILED_HOST_TTL,
+    ):
+        """
+        :param rates: The (requests per second, burst) of each host.
+        :param default_rate: The (requests per second, burst) of the other hosts, None for no limit.
+        :param thresholds: The consecutive failures opening the circuit of each host.
+        :param cooldown: The seconds during which an open circuit rejects the requests.
+        """
+        self.rates = rates
+        self.default_rate = default_rate
+        self.thresholds = thresholds
+        self.default_threshold = default_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def get(self, host: str) -> HostLimiter:
+        host = host.casefold()
+        with self.lock:
+            if host not in self.limiters:
+                rate, burst = self.rates.get(host, self.default_rate or (None, 1))
+                threshold = self.thresholds.get(host, self.default_threshold)
+                self.limiters[host] = HostLimiter(
+                    host, TokenBucket(rate, burst), CircuitBreaker(threshold, self.cooldown)
+                )
+            return self.limiters[host]
+
+    def status(self) -> dict:
+        """State of the limiters, by host."""
+        with self.lock:
+            limiters = list(self.limiters.values())
+        return {limiter.host: limiter.status() for limiter in limiters}
+
+    def labelled_status(self) -> dict:
+        """
+        State of the limiters by metrics label: the company websites are summed under "other"
+        (open circuits and failures), their rates are not reported.
+        """
+        statuses = {}
+        for host, status in self.status().items():
+            label = get_host_label(host)
+            if label != "other":
+                statuses[label] = status
+                continue
+            other = statuses.setdefault("other", {"circuit_open": 0, "failures": 0})
+            other["circuit_open"] += status["circuit_open"]
+            other["failures"] += status["failures"]
+        return statuses
+
+    def reset(self):
+        with self.lock:
+            self.limiters.clear()
+
+
+_lock = threading.Lock()
+_host_limits = None
+
+
+def get_host_limits() -> HostLimits:
+    """Return the process-wide host limits, configured by `HOST_RATES` and `HOST_FAILURE_THRESHOLD`."""
+    global _host_limits
+    with _lock:
+        if _host_limits is None:
+            _host_limits = HostLimits()
+        return _host_limits
+
+
+def set_host_limits(host_limits: HostLimits):
+    """Replace the process-wide host limits, e.g. by unlimited ones in the offline benchmarks."""
+    global _host_limits
+    with _lock:
+        _host_limits = host_limits
+
+
+metrics.register("host", lambda: get_host_limits().labelled_status(), label="host", gauge=True)
@@ -0,0 +1,375 @@
+from .metrics import metrics
+from config.jobs import *
+from collections import defaultdict
+from typing import Iterator, List
+import json, logging, random, threading, time, uuid
+
+# Statuses of the jobs which will not change anymore
+FINAL_STATUSES = ("done", "failed", "expired")
+
+# Move a job id from a sorted set to another one, atomically: KEYS = (source, target), ARGV = (job id, score)
+MOVE_SCRIPT = """
+if redis.call("ZREM", KEYS[1], ARGV[1]) == 1 then
+    redis.call("ZADD", KEYS[2], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+def new_job(
+    fields: dict, stages: List[str] = None, lane: str = "interactive", deadline: float = None, max_attempts: int = JOB_MAX_ATTEMPTS
+) -> dict:
+    """
+    Build the record of a job, as stored in the queue and read by the web tier.
+
+    :param fields: The request of the pipeline, at least {"vat_number": ...}.
+    :param stages: The stages to recompute (see `STAGES`), None to only recompute the changed ones.
+    :param lane: The priority lane.
+    :param deadline: Seconds after which the job is abandoned, `JOB_DEADLINES` of the lane by default.
+    """
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "fields": fields,
+        "stages": list(stages) if stages else None,
+        "lane": lane,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "created_at": now,
+        "updated_at": now,
+        "deadline": now + (deadline if deadline is not None else JOB_DEADLINES.get(lane, JOB_DEADLINES["batch"])),
+        "progress": {},  # Completed stages: "done" or "reused"
+        "result": None,
+        "error": None,
+    }
+
+
+class JobQueue:
+    """
+    Queue of the enrichment jobs. The jobs are JSON records, the lanes and the running jobs
+    are sets of job ids scored by the time they are due (a retry later, a lease expiry).
+    A job id is claimed by moving it atomically from its lane to the running jobs, so that
+    concurrent workers never take the same job and a crashed worker never loses it.
+    The backends only implement the storage operations.
+    """
+
+    def __init__(
+        self, lanes=JOB_LANES, ttl: float = JOB_RESULT_TTL, lease: float = JOB_LEASE, backoff: float = JOB_BACKOFF
+    ):
+        """
+        :param lanes: The lanes, by priority.
+        :param ttl: How long the jobs and their results are kept (seconds).
+        :param lease: Delay after which a running job whose lease was not renewed is queued again.
+        :param backoff: The first delay of the exponential backoff of the retries.
+        """
+        self.lanes = tuple(lanes)
+        self.ttl = ttl
+        self.lease = lease
+        self.backoff = backoff
+        self.stats = defaultdict(lambda: defaultdict(int))  # By lane: submitted, done, failed, ...
+
+    def load(self, job_id: str) -> dict:
+        raise NotImplementedError
+
+    def store(self, job: dict):
+        raise NotImplementedError
+
+    def schedule(self, key: str, job_id: str, at: float):
+        """Add the job id to a set, due at the given time."""
+        raise NotImplementedError
+
+    def due(self, key: str, now: float, limit: int = 10) -> List[str]:
+        """The ids of a set due at `now`, oldest first."""
+        raise NotImplementedError
+
+    def take(self, key: str, job_id: str) -> bool:
+        """Remove the job id from a set, False when another worker removed it first."""
+        raise NotImplementedError
+
+    def move(self, source: str, target: str, job_id: str, at: float) -> bool:
+        """
+        Atomically remove the job id from a set and add it to another one, due at the given time.
+
+        :return bool: False when the job id was not in the source set (taken by another worker).
+        """
+        raise NotImplementedError
+
+    def count(self, key: str) -> int:
+        raise NotImplementedError
+
+    def publish(self, job: dict):
+        """Notify the subscribers of the job of its new state."""
+
+    def get_lane_key(self, lane: str) -> str:
+        return f"{JOBS_PREFIX}:lane:{lane}"
+
+    def get_running_key(self) -> str:
+        return f"{JOBS_PREFIX}:running"
+
+    def get_delay(self, attempt: int) -> float:
+        """Delay before the retry of an attempt, jittered so that the failed jobs do not retry together."""
+        delay = min(self.backoff * 2 ** max(0, attempt - 1), JOB_MAX_BACKOFF)
+        return delay * random.uniform(1, 1 + JOB_JITTER)
+
+    def save(self, job: dict):
+        job["updated_at"] = time.time()
+        self.store(job)
+        self.publish(job)
+
+    def submit(self, fields: dict, stages: List[str] = None, lane: str = "interactive", **kwargs) -> str:
+        """
+        Queue a job, see `new_job` for the parameters.
+
+        :return str: The id of the job, polled with `get` or `watch`.
+        """
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane {lane}, expected one of {', '.join(self.lanes)}")
+        job = new_job(fields, stages, lane, **kwargs)
+        self.save(job)
+        self.schedule(self.get_lane_key(lane), job["id"], job["created_at"])
+        self.stats[lane]["submitted"] += 1
+        return job["id"]
+
+    def get(self, job_id: str) -> dict:
+        """The job record, None when unknown or expired."""
+        return self.load(job_id)
+
+    def claim(self, lanes=None) -> dict:
+        """
+        Take the next due job, from the lane with the highest priority.
+
+        :param lanes: The lanes served by the worker, all of them by default.
+        :return dict: The job, now running, or None when no job is due.
+        """
+        now = time.time()
+        for lane in lanes or self.lanes:
+            for job_id in self.due(self.get_lane_key(lane), now):
+                if not self.move(self.get_lane_key(lane), self.get_running_key(), job_id, now + self.lease):
+                    continue  # Claimed by another worker
+                job = self.load(job_id)
+                if job is None:
+                    self.take(self.get_running_key(), job_id)
+                    continue
+                if job["deadline"] < now:
+                    self.finish(job, "expired", "Deadline exceeded before the job started")
+                    continue
+                job["status"] = "running"
+                job["attempts"] += 1
+                self.save(job)
+                return job
+        return None
+
+    def renew(self, job: dict):
+        """Extend the lease of a running job and write its progress."""
+        self.schedule(self.get_running_key(), job["id"], time.time() + self.lease)
+        self.save(job)
+
+    def finish(self, job: dict, status: str, error: str = None):
+        self.take(self.get_running_key(), job["id"])
+        job["status"] = status
+        job["error"] = error
+        self.save(job)
+        self.stats[job["lane"]][status] += 1
+
+    def complete(self, job: dict, result):
+        job["result"] = result
+        self.finish(job, "done")
+
+    def fail(self, job: dict, error: str) -> bool:
+        """
+        Retry a failed job after a backoff, unless it has no attempt left or would miss its deadline.
+
+        :return bool: True when the job is retried.
+        """
+        delay = self.get_delay(job["attempts"])
+        if job["attempts"] >= job["max_attempts"] or time.time() + delay >= job["deadline"]:
+            self.finish(job, "failed", error)
+            return False
+        job["status"] = "queued"
+        job["error"] = error
+        self.save(job)
+        self.move(self.get_running_key(), self.get_lane_key(job["lane"]), job["id"], time.time() + delay)
+        self.stats[job["lane"]]["retried"] += 1
+        return True
+
+    def recover(self) -> int:
+        """
+        Queue again the running jobs whose lease expired, their worker died
+        (possibly before it wrote the job as running or as queued again).
+
+        :return int: The number of recovered jobs.
+        """
+        recovered = 0
+        for job_id in self.due(self.get_running_key(), time.time()):
+            job = self.load(job_id)
+            if job is None or job["status"] in FINAL_STATUSES:
+                self.take(self.get_running_key(), job_id)
+                continue
+            if job["status"] == "running" and job["attempts"] >= job["max_attempts"]:
+                if self.take(self.get_running_key(), job_id):
+                    logging.warning(f"Job {job_id} lost by its worker, no attempt left")
+                    self.finish(job, "failed", "Worker lost")
+                continue
+            if not self.move(self.get_running_key(), self.get_lane_key(job["lane"]), job_id, time.time()):
+                continue  # Recovered by another worker
+            logging.warning(f"Job {job_id} lost by its worker, queued again")
+            job["status"] = "queued"
+            self.save(job)
+            self.stats[job["lane"]]["recovered"] += 1
+            recovered += 1
+        return recovered
+
+    def pending(self, lanes=None) -> int:
+        """The number of queued (now or later) and running jobs."""
+        keys = [self.get_lane_key(lane) for lane in lanes or self.lanes] + [self.get_running_key()]
+        return sum(self.count(key) for key in keys)
+
+    def watch(self, job_id: str, timeout: float = None, interval: float = JOB_POLL_INTERVAL) -> Iterator[dict]:
+        """
+        Yield the job each time it changes, until it is finished or the timeout elapses.
+
+        :param timeout: The maximum duration of the watch (seconds), no limit by default.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        updated_at = None
+        while deadline is None or time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job["updated_at"] != updated_at:
+                updated_at = job["updated_at"]
+                yield job
+            if job["status"] in FINAL_STATUSES:
+                return
+            time.sleep(interval)
+
+
+class MemoryJobQueue(JobQueue):
+    """Queue living in the process, for the tests and local runs (the jobs never expire)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.sets = defaultdict(dict)
+
+    def load(self, job_id: str) -> dict:
+        with self.lock:
+            value = self.jobs.get(job_id)
+        return json.loads(value) if value is not None else None
+
+    def store(self, job: dict):
+        value = json.dumps(job)  # Same isolation as a remote queue: callers never share a record
+        with self.lock:
+            self.jobs[job["id"]] = value
+
+    def schedule(self, key: str, job_id: str, at: float):
+        with self.lock:
+            self.sets[key][job_id] = at
+
+    def due(self, key: str, now: float, limit: int = 10) -> List[str]:
+        with self.lock:
+            items = sorted((at, job_id) for job_id, at in self.sets[key].items() if at <= now)
+        return [job_id for _, job_id in items[:limit]]
+
+    def take(self, key: str, job_id: str) -> bool:
+        with self.lock:
+            return self.sets[key].pop(job_id, None) is not None
+
+    def move(self, source: str, target: str, job_id: str, at: float) -> bool:
+        with self.lock:
+            if self.sets[source].pop(job_id, None) is None:
+                return False
+            self.sets[target][job_id] = at
+            return True
+
+    def count(self, key: str) -> int:
+        with self.lock:
+            return len(self.sets[key])
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Queue stored in Redis, shared by the web tier and the workers of every machine.
+    The lanes are sorted sets, a job is moved to the running jobs by a Lua script (ZREM then
+    ZADD, atomically), and every change of a job is published on the channel "jobs:events:<id>".
+    """
+
+    def __init__(self, url: str, client=None, **kwargs):
+        """:param client: An already created Redis client, e.g. a fake one in tests."""
+        super().__init__(**kwargs)
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.redis = client
+
+    def get_job_key(self, job_id: str) -> str:
+        return f"{JOBS_PREFIX}:job:{job_id}"
+
+    def load(self, job_id: str) -> dict:
+        value = self.redis.get(self.get_job_key(job_id))
+        return json.loads(value) if value is not None else None
+
+    def store(self, job: dict):
+        self.redis.set(self.get_job_key(job["id"]), json.dumps(job), ex=int(self.ttl))
+
+    def schedule(self, key: str, job_id: str, at: float):
+        self.redis.zadd(key, {job_id: at})
+
+    def due(self, key: str, now: float, limit: int = 10) -> List[str]:
+        members = self.redis.zrangebyscore(key, "-inf", now, start=0, num=limit)
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    def take(self, key: str, job_id: str) -> bool:
+        return self.redis.zrem(key, job_id) == 1
+
+    def move(self, source: str, target: str, job_id: str, at: float) -> bool:
+        return self.redis.eval(MOVE_SCRIPT, 2, source, target, job_id, at) == 1
+
+    def count(self, key: str) -> int:
+        return self.redis.zcard(key)
+
+    def publish(self, job: dict):
+        event = {key: job[key] for key in ("id", "status", "attempts", "progress", "error", "updated_at")}
+        try:
+            self.redis.publish(f"{JOBS_PREFIX}:events:{job['id']}", json.dumps(event))
+        except Exception as e:  # The subscribers can still poll the job
+            logging.warning(f"Event of job {job['id']} not published: {e}")
+
+
+def create_queue(url: str, **kwargs) -> JobQueue:
+    """
+    Create the job queue described by an URL.
+
+    :param url: "redis://..." or "memory://".
+    :return JobQueue: The job queue.
+    """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(url, **kwargs)
+    return MemoryJobQueue(**kwargs)
+
+
+_lock = threading.Lock()
+_job_queue = None
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue configured by `JOBS_URL`."""
+    global _job_queue
+    with _lock:
+        if _job_queue is None:
+            _job_queue = create_queue(JOBS_URL)
+        return _job_queue
+
+
+def set_job_queue(queue: JobQueue):
+    """Replace the process-wide job queue."""
+    global _job_queue
+    with _lock:
+        _job_queue = queue
+
+
+metrics.register("jobs", lambda: _job_queue.stats if _job_queue else {}, label="lane")
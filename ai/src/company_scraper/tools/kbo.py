@@ -0,0 +1,340 @@
+from config.config import *
+import argparse, csv, io, os, re, sqlite3, threading, zipfile
+
+
+def to_entity_number(value: str):
+    """Convert an enterprise number ("0423.369.762") into an integer, None for establishment units."""
+    digits = re.sub(r"[^\d]", "", value or "")
+    if len(digits) != 10 or digits[0] not in "01":
+        return None
+    return int(digits)
+
+
+def format_date(value: str) -> str:
+    """Convert a KBO date ("29-06-1983") into the format of the KBO pages ("29 juin 1983")."""
+    match = re.fullmatch(r"(\d{2})-(\d{2})-(\d{4})", value or "")
+    if not match:
+        return value or ""
+    day, month, year = match.groups()
+    return f"{int(day)} {MONTHS_FR[int(month) - 1]} {year}"
+
+
+def format_nace_code(code: str) -> str:
+    """Format a NACEBEL code as on the KBO pages ("47520" -> "47.520")."""
+    return f"{code[:2]}.{code[2:]}" if len(code) == 5 else code
+
+
+class KboDump:
+    """Files of a KBO open data dump, either a zip archive or an extracted directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def __contains__(self, name: str) -> bool:
+        if self.archive:
+            return name in self.archive.namelist()
+        return os.path.exists(os.path.join(self.path, name))
+
+    def read(self, name: str):
+        """Iterate over the rows of a CSV file of the dump, as dictionaries."""
+        if name not in self:
+            return
+        if self.archive:
+            file = io.TextIOWrapper(self.archive.open(name), encoding="utf-8-sig", newline="")
+        else:
+            file = open(os.path.join(self.path, name), encoding="utf-8-sig", newline="")
+        with file:
+            yield from csv.DictReader(file)
+
+    def get_meta(self) -> dict:
+        """Read meta.csv (SnapshotDate, ExtractNumber, ExtractType, ...)."""
+        return {row["Variable"]: row["Value"] for row in self.read("meta.csv")}
+
+
+def remove_database(path: str):
+    """Delete a SQLite database file and its rollback journal, if any."""
+    for name in (path, f"{path}-journal"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class KboStore:
+    """
+    Local SQLite index of the KBO open data, keyed by enterprise number.
+    A full dump is imported once, then the monthly update dumps are applied on top of it.
+    """
+
+    def __init__(self, path: str, language: str = KBO_LANGUAGE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.language = language
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.create_tables()
+
+    def create_tables(self):
+        for table, columns in KBO_TABLES.items():
+            key = "PRIMARY KEY" if table == "enterprise" else ""
+            definition = ", ".join([f"{columns[0]} INTEGER {key}", *columns[1:]])
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definition})")
+            if table != "enterprise":
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_entity ON {table} ({columns[0]})"
+                )
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS code ({', '.join(KBO_CODE_COLUMNS)}, "
+            "PRIMARY KEY (Category, Code, Language))"
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (Variable PRIMARY KEY, Value)")
+
+    @property
+    def extract_number(self) -> int:
+        """Number of the last imported dump, 0 when the index is empty."""
+        row = self.connection.execute(
+            "SELECT Value FROM meta WHERE Variable = 'ExtractNumber'"
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def insert_rows(self, table: str, rows):
+        """Insert the rows of an enterprise table, skipping the establishment units."""
+        columns = KBO_TABLES[table]
+        values = (
+            (number, *(row.get(column, "") for column in columns[1:]))
+            for row in rows
+            if (number := to_entity_number(row.get(columns[0]))) is not None
+        )
+        placeholders = ", ".join("?" * len(columns))
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", values
+        )
+
+    def insert_codes(self, rows):
+        placeholders = ", ".join("?" * len(KBO_CODE_COLUMNS))
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO code VALUES ({placeholders})",
+            ([row[column] for column in KBO_CODE_COLUMNS] for row in rows),
+        )
+
+    def delete_rows(self, table: str, rows):
+        """Delete all the rows of the listed entities."""
+        column = KBO_TABLES[table][0]
+        numbers = (
+            (number,)
+            for row in rows
+            if (number := to_entity_number(next(iter(row.values()), ""))) is not None
+        )
+        self.connection.executemany(f"DELETE FROM {table} WHERE {column} = ?", numbers)
+
+    def import_dump(self, path: str) -> bool:
+        """
+        Import a full dump, or apply an update dump on top of the index.
+
+        :param path: The zip archive or extracted directory of the dump.
+        :return bool: False when the dump was skipped (update older than the index).
+        """
+        dump = KboDump(path)
+        meta = dump.get_meta()
+        number = int(meta.get("ExtractNumber", 0))
+        is_full = meta.get("ExtractType", "full").casefold() == "full"
+        if is_full:
+            self.import_full_dump(dump, meta)
+            logging.info(f"KBO full dump {number} imported from {path}")
+            return True
+
+        # The update only deletes and inserts rows, sqlite3 runs them in a single transaction
+        with self.lock, self.connection:
+            if number <= self.extract_number:
+                logging.info(f"KBO update {number} already applied, skipping {path}")
+                return False
+            if number != self.extract_number + 1:
+                logging.warning(f"KBO update {number} applied after {self.extract_number}")
+
+            # Deleted entities are removed from every table before the new rows are inserted
+            for table in KBO_TABLES:
+                self.delete_rows(table, dump.read(f"{table}_delete.csv"))
+            for table in KBO_TABLES:
+                self.insert_rows(table, dump.read(f"{table}_insert.csv"))
+            self.insert_codes(dump.read("code_insert.csv"))
+            self.insert_meta(meta)
+        logging.info(f"KBO update dump {number} imported from {path}")
+        return True
+
+    def import_full_dump(self, dump: KboDump, meta: dict):
+        """
+        Build the index of a full dump in a new database file, then replace the current one.
+        The current index stays complete and readable during the import, and is kept as is
+        when the import fails or is interrupted.
+        """
+        temporary = f"{self.path}.import"
+        remove_database(temporary)
+        store = KboStore(temporary, self.language)
+        try:
+            with store.connection:
+                for table in KBO_TABLES:
+                    store.insert_rows(table, dump.read(f"{table}.csv"))
+                store.insert_codes(dump.read("code.csv"))
+                store.insert_meta(meta)
+            store.connection.close()
+            with self.lock:
+                self.connection.close()
+                try:
+                    os.replace(temporary, self.path)
+                finally:
+                    self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        except BaseException:
+            store.connection.close()
+            remove_database(temporary)
+            raise
+
+    def insert_meta(self, meta: dict):
+        self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
+
+    def get_code(self, category: str, code: str) -> str:
+        """Description of a code in the language of the store."""
+        row = self.connection.execute(
+            "SELECT Description FROM code WHERE Category = ? AND Code = ? "
+            "ORDER BY Language = ? DESC LIMIT 1",
+            (category, code, self.language),
+        ).fetchone()
+        return row[0] if row else ""
+
+    def get_name(self, number: int) -> str:
+        """Legal name, in the language of the store when the company has one."""
+        language = KBO_DENOMINATION_LANGUAGES.get(self.language, "")
+        row = self.connection.execute(
+            "SELECT Denomination FROM denomination WHERE EntityNumber = ? "
+            "AND TypeOfDenomination = ? ORDER BY Language = ? DESC, Language LIMIT 1",
+            (number, KBO_LEGAL_NAME, language),
+        ).fetchone()
+        return row[0] if row else ""
+
+    def get_address(self, number: int) -> AddressSchema:
+        """Address of the registered office."""
+        row = self.connection.execute(
+            "SELECT StreetFR, StreetNL, HouseNumber, Box, Zipcode, MunicipalityFR, MunicipalityNL "
+            "FROM address WHERE EntityNumber = ? AND TypeOfAddress = ?",
+            (number, KBO_REGISTERED_OFFICE),
+        ).fetchone()
+        if not row:
+            return AddressSchema()
+        street_fr, street_nl, house_number, box, zipcode, city_fr, city_nl = row
+        if self.language == "NL":
+            street_fr, city_fr = street_nl, city_nl
+        return AddressSchema(
+            street=street_fr or street_nl,
+            street_number=house_number,
+            postal_box=box,
+            postal_code=zipcode,
+            city=city_fr or city_nl,
+            country="Belgique",
+        )
+
+    def get_activities(self, number: int) -> ActivitiesSchema:
+        """NACEBEL codes of the most recent nomenclature, main activities first."""
+        rows = self.connection.execute(
+            "SELECT NaceVersion, NaceCode FROM activity WHERE EntityNumber = ? "
+            "AND NaceVersion = (SELECT MAX(NaceVersion) FROM activity WHERE EntityNumber = ?) "
+            "ORDER BY Classification != 'MAIN', rowid",
+            (number, number),
+        ).fetchall()
+        codes, activities = [], []
+        for version, code in rows:
+            if format_nace_code(code) in codes:
+                continue
+            codes.append(format_nace_code(code))
+            description = self.get_code(f"Nace{version}", code)
+            if description:
+                activities.append(description)
+        return ActivitiesSchema(nacebel_codes=codes, company_activities=activities)
+
+    def get_contact(self, number: int) -> ContactSchema:
+        contacts = dict(
+            self.connection.execute(
+                "SELECT ContactType, Value FROM contact WHERE EntityNumber = ?", (number,)
+            ).fetchall()
+        )
+        website = contacts.get("WEB", "")
+        if website and not website.startswith(("http://", "https://")):
+            website = "https://" + website
+        return ContactSchema(
+            email=contacts.get("EMAIL", ""), phone=contacts.get("TEL", ""), website=website
+        )
+
+    def lookup(self, vat_number: str) -> CompanySchema:
+        """
+        Fill a CompanySchema with the legal data of an enterprise.
+
+        :param vat_number: The enterprise number, with or without dots.
+        :return CompanySchema: The legal data, or None if the enterprise is not in the index.
+        """
+        number = to_entity_number(vat_number)
+        if number is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT TypeOfEnterprise, JuridicalForm, StartDate FROM enterprise "
+                "WHERE EnterpriseNumber = ?",
+                (number,),
+            ).fetchone()
+            if not row:
+                return None
+            type_of_enterprise, juridical_form, start_date = row
+            company_type = self.get_code("TypeOfEnterprise", type_of_enterprise)
+            return CompanySchema(
+                name=self.get_name(number),
+                vat_number=f"{number:010d}",
+                established=format_date(start_date),
+                legal_form=self.get_code("JuridicalForm", juridical_form),
+                company_type=[company_type] if company_type else [],
+                is_company=type_of_enterprise == "2",  # 1: natural person, 2: legal person
+                address=self.get_address(number),
+                activities=self.get_activities(number),
+                financial=FinancialSchema(),
+                contact=self.get_contact(number),
+            )
+
+
+_lock = threading.Lock()
+_store = None
+
+
+def get_kbo_store() -> KboStore:
+    """Return the KBO index of `KBO_DATABASE`, None when no dump has been imported."""
+    global _store
+    with _lock:
+        if _store is None and os.path.exists(KBO_DATABASE):
+            _store = KboStore(KBO_DATABASE)
+        return _store
+
+
+def set_kbo_store(store: KboStore):
+    """Replace the KBO index, e.g. by one built from a fixture dump in tests."""
+    global _store
+    with _lock:
+        _store = store
+
+
+def lookup_kbo(vat_number: str) -> CompanySchema:
+    """Read the legal data of a company in the local KBO index, None when unavailable."""
+    store = get_kbo_store()
+    if store is None or not vat_number:
+        return None
+    try:
+        return store.lookup(vat_number)
+    except sqlite3.Error as e:
+        logging.error(f"KBO index unavailable: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import KBO open data dumps into the local index.")
+    parser.add_argument("dumps", nargs="+", help="Full dump then update dumps (zip or directory)")
+    parser.add_argument("--database", default=KBO_DATABASE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = KboStore(args.database)
+    for path in args.dumps:
+        store.import_dump(path)
@@ -0,0 +1,191 @@
+from .cache import get_cache, SingleFlight, CacheBackend
+from .metrics import metrics
+from config.config import *
+from pydantic import BaseModel
+from collections import defaultdict
+from functools import lru_cache
+import hashlib, re
+
+
+class LlmCache:
+    """
+    Content-addressed cache of LLM answers, keyed by (prompt template, model, normalized input).
+    Identical requests running at the same time are sent only once to the model.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = LLM_CACHE_TTL):
+        self._backend = backend
+        self.ttl = ttl
+        self.flights = SingleFlight()
+        # Counters by prompt: hit, miss, coalesced and bypassed (answer not cached)
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache()
+
+    def get_key(self, prompt, model, inputs: dict, schema=None) -> str:
+        """Hash the prompt template, the model, the output schema and the normalized inputs."""
+        if isinstance(schema, type) and issubclass(schema, BaseModel):
+            schema = schema.model_json_schema()
+        payload = json.dumps(
+            {
+                "prompt": get_template(prompt),
+                "model": get_model_name(model),
+                "schema": schema,
+                "inputs": normalize_inputs(inputs),
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return "llm:" + hashlib.sha256(payload.encode()).hexdigest()
+
+    def load(self, key: str, name: str, schema=None):
+        """Return the cached answer, or None."""
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.error(f"LLM cache unavailable: {e}")
+            return None
+        if value is None:
+            return None
+        self.stats[name]["hit"] += 1
+        return from_cache_value(value, schema)
+
+    def save(self, key: str, name: str, answer):
+        """Store an answer, answers which cannot be serialized are reported as bypassed."""
+        try:
+            self.backend.set(key, to_cache_value(answer), self.ttl)
+        except Exception as e:
+            self.stats[name]["bypassed"] += 1
+            logging.error(f"LLM answer of {name} not cached: {e}")
+
+    def invoke(self, prompt, model, inputs: dict, schema=None):
+        """
+        Invoke `prompt | model`, with a structured output when a schema is given.
+
+        :param prompt: The prompt template (see `Prompt`).
+        :param model: The name of the chat model (see `LLM`) or the chat model.
+        :param inputs: The variables of the prompt.
+        :param schema: The pydantic class or JSON schema of the structured output.
+        :return: The content of the answer, or the structured output.
+        """
+        name = prompt_name(prompt)
+        key = self.get_key(prompt, model, inputs, schema)
+        answer = self.load(key, name, schema)
+        if answer is not None:
+            return answer
+
+        def compute():
+            with metrics.timer("llm", prompt=name):
+                answer = to_answer(build_chain(prompt, model, schema).invoke(inputs))
+            self.save(key, name, answer)
+            return answer
+
+        answer, shared = self.flights.do(key, compute)
+        self.stats[name]["coalesced" if shared else "miss"] += 1
+        return answer
+
+    async def ainvoke(self, prompt, model, inputs: dict, schema=None):
+        """Asynchronous version of `invoke`, the cache backend is read and written in a thread."""
+        name = prompt_name(prompt)
+        key = self.get_key(prompt, model, inputs, schema)
+        answer = await asyncio.to_thread(self.load, key, name, schema)
+        if answer is not None:
+            return answer
+
+        async def compute():
+            async with metrics.atimer("llm", prompt=name):
+                answer = to_answer(await build_chain(prompt, model, schema).ainvoke(inputs))
+            await asyncio.to_thread(self.save, key, name, answer)
+            return answer
+
+        answer, shared = await self.flights.ado(key, compute)
+        self.stats[name]["coalesced" if shared else "miss"] += 1
+        return answer
+
+
+@lru_cache(maxsize=None)
+def get_model(name: str):
+    """
+    Create the chat model on first use: langchain_openai takes most of the import time
+    of the project and its client requires `OPENAI_API_KEY`.
+
+    :param name: The name of the model (see `LLM`).
+    """
+    from langchain_openai.chat_models import ChatOpenAI
+
+    return ChatOpenAI(model=name)
+
+
+@lru_cache(maxsize=None)
+def get_prompt(template: str):
+    """Build the langchain prompt of a template (see `Prompt`) on first use."""
+    from langchain_core.prompts import PromptTemplate
+
+    return PromptTemplate.from_template(template)
+
+
+def get_template(prompt) -> str:
+    return prompt if isinstance(prompt, str) else prompt.template
+
+
+def get_model_name(model) -> str:
+    return model if isinstance(model, str) else getattr(model, "model_name", type(model).__name__)
+
+
+def build_chain(prompt, model, schema=None):
+    """Chain the prompt with the model, with a structured output when a schema is given."""
+    prompt = get_prompt(prompt) if isinstance(prompt, str) else prompt
+    model = get_model(model) if isinstance(model, str) else model
+    return prompt | (model.with_structured_output(schema) if schema else model)
+
+
+def prompt_name(prompt) -> str:
+    """Return the name of the prompt in `Prompt`, used to report the cache statistics."""
+    for name, value in vars(Prompt).items():
+        if value is prompt:
+            return name
+    return "UNKNOWN"
+
+
+def normalize_inputs(value):
+    """Normalize the prompt inputs so that formatting-only differences share the same cache key."""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, BaseModel):
+        return normalize_inputs(value.model_dump())
+    if isinstance(value, dict):
+        return {key: normalize_inputs(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_inputs(item) for item in value]
+    return value
+
+
+def to_answer(output):
+    """Keep only the content of plain chat answers."""
+    return output.content if hasattr(output, "content") else output
+
+
+def to_cache_value(answer):
+    return answer.model_dump() if isinstance(answer, BaseModel) else answer
+
+
+def from_cache_value(value, schema=None):
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        return schema.model_validate(value)
+    return value
+
+
+llm_cache = LlmCache()
+metrics.register("llm_cache", lambda: llm_cache.stats, label="prompt")
+
+
+def invoke_llm(prompt, model, inputs: dict, schema=None):
+    """Invoke an LLM through the shared `LlmCache`."""
+    return llm_cache.invoke(prompt, model, inputs, schema)
+
+
+async def ainvoke_llm(prompt, model, inputs: dict, schema=None):
+    """Asynchronous version of `invoke_llm`."""
+    return await llm_cache.ainvoke(prompt, model, inputs, schema)
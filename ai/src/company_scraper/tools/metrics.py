@@ -0,0 +1,249 @@
+from collections import defaultdict
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+import asyncio, contextvars, functools, json, re, threading, time
+
+METRICS_PREFIX = "company_scraper"
+
+
+class RunTimings:
+    """Time spent in each step of one pipeline run, by step ("fetch:kbopub.economie.fgov.be", "llm:FIND_URL", ...)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        self.started = time.perf_counter()
+
+    def add(self, step: str, seconds: float):
+        with self.lock:
+            self.steps[step]["count"] += 1
+            self.steps[step]["seconds"] += seconds
+
+    def to_dict(self) -> dict:
+        """The steps, slowest first, and the total duration of the run."""
+        with self.lock:
+            steps = sorted(self.steps.items(), key=lambda item: item[1]["seconds"], reverse=True)
+            return {
+                "total": round(time.perf_counter() - self.started, 4),
+                "steps": {
+                    step: {"count": value["count"], "seconds": round(value["seconds"], 4)} for step, value in steps
+                },
+            }
+
+
+# Timings of the run being executed, shared with its asyncio tasks and `in_context` threads
+current_run: ContextVar[RunTimings] = ContextVar("current_run", default=None)
+
+
+@contextmanager
+def track_run():
+    """Record the timings of the steps executed in this block into a new `RunTimings`."""
+    timings = RunTimings()
+    token = current_run.set(timings)
+    try:
+        yield timings
+    finally:
+        current_run.reset(token)
+
+
+def in_context(func):
+    """Wrap a function submitted to a thread pool so that it runs in the caller's context (current run)."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def to_labels(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    In-process counters and timers, without any external service. The statistics kept
+    by the caches are exposed through collectors, so that everything is exported together.
+    """
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.timers = {}  # (name, labels) -> [count, sum, max] in seconds
+        self.collectors = {}  # name -> (label, function returning the stats, gauge)
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Increment a counter."""
+        key = (name, to_labels(labels))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Record a duration, also added to the timings of the current run."""
+        key = (name, to_labels(labels))
+        with self.lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+        timings = current_run.get()
+        if timings is not None:
+            timings.add(":".join([name, *map(str, labels.values())]), seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the block, e.g. `with metrics.timer("fetch", host=host):`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @asynccontextmanager
+    async def atimer(self, name: str, **labels):
+        """Asynchronous version of `timer`, usable in an `async with` statement."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator timing every call of a function or coroutine function."""
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def register(self, name: str, stats, label: str = None, gauge: bool = False):
+        """
+        Expose the counters of a component.
+
+        :param name: The name of the counters ("http_cache", "llm_cache", ...).
+        :param stats: Function returning the stats, either {"hit": 3, ...} or,
+            with a `label`, {"FIND_URL": {"hit": 3, ...}, ...}.
+        :param label: The name of the label of the first level of nested stats.
+        :param gauge: Whether the stats are current values (rate, state, ...) rather than counters.
+        """
+        with self.lock:
+            self.collectors[name] = (label, stats, gauge)
+
+    def collect(self, gauges: bool = False) -> dict:
+        """Read the registered counters, or gauges, as {(name, labels): value}."""
+        with self.lock:
+            collectors = [(name, collector) for name, collector in self.collectors.items() if collector[2] == gauges]
+        values = {}
+        for name, (label, stats, _) in collectors:
+            stats = dict(stats())
+            groups = stats.items() if label else [(None, stats)]
+            for group, counters in groups:
+                for result, value in dict(counters).items():
+                    labels = {label: group, "result": result} if label else {"result": result}
+                    values[(name, to_labels(labels))] = value
+        return values
+
+    def snapshot(self) -> dict:
+        """All the metrics as a JSON serializable dictionary."""
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {key: list(value) for key, value in self.timers.items()}
+        counters.update(self.collect())
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.collect(gauges=True).items())
+            ],
+            "timers": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "seconds": round(total, 6),
+                    "max_seconds": round(longest, 6),
+                }
+                for (name, labels), (count, total, longest) in sorted(timers.items())
+            ],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def metric_name(self, name: str) -> str:
+        return re.sub(r"[^a-zA-Z0-9_]", "_", f"{self.prefix}_{name}")
+
+    def to_prometheus(self) -> str:
+        """All the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        counters = defaultdict(list)
+        for counter in snapshot["counters"]:
+            counters[counter["name"]].append(counter)
+        for name, items in counters.items():
+            metric = self.metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            for item in items:
+                lines.append(f"{metric}{format_labels(tuple(item['labels'].items()))} {item['value']:g}")
+
+        gauges = defaultdict(list)
+        for gauge in snapshot["gauges"]:
+            gauges[gauge["name"]].append(gauge)
+        for name, items in gauges.items():
+            metric = self.metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            for item in items:
+                lines.append(f"{metric}{format_labels(tuple(item['labels'].items()))} {item['value']:g}")
+
+        timers = defaultdict(list)
+        for timer in snapshot["timers"]:
+            timers[timer["name"]].append(timer)
+        for name, items in timers.items():
+            metric = self.metric_name(name) + "_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for item in items:
+                labels = format_labels(tuple(item["labels"].items()))
+                lines.append(f"{metric}_count{labels} {item['count']}")
+                lines.append(f"{metric}_sum{labels} {item['seconds']:g}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            for item in items:
+                lines.append(f"{metric}_max{format_labels(tuple(item['labels'].items()))} {item['max_seconds']:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Clear the counters and timers (the registered stats belong to their components)."""
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,142 @@
+from .utils import compare_name_with_domain
+from difflib import SequenceMatcher
+from config.config import *
+import re, unicodedata
+
+# Belgian VAT / enterprise numbers: BE 0423.369.762, BE0423369762, 0423 369 762, ...
+VAT_NUMBER = re.compile(r"(?<![\d.])(?:BE\s?)?([01]\d{3})[.\s]?(\d{3})[.\s]?(\d{3})(?!\d)", re.IGNORECASE)
+
+# Length of the word prefixes compared, so that plural and singular forms match
+STEM_LENGTH = 6
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase a text and remove its accents and punctuation."""
+    text = unicodedata.normalize("NFKD", text or "").casefold()
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def get_stems(text: str) -> set:
+    """Return the prefixes of the significant words of a text."""
+    return {
+        word[:STEM_LENGTH]
+        for word in normalize_text(text).split()
+        if len(word) >= 5 and word not in GENERIC_ACTIVITY_WORDS
+    }
+
+
+def find_vat_numbers(html: str) -> List[str]:
+    """Find the Belgian VAT numbers published on a page (footer, legal notice, JSON-LD, ...)."""
+    return sorted({"".join(match) for match in VAT_NUMBER.findall(html or "")})
+
+
+def score_domain(company_name: str, url: str) -> float:
+    """Similarity between the company name and the domain, between 0 and 1."""
+    return compare_name_with_domain(company_name, url) / 100
+
+
+def score_site_name(company_name: str, data: dict) -> float:
+    """Best match between the company name and the site name or titles of the page, between 0 and 1."""
+    name = normalize_text(company_name).replace(" ", "")
+    if not name:
+        return 0
+    scores = [0]
+    for key in ("og_site_name", "og_title", "title"):
+        value = normalize_text(data.get(key)).replace(" ", "")
+        if not value:
+            continue
+        if name in value:
+            return 1
+        scores.append(SequenceMatcher(None, name, value).ratio())
+    return max(scores)
+
+
+def score_activities(activities: List[str], data: dict) -> float:
+    """Share of the company activities having a keyword on the page, between 0 and 1."""
+    keywords = [stems for stems in map(get_stems, activities or []) if stems]
+    if not keywords:
+        return 0
+    page = " ".join(
+        data.get(key) or "" for key in ("title", "description", "og_description", "website_content")
+    )
+    page_stems = get_stems(page)
+    return sum(1 for stems in keywords if stems & page_stems) / len(keywords)
+
+
+def score_vat(vat_number: str, data: dict) -> float:
+    """1 when the VAT number of the company is published on the page, 0 otherwise."""
+    return float(bool(vat_number) and vat_number in data.get("vat_numbers", []))
+
+
+def score_website(entry: dict, company_schema: CompanySchema) -> float:
+    """
+    Score a candidate website from deterministic signals.
+
+    :param entry: The page data built by `parse_page_data`.
+    :param company_schema: The company looked for.
+    :return float: A score between 0 and 100 (see `RANKING_WEIGHTS`).
+    """
+    data = entry["data"]
+    scores = {
+        "domain": score_domain(company_schema.name, data["url"]),
+        "site_name": score_site_name(company_schema.name, data),
+        "activities": score_activities(company_schema.activities.company_activities, data),
+        "vat": score_vat(company_schema.vat_number, data),
+    }
+    return sum(RANKING_WEIGHTS[key] * score for key, score in scores.items())
+
+
+def upper_bound(url: str, company_schema: CompanySchema) -> float:
+    """Best score a website can reach before being loaded, only its domain being known."""
+    others = sum(weight for key, weight in RANKING_WEIGHTS.items() if key != "domain")
+    return RANKING_WEIGHTS["domain"] * score_domain(company_schema.name, url) + others
+
+
+def sort_urls(urls: List[str], company_schema: CompanySchema) -> List[str]:
+    """Sort the candidate URLs from the most to the least promising domain."""
+    return sorted(urls, key=lambda url: score_domain(company_schema.name, url), reverse=True)
+
+
+def can_win(url: str, company_schema: CompanySchema, best_score: float) -> bool:
+    """Check if a website not loaded yet can still come within `RANKING_MARGIN` of the best score."""
+    return upper_bound(url, company_schema) >= best_score - RANKING_MARGIN
+
+
+def split_candidates(urls: List[str], company_schema: CompanySchema) -> tuple:
+    """
+    Split the candidate URLs sorted by `sort_urls` into the first wave, loaded at once, and the
+    others, loaded once the first wave is scored. No website of the first wave can score above
+    the upper bound of the best domain, so the URLs within `RANKING_MARGIN` of it would never
+    be pruned by `can_win` and are loaded in the first wave.
+
+    :return: (first, others) the URLs of each wave.
+    """
+    if not urls:
+        return [], []
+    best_bound = upper_bound(urls[0], company_schema)
+    first = [url for url in urls if can_win(url, company_schema, best_bound)]
+    return first, [url for url in urls if url not in first]
+
+
+def rank_websites(websites_data: List[dict], company_schema: CompanySchema) -> List[dict]:
+    """Score the candidate websites (added as `score` to their data) and sort them, best first."""
+    for entry in websites_data:
+        entry["data"]["score"] = round(score_website(entry, company_schema), 1)
+    return sorted(websites_data, key=lambda entry: entry["data"]["score"], reverse=True)
+
+
+def pick_website(ranking: List[dict]) -> tuple:
+    """
+    Pick the website when the ranking has an obvious winner.
+
+    :param ranking: The candidates sorted by `rank_websites`.
+    :return: (winner, contenders) where winner is None when the LLM must choose between the contenders.
+    """
+    if not ranking:
+        return None, []
+    best_score = ranking[0]["data"]["score"]
+    contenders = [entry for entry in ranking if entry["data"]["score"] >= best_score - RANKING_MARGIN]
+    if len(contenders) == 1 and best_score >= RANKING_MIN_SCORE:
+        return contenders[0], contenders
+    return None, contenders
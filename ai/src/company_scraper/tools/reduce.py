@@ -0,0 +1,118 @@
+from config.config import *
+from functools import lru_cache
+import re
+
+# Markdown images and links, the URLs are only noise for the LLM
+MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+BOILERPLATE = re.compile(BOILERPLATE_PATTERN, re.IGNORECASE)
+
+# Average length of a token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
+def is_boilerplate(tag) -> bool:
+    """Check if a tag is a cookie banner, a menu, a pop-up, ... from its role, class or id."""
+    if tag.attrs is None:  # Already removed with its parent
+        return False
+    if tag.get("role") in BOILERPLATE_ROLES:
+        return True
+    # Each class name is matched on its own, "main-nav container" is a menu
+    names = [*tag.get("class", []), tag.get("id") or ""]
+    return any(name and BOILERPLATE.search(name) for name in names)
+
+
+def strip_boilerplate(soup: BeautifulSoup) -> BeautifulSoup:
+    """
+    Remove the navigation, footers, cookie banners, forms and scripts of a page.
+
+    :param soup: The parsed page, modified in place (read its metadata first).
+    :return BeautifulSoup: The same tree, keeping only the main content.
+    """
+    for tag in soup.find_all(BOILERPLATE_TAGS):
+        tag.decompose()
+    body = soup.body or soup
+    for tag in body.find_all(is_boilerplate):
+        tag.decompose()
+    return soup
+
+
+def clean_markdown(markdown: str) -> str:
+    """Remove the images and link targets, then drop the blocks already seen on the page."""
+    markdown = MARKDOWN_LINK.sub(r"\1", MARKDOWN_IMAGE.sub("", markdown))
+    seen = set()
+    blocks = []
+    for block in re.split(r"\n\s*\n", markdown):
+        key = " ".join(block.split()).casefold()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        blocks.append(block.strip())
+    return "\n\n".join(blocks)
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Return the tiktoken encoding of `TOKENIZER_ENCODING`, None if tiktoken is unavailable."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, token counts are estimated: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text."""
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """
+    Truncate a text to a number of tokens, at the end of the last complete block or line.
+
+    :param text: The text to truncate.
+    :param budget: The maximum number of tokens.
+    :return str: The text itself when it fits in the budget.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        if len(text) <= budget * CHARS_PER_TOKEN:
+            return text
+        truncated = text[: budget * CHARS_PER_TOKEN]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= budget:
+            return text
+        truncated = encoding.decode(tokens[:budget])
+
+    # Avoid ending the content with half a sentence when a line break is close enough
+    cut = truncated.rfind("\n")
+    if cut > len(truncated) * 0.8:
+        truncated = truncated[:cut]
+    return truncated.rstrip()
+
+
+def reduce_content(markdown: str, budget: int) -> str:
+    """Deduplicate a page content and fit it into a token budget."""
+    return truncate_tokens(clean_markdown(markdown or ""), budget)
+
+
+def reduce_candidates(websites_data: List[dict], budget: int = FIND_URL_TOKEN_BUDGET) -> List[dict]:
+    """
+    Copy the candidate websites with their content reduced, for `Prompt.FIND_URL`.
+    The complete content is kept in `websites_data` for the description of the selected website.
+    """
+    return [
+        {
+            "data": {
+                **entry["data"],
+                "website_content": reduce_content(entry["data"].get("website_content"), budget),
+            }
+        }
+        for entry in websites_data
+    ]
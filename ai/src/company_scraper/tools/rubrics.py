@@ -0,0 +1,124 @@
+from functools import lru_cache
+from typing import Iterable, Iterator
+import csv, re
+
+# Keys of the annual account CSV holding an amount ("70", "10/49", "9087", ...)
+RUBRIC_CODE = re.compile(r"\d[\d/.-]*")
+MODEL_CODE = "Model code"
+
+
+@lru_cache(maxsize=4096)
+def is_rubric_code(key: str) -> bool:
+    """Whether a key holds an amount, cached since the same few hundred codes come back in every file."""
+    return RUBRIC_CODE.fullmatch(key) is not None
+
+
+def to_amount(value: str) -> float:
+    """Convert an amount, with a decimal comma or point, None when it is not a number."""
+    try:
+        return float(value.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def parse_row(row: list, wanted: set = None) -> tuple:
+    """
+    Type a row of an annual account CSV.
+
+    :param wanted: The requested codes, all the amounts when None.
+    :return tuple: (code, value) with a float value ("Model code" stays a string), None to skip the row.
+    """
+    if len(row) < 2 or (wanted is not None and row[0] not in wanted):
+        return None
+    key = row[0]
+    if key == MODEL_CODE:
+        return key, row[1]
+    if not is_rubric_code(key):
+        return None
+    amount = to_amount(row[1])
+    return (key, amount) if amount is not None else None
+
+
+def iter_rubrics(lines: Iterable[str], codes: Iterable[str] = None) -> Iterator[tuple]:
+    """
+    Yield the typed (code, value) pairs of an annual account CSV while it is read.
+
+    :param lines: The lines of the CSV, e.g. a file, a `StringIO` or a streamed response.
+        They are consumed one by one, the rest is left unread after an early stop.
+    :param codes: The rubric codes to extract ("Model code" included if wanted). The reading
+        stops as soon as all of them are found. All the amounts by default.
+    :return: An iterator over the (code, value) pairs, in file order.
+    """
+    wanted = set(codes) if codes is not None else None
+    remaining = set(wanted) if wanted is not None else None
+    for row in csv.reader(lines):
+        item = parse_row(row, wanted)
+        if item is None:
+            continue
+        yield item
+        if remaining is not None:
+            remaining.discard(item[0])
+            if not remaining:
+                return
+
+
+class RubricReader:
+    """
+    Push version of `iter_rubrics`, fed line by line (e.g. from an asynchronous stream)
+    so that a response body never has to be held as a whole.
+    """
+
+    def __init__(self, codes: Iterable[str] = None):
+        """:param codes: The rubric codes to extract, all the amounts by default."""
+        self.wanted = {*codes, MODEL_CODE} if codes is not None else None
+        self.remaining = set(codes) if codes is not None else None
+        self.model = ""
+        self.amounts = {}
+        self.line = None
+        # One csv.reader for the whole file, pulling each fed line from `__next__`
+        self.rows = csv.reader(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self.line is None:
+            raise StopIteration
+        line, self.line = self.line, None
+        return line
+
+    @property
+    def done(self) -> bool:
+        """True once all the requested codes have been found."""
+        return self.remaining is not None and not self.remaining
+
+    def feed(self, line: str) -> bool:
+        """
+        Read one line of the CSV.
+
+        :return bool: True when the rest of the file can be skipped.
+        """
+        self.line = line
+        for row in self.rows:
+            item = parse_row(row, self.wanted)
+            if item is None:
+                continue
+            self.add(*item)
+        return self.done
+
+    def add(self, code: str, value):
+        """Store an already typed (code, value) pair."""
+        if code == MODEL_CODE:
+            self.model = value  # Always kept, it tells the size of the company
+        else:
+            self.amounts[code] = value
+        if self.remaining is not None:
+            self.remaining.discard(code)
+
+    def result(self) -> tuple:
+        """
+        :return tuple: (model, rubrics, values) with the rubric codes and their amounts as a float array.
+        """
+        import numpy as np  # Only needed by the financial history
+
+        return self.model, list(self.amounts), np.fromiter(self.amounts.values(), dtype=np.float64)
@@ -1,8 +1,10 @@
-from langchain_core.document_loaders import BaseLoader
-from langchain.schema import Document
-from .utils import *
+from .document import Document
+from .client import *
+from .cache import HttpCache, http_cache
+from .hosts import HostLimits, get_host_limits
+from .metrics import metrics
 from urllib.parse import urlparse
-import random, requests, logging
+import asyncio, random, logging, httpx
 
 # List of user agents to rotate requests and avoid detection
 USER_AGENTS = [
@@ -13,11 +15,35 @@ USER_AGENTS = [
     "Mozilla/5.0 (iPad; CPU OS 15_7 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Version/15.7 Mobile/15E148 Safari/537.36",
 ]
 
+# Content types never converted into documents
+BINARY_CONTENT_TYPES = ("image/", "audio/", "video/", "font/", "application/pdf", "application/zip")
+
 
 class CompanyScraper:
-    def __init__(self, loader: BaseLoader):
-        # Initialize the scraper with a document loader
-        self.loader = loader
+    def __init__(
+        self,
+        client: httpx.Client = None,
+        async_client: httpx.AsyncClient = None,
+        cache: HttpCache = None,
+        limits: HostLimits = None,
+    ):
+        # Use the process-wide pooled clients, cache and host limits unless specific ones are given
+        self._client = client
+        self._async_client = async_client
+        self.cache = cache or http_cache
+        self._limits = limits
+
+    @property
+    def client(self) -> httpx.Client:
+        return self._client or get_client()
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        return self._async_client or get_async_client()
+
+    @property
+    def limits(self) -> HostLimits:
+        return self._limits or get_host_limits()
 
     def is_valid_format(self, url: str) -> bool:
         """
@@ -38,22 +64,6 @@ class CompanyScraper:
         # Ensure the domain appears valid
         return bool(parsed_url.netloc and "." in parsed_url.netloc)
 
-    def is_accessible_url(self, url: str) -> bool:
-        """Check if the URL responds with a valid HTTP status."""
-        try:
-            response = requests.head(
-                url, headers=self.get_random_header(), allow_redirects=True, timeout=10
-            )
-            return response.status_code in [200, 405, 403] # method 'head' can be not allowed and return code 405 or 403
-        except requests.RequestException as e:
-            # Capture et affiche l'exception
-            logging.error(f"Erreur lors de la requête HTTP pour l'URL {url} : {str(e)}")
-            return False
-
-    def is_valid_url(self, url: str) -> bool:
-        """Check if the URL is well-formed and accessible."""
-        return self.is_valid_format(url) and self.is_accessible_url(url)
-
     def get_random_header(self) -> dict:
         """
         Generate a random HTTP header to simulate different user agents.
@@ -67,23 +77,135 @@ class CompanyScraper:
             "Connection": "keep-alive",
         }
 
+    def is_valid_response(self, url: str, response: httpx.Response, first_chunk: bytes) -> bool:
+        """
+        Check, from the status and the first bytes of the body, that the response is worth reading.
+
+        :param url: The requested URL.
+        :param response: The streamed response, whose body is not read yet.
+        :param first_chunk: The first bytes of the body.
+        :return: True if the response is a successful textual response, False otherwise
+        """
+        if not response.is_success:
+            logging.error(f"HTTP status {response.status_code} for the URL {url}")
+            return False
+
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().casefold()
+        if content_type.startswith(BINARY_CONTENT_TYPES) or b"\x00" in first_chunk:
+            logging.error(f"Non textual content ({content_type}) for the URL {url}")
+            return False
+        return True
+
+    def to_documents(self, url: str, text: str) -> list[Document]:
+        """Wrap the body of a response into a document."""
+        return [Document(page_content=text, metadata={"source": url})]
+
+    def skip(self, url: str, entry: dict) -> list[Document]:
+        """The circuit of the host is open, the request is not sent."""
+        logging.error(f"Skipping {url}: the host failed recently")
+        return self.fallback(url, entry)
+
+    def get_headers(self, entry: dict) -> dict:
+        """Build the request headers, revalidating the stale cache entry if any."""
+        return {**self.get_random_header(), **self.cache.conditional_headers(entry)}
+
+    def read_response(self, url: str, response: httpx.Response, content: bytes, entry: dict) -> list[Document]:
+        """Convert a response into documents and store it in the cache."""
+        if response.status_code == 304 and entry:
+            entry = self.cache.store(url, response, None, entry)
+            return self.to_documents(url, entry["content"])
+
+        text = content.decode(response.encoding or "utf-8", errors="replace")
+        self.cache.store(url, response, text)
+        return self.to_documents(url, text)
+
+    def fallback(self, url: str, entry: dict) -> list[Document]:
+        """Serve the stale cache entry, if any, when the request failed."""
+        return self.to_documents(url, entry["content"]) if entry else [Document("")]
+
     def load_web_content(self, url: str) -> list[Document]:
         """
-        Load web content from a URL using a document loader.
+        Load web content from a URL with a single streamed GET request.
+        The body is only downloaded when the status and content type are valid.
+        Responses of the public sources are served from the HTTP cache while fresh.
 
         :param url: The URL of the web page to retrieve.
         :return: A list of documents or an empty document if the URL is invalid.
         """
-        if not self.is_valid_url(url):
-            print(url)
-            return [Document("")]
+        entry, fresh = self.cache.lookup(url)
+        if fresh:
+            return self.to_documents(url, entry["content"])
+        if not self.is_valid_format(url):
+            return self.fallback(url, entry)
+
+        host = get_host(url)
+        limiter = self.limits.get(host)
+        if not limiter.wait():
+            return self.skip(url, entry)
+        try:
+            with host_thread_semaphore(url), metrics.timer("fetch", host=limiter.label), self.client.stream(
+                "GET", url, headers=self.get_headers(entry)
+            ) as response:
+                limiter.record(response)
+                metrics.count("requests", host=limiter.label, status=response.status_code)
+                content = b""
+                if response.status_code != 304:
+                    chunks = response.iter_bytes()
+                    first_chunk = next(chunks, b"")
+                    if not self.is_valid_response(url, response, first_chunk):
+                        return self.fallback(url, entry)
+                    content = first_chunk + b"".join(chunks)
+        except httpx.HTTPError as e:
+            limiter.record(error=e)
+            metrics.count("requests", host=limiter.label, status="error")
+            logging.error(f"Erreur lors de la requête HTTP pour l'URL {url} : {str(e)}")
+            return self.fallback(url, entry)
+        return self.read_response(url, response, content, entry)
+
+    async def aload_web_content(self, url: str) -> list[Document]:
+        """
+        Load web content from a URL without blocking the running event loop,
+        the HTTP cache is read and written in a thread.
 
-        # Use the document loader with the given URL and headers
-        loader = self.loader(url, self.get_random_header())
-        documents = loader.load()  # Synchronous retrieval of documents
-        return documents
+        :param url: The URL of the web page to retrieve.
+        :return: A list of documents or an empty document if the URL is invalid.
+        """
+        entry, fresh = await asyncio.to_thread(self.cache.lookup, url)
+        if fresh:
+            return self.to_documents(url, entry["content"])
+        if not self.is_valid_format(url):
+            return self.fallback(url, entry)
+
+        host = get_host(url)
+        limiter = self.limits.get(host)
+        if not await limiter.await_turn():
+            return self.skip(url, entry)
+        try:
+            async with host_semaphore(url), metrics.atimer("fetch", host=limiter.label), self.async_client.stream(
+                "GET", url, headers=self.get_headers(entry)
+            ) as response:
+                limiter.record(response)
+                metrics.count("requests", host=limiter.label, status=response.status_code)
+                content = b""
+                if response.status_code != 304:
+                    chunks = response.aiter_bytes()
+                    first_chunk = await anext(chunks, b"")
+                    if not self.is_valid_response(url, response, first_chunk):
+                        return self.fallback(url, entry)
+                    content = first_chunk + b"".join([chunk async for chunk in chunks])
+        except httpx.HTTPError as e:
+            limiter.record(error=e)
+            metrics.count("requests", host=limiter.label, status="error")
+            logging.error(f"Erreur lors de la requête HTTP pour l'URL {url} : {str(e)}")
+            return self.fallback(url, entry)
+        return await asyncio.to_thread(self.read_response, url, response, content, entry)
 
     def run(self, url: str) -> list[Document]:
         """Execute the scraper on a given URL and return its content."""
         logging.info(f"Loading URL: {url}")  # Debugging output
         return self.load_web_content(url)
+
+    async def arun(self, url: str) -> list[Document]:
+        """Asynchronous version of `run`, to be awaited from the pipeline's event loop."""
+        logging.info(f"Loading URL: {url}")
+        return await self.aload_web_content(url)
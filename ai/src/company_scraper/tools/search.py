@@ -0,0 +1,296 @@
+from .cache import CacheBackend, SingleFlight, get_cache
+from .client import get_client, get_async_client
+from .hosts import HostLimiter, HostLimits, get_host_limits
+from .metrics import metrics, in_context
+from config.search import *
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import urlsplit
+import asyncio, hashlib, json, logging
+
+
+class SearchProvider:
+    """Web search backend returning the URLs of the results of a query."""
+
+    name = "provider"
+    host = None  # Host whose rate limit and circuit breaker apply to the searches
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        raise NotImplementedError
+
+    async def asearch(self, query: str, num_results: int) -> List[str]:
+        """Asynchronous version of `search`, by default the blocking search runs in a thread."""
+        return await asyncio.to_thread(self.search, query, num_results)
+
+
+class GoogleSearch(SearchProvider):
+    """Google results page scraped by `googlesearch`, quickly throttled under load."""
+
+    name = "google"
+    host = "www.google.com"
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        from googlesearch import search  # Imported on first use (it imports requests)
+
+        return list(search(query, num_results=num_results, region="be"))
+
+
+class SearxngSearch(SearchProvider):
+    """JSON API of a SearXNG instance, requested with the shared HTTP clients."""
+
+    name = "searxng"
+
+    def __init__(self, url: str = SEARXNG_URL, language: str = SEARCH_LANGUAGE):
+        self.url = url.rstrip("/") + "/search"
+        self.host = urlsplit(self.url).netloc.casefold()
+        self.language = language
+
+    def get_params(self, query: str) -> dict:
+        return {"q": query, "format": "json", "language": self.language}
+
+    def parse(self, response, num_results: int) -> List[str]:
+        response.raise_for_status()  # 429 when the instance limits us, the engine backs off
+        urls = [result["url"] for result in response.json().get("results", []) if result.get("url")]
+        return urls[:num_results]
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        return self.parse(get_client().get(self.url, params=self.get_params(query)), num_results)
+
+    async def asearch(self, query: str, num_results: int) -> List[str]:
+        response = await get_async_client().get(self.url, params=self.get_params(query))
+        return self.parse(response, num_results)
+
+
+class StaticSearch(SearchProvider):
+    """
+    Recorded results, for the tests and the offline benchmarks. A query returns the results
+    of the same query or else of the longest recorded query it contains (e.g. the company name).
+    """
+
+    name = "static"
+
+    def __init__(self, results: dict):
+        self.results = results
+        self.queries = sorted(results, key=len, reverse=True)
+
+    @classmethod
+    def from_file(cls, path: str) -> "StaticSearch":
+        """Load the results of a JSON file {query: [urls]}."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                return cls(json.load(file))
+        except (OSError, ValueError) as e:
+            logging.error(f"Search fixtures {path} unavailable: {e}")
+            return cls({})
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        if query in self.results:
+            return list(self.results[query])[:num_results]
+        recorded = next((item for item in self.queries if item in query), None)
+        return list(self.results[recorded])[:num_results] if recorded else []
+
+    async def asearch(self, query: str, num_results: int) -> List[str]:
+        return self.search(query, num_results)
+
+
+def create_provider(name: str) -> SearchProvider:
+    """Create the provider of a `SEARCH_PROVIDERS` name, None for an unknown name."""
+    if name == "google":
+        return GoogleSearch()
+    if name == "searxng":
+        return SearxngSearch()
+    if name == "static":
+        return StaticSearch.from_file(SEARCH_FIXTURES)
+    logging.error(f"Unknown search provider ignored: {name}")
+    return None
+
+
+def result_key(url: str) -> str:
+    """Identity of a result when merging providers: host without "www." and path without trailing "/"."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").removeprefix("www.")
+    return host + parts.path.rstrip("/")
+
+
+def merge_results(results: List[List[str]], num_results: int) -> List[str]:
+    """Interleave the results of the providers, by rank, without duplicates."""
+    merged, seen = [], set()
+    for rank in range(max(map(len, results), default=0)):
+        for urls in results:
+            if rank < len(urls) and result_key(urls[rank]) not in seen:
+                seen.add(result_key(urls[rank]))
+                merged.append(urls[rank])
+    return merged[:num_results]
+
+
+def normalize_query(value) -> str:
+    return " ".join(str(value or "").casefold().split())
+
+
+class SearchEngine:
+    """
+    Search of the candidate websites of a company through the configured providers.
+    Results are cached by (name, address), concurrent searches of the same company share
+    one query, and each provider is subject to the rate limit and circuit breaker of its host.
+    """
+
+    def __init__(
+        self,
+        providers: List[SearchProvider] = None,
+        backend: CacheBackend = None,
+        ttl: float = SEARCH_CACHE_TTL,
+        fan_out: bool = SEARCH_FAN_OUT,
+        limits: HostLimits = None,
+    ):
+        """
+        :param providers: The providers, in order of preference (`SEARCH_PROVIDERS` by default).
+        :param backend: The cache of the results, the process-wide cache by default.
+        :param ttl: The time to live of the cached results, in seconds.
+        :param fan_out: Whether the providers are queried concurrently and their results merged,
+            otherwise the next provider is only queried when the previous one fails or finds nothing.
+        :param limits: The limits of the hosts of the providers, the process-wide ones by default.
+        """
+        if providers is None:
+            providers = [provider for provider in map(create_provider, SEARCH_PROVIDERS) if provider]
+        self.providers = providers
+        self._backend = backend
+        self.ttl = ttl
+        self.fan_out = fan_out
+        self._limits = limits
+        self.flights = SingleFlight()
+        self.stats = {"hit": 0, "miss": 0}
+        self.provider_stats = defaultdict(Counter)  # By provider: success, empty, failure, skipped
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache()
+
+    @property
+    def limits(self) -> HostLimits:
+        return self._limits or get_host_limits()
+
+    def get_limiter(self, provider: SearchProvider) -> HostLimiter:
+        """The limiter of the provider's host, None for a provider without host."""
+        return self.limits.get(provider.host) if provider.host else None
+
+    def get_key(self, company_name: str, address: str, num_results: int) -> str:
+        key = json.dumps([normalize_query(company_name), normalize_query(address), num_results])
+        return "search:" + hashlib.sha256(key.encode()).hexdigest()
+
+    def lookup(self, key: str):
+        urls = self.backend.get(key)
+        self.stats["hit" if urls is not None else "miss"] += 1
+        return urls
+
+    def store(self, key: str, urls: List[str]) -> List[str]:
+        # Nothing found may come from failing providers, the query is tried again next time
+        if urls:
+            self.backend.set(key, urls, self.ttl)
+        return urls
+
+    def skip(self, provider: SearchProvider) -> List[str]:
+        """The circuit of the provider's host is open, the next provider is used meanwhile."""
+        self.provider_stats[provider.name]["skipped"] += 1
+        return None
+
+    def record(self, provider: SearchProvider, limiter: HostLimiter, urls, error: Exception = None) -> List[str]:
+        if error is not None:
+            if limiter:
+                # googlesearch and httpx errors carry the response of a rejected request (429, ...)
+                response = getattr(error, "response", None)
+                limiter.record(response, None if getattr(response, "status_code", None) else error)
+            self.provider_stats[provider.name]["failure"] += 1
+            logging.warning(f"Search provider {provider.name} failed: {error}")
+            return None
+        if limiter:
+            limiter.success()
+        self.provider_stats[provider.name]["success" if urls else "empty"] += 1
+        return list(urls)
+
+    def call(self, provider: SearchProvider, query: str, num_results: int) -> List[str]:
+        """Query a provider once its turn comes, None when it fails or its host is down."""
+        limiter = self.get_limiter(provider)
+        if limiter and not limiter.wait():
+            return self.skip(provider)
+        try:
+            with metrics.timer("search_provider", provider=provider.name):
+                urls = provider.search(query, num_results)
+        except Exception as e:
+            return self.record(provider, limiter, None, e)
+        return self.record(provider, limiter, urls)
+
+    async def acall(self, provider: SearchProvider, query: str, num_results: int) -> List[str]:
+        """Asynchronous version of `call`."""
+        limiter = self.get_limiter(provider)
+        if limiter and not await limiter.await_turn():
+            return self.skip(provider)
+        try:
+            async with metrics.atimer("search_provider", provider=provider.name):
+                urls = await provider.asearch(query, num_results)
+        except Exception as e:
+            return self.record(provider, limiter, None, e)
+        return self.record(provider, limiter, urls)
+
+    def query(self, query: str, num_results: int) -> List[str]:
+        if self.fan_out and len(self.providers) > 1:
+            with ThreadPoolExecutor(max_workers=len(self.providers)) as executor:
+                results = list(
+                    executor.map(in_context(lambda provider: self.call(provider, query, num_results)), self.providers)
+                )
+            return merge_results([urls or [] for urls in results], num_results)
+        for provider in self.providers:
+            urls = self.call(provider, query, num_results)
+            if urls:
+                return urls
+        return []
+
+    async def aquery(self, query: str, num_results: int) -> List[str]:
+        """Asynchronous version of `query`."""
+        if self.fan_out and len(self.providers) > 1:
+            results = await asyncio.gather(
+                *(self.acall(provider, query, num_results) for provider in self.providers)
+            )
+            return merge_results([urls or [] for urls in results], num_results)
+        for provider in self.providers:
+            urls = await self.acall(provider, query, num_results)
+            if urls:
+                return urls
+        return []
+
+    def search(self, company_name: str, address: str, num_results: int = 5) -> List[str]:
+        """
+        Return the URLs of the search results of a company.
+
+        :param company_name: The name of the company.
+        :param address: The address of the company.
+        :param num_results: The maximum number of URLs.
+        :return List[str]: The URLs, empty when no provider found anything.
+        """
+        key = self.get_key(company_name, address, num_results)
+        urls = self.lookup(key)
+        if urls is not None:
+            return urls
+        urls, _ = self.flights.do(
+            key, lambda: self.store(key, self.query(f"{company_name} {address}", num_results))
+        )
+        return list(urls)
+
+    async def asearch(self, company_name: str, address: str, num_results: int = 5) -> List[str]:
+        """Asynchronous version of `search`, the cache is read and written in a thread."""
+        key = self.get_key(company_name, address, num_results)
+        urls = await asyncio.to_thread(self.lookup, key)
+        if urls is not None:
+            return urls
+
+        async def query():
+            urls = await self.aquery(f"{company_name} {address}", num_results)
+            return await asyncio.to_thread(self.store, key, urls)
+
+        urls, _ = await self.flights.ado(key, query)
+        return list(urls)
+
+
+search_engine = SearchEngine()
+metrics.register("search_cache", lambda: search_engine.stats)
+metrics.register("search_provider", lambda: search_engine.provider_stats, label="provider")
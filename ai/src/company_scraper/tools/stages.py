@@ -0,0 +1,137 @@
+from .cache import get_cache, CacheBackend
+from .metrics import metrics
+from config.cache import *
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Union
+import hashlib, json, logging, re
+
+# Stages of the pipeline, in execution order
+STAGES = ("legal", "address", "financial", "website", "description")
+
+# Function called with (stage, reused, fragment) as each stage of the current run completes
+stage_listener: ContextVar = ContextVar("stage_listener", default=None)
+
+
+@contextmanager
+def track_stages(listener):
+    """
+    Call `listener(stage, reused, fragment)` when a stage of the runs executed in this block
+    completes, `fragment` being the output of the stage.
+    """
+    token = stage_listener.set(listener)
+    try:
+        yield
+    finally:
+        stage_listener.reset(token)
+
+
+def notify(stage: str, reused: bool, fragment=None):
+    listener = stage_listener.get()
+    if listener is not None:
+        try:
+            listener(stage, reused, fragment)
+        except Exception as e:
+            logging.warning(f"Stage listener failed on {stage}: {e}")
+
+
+def fingerprint(*inputs) -> str:
+    """Hash the inputs of a stage (any JSON serializable values)."""
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def content_hash(content: str) -> str:
+    """Hash a page content, insensitive to whitespace-only changes."""
+    return hashlib.sha256(re.sub(r"\s+", " ", content or "").strip().encode()).hexdigest()
+
+
+class StageStore:
+    """
+    Fingerprint of the inputs and output fragment of each pipeline stage, by company.
+    A re-run skips the stages whose fingerprint is unchanged and reuses their fragment.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = STAGES_TTL):
+        self._backend = backend
+        self.ttl = ttl
+        # Counters by stage: reused and computed
+        self.stats = defaultdict(lambda: defaultdict(int))
+
+    @property
+    def backend(self) -> CacheBackend:
+        return self._backend or get_cache()
+
+    def get_key(self, vat_number: str) -> str:
+        return "stages:" + re.sub(r"[^\d]", "", vat_number)
+
+    def load(self, vat_number: str) -> dict:
+        """Return the stages of the last run, by name."""
+        try:
+            return self.backend.get(self.get_key(vat_number)) or {}
+        except Exception as e:
+            logging.warning(f"Stages of {vat_number} unavailable: {e}")
+            return {}
+
+    def save(self, vat_number: str, stages: dict):
+        try:
+            self.backend.set(self.get_key(vat_number), stages, self.ttl)
+        except Exception as e:
+            logging.warning(f"Stages of {vat_number} not saved: {e}")
+
+    def start(self, vat_number: str, force: Union[bool, Iterable[str]] = False) -> "StageRun":
+        """Start the run of a company, `force` recomputing every stage or the given ones."""
+        return StageRun(self, vat_number, force)
+
+
+class StageRun:
+    """
+    Stages of one pipeline run. Without store or VAT number, every stage is computed
+    and nothing is recorded.
+    """
+
+    def __init__(self, store: StageStore = None, vat_number: str = None, force: Union[bool, Iterable[str]] = False):
+        self.store = store if vat_number else None
+        self.vat_number = vat_number
+        self.force = force
+        self.previous = {} if force is True or self.store is None else self.store.load(vat_number)
+        if force and force is not True:
+            forced = set(force)
+            self.previous = {stage: value for stage, value in self.previous.items() if stage not in forced}
+        self.current = {}
+        self.reused = []
+
+    def reuse(self, stage: str, key: str) -> tuple:
+        """
+        Look for the output of the previous run of a stage with the same fingerprint.
+
+        :return: (found, fragment) where fragment is the stored output of the stage.
+        """
+        previous = self.previous.get(stage)
+        if not previous or previous.get("fingerprint") != key:
+            return False, None
+        self.current[stage] = previous
+        self.reused.append(stage)
+        if self.store:
+            self.store.stats[stage]["reused"] += 1
+        notify(stage, True, previous.get("fragment"))
+        return True, previous.get("fragment")
+
+    def record(self, stage: str, key: str, fragment):
+        """Record the fingerprint and JSON serializable output of a computed stage."""
+        self.current[stage] = {"fingerprint": key, "fragment": fragment}
+        if self.store:
+            self.store.stats[stage]["computed"] += 1
+        notify(stage, False, fragment)
+
+    def save(self):
+        """Store the stages of this run, merged with the ones of the previous run not run this time."""
+        if self.store:
+            self.store.save(self.vat_number, {**self.previous, **self.current})
+            if self.reused:
+                logging.info(f"Stages reused for {self.vat_number}: {', '.join(self.reused)}")
+
+
+stage_store = StageStore()
+metrics.register("stages", lambda: stage_store.stats, label="stage")
@@ -0,0 +1,34 @@
+import asyncio, functools, threading
+
+_lock = threading.Lock()
+
+
+def traceable(func):
+    """
+    Same as `langsmith.traceable`, but langsmith is only imported on the first call
+    of the function instead of when the module defining it is imported.
+    """
+    traced = None
+
+    def get_traced():
+        nonlocal traced
+        with _lock:
+            if traced is None:
+                from langsmith import traceable as langsmith_traceable
+
+                traced = langsmith_traceable(func)
+            return traced
+
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            return await get_traced()(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return get_traced()(*args, **kwargs)
+
+    return wrapper
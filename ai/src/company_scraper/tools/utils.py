@@ -1,11 +1,12 @@
 from .scraper import CompanyScraper
-from langchain_community.document_loaders import AsyncHtmlLoader
+from .geography import lookup_postal_area
+from .rubrics import iter_rubrics
 from difflib import SequenceMatcher
 from config.config import *
 import csv
 from io import StringIO
 
-scraper = CompanyScraper(AsyncHtmlLoader)
+scraper = CompanyScraper()
 
 def safe_execution(func):
     """Decorator to handle errors globally"""
@@ -31,51 +32,65 @@ def find_region(postal) -> str:
     :param postal: an integer representing postal code.
     :return str: The region of the postal code.
     """
-    postal = int(postal)
+    location = lookup_postal_area(postal)
+    return location["region"] if location else ""  # If not a postal code
 
-    if 1000 > postal or postal > 9992:
-        return "" # If not a postal code
-    if 1000 <= postal < 1300:
-        return "Bruxelles"
-    elif 1500 <= postal < 4000 or 8000 <= postal <= 9992:
-        return "Flandre"
-    return "Wallonie"
+
+def get_address_url(address: str) -> str:
+    """Build the OpenStreetMap (Nominatim) search URL for an address."""
+    # Encode the address for a safe URL
+    address_encoded = urllib.parse.quote_plus(address)
+    return f"https://nominatim.openstreetmap.org/search?q={address_encoded}&format=json&addressdetails=1"
+
+
+def parse_address_data(content: str) -> dict:
+    """
+    Extracts country, province and region from a Nominatim JSON response.
+
+    :param content: The raw JSON body returned by Nominatim.
+    :return dict: The address data, or None if the response is invalid.
+    """
+    # Ensure response contains valid JSON
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        logging.warning("Invalid JSON response from Nominatim")
+        return
+    # Validate extracted data
+    if isinstance(data, list) and data and "address" in data[0]:
+        address_info = data[0]["address"]
+        return {
+            "country": address_info.get("country", ""),
+            "province": address_info.get("state", ""),
+            "region": address_info.get("region", ""),
+        }
+    logging.warning("get_data_from_address: Address not found or invalid format")
+    return
 
 
 def get_data_from_address(address: str) -> dict:
     """
     Uses the OpenStreetMap API to retrieve country, province, and region from an address.
     """
-    logging.error(address)
+    logging.debug(f"Geocoding address: {address}")
     try:
-        # Encode the address for a safe URL
-        address_encoded = urllib.parse.quote_plus(address)
-        url = f"https://nominatim.openstreetmap.org/search?q={address_encoded}&format=json&addressdetails=1"
-
-        # Initialize the scraper
-        scraper = CompanyScraper(AsyncHtmlLoader)
-        response = scraper.run(url)
+        response = scraper.run(get_address_url(address))
+        return parse_address_data(response[0].page_content)
 
-        # Ensure response contains valid JSON
-        try:
-            data = json.loads(response[0].page_content)
-        except json.JSONDecodeError:
-            logging.error("error: Invalid JSON response from API")
-            return
-        logging.error(data)
-        # Validate extracted data
-        if isinstance(data, list) and data and "address" in data[0]:
-            address_info = data[0]["address"]
-            return {
-                "country": address_info.get("country", ""),
-                "province": address_info.get("state", ""),
-                "region": address_info.get("region", ""),
-            }
-        logging.error("error get_data_from_address: Address not found or invalid format")
+    except Exception as e:
+        logging.warning(f"Geocoding failed for {address}: {e}")
         return
 
+
+async def aget_data_from_address(address: str) -> dict:
+    """Asynchronous version of `get_data_from_address`."""
+    logging.debug(f"Geocoding address: {address}")
+    try:
+        response = await scraper.arun(get_address_url(address))
+        return parse_address_data(response[0].page_content)
+
     except Exception as e:
-        logging.error("error: " + str(e))
+        logging.warning(f"Geocoding failed for {address}: {e}")
         return
 
 # *******************************************
@@ -156,38 +171,28 @@ def get_deposit_id(published_deposit):
     return None
 
 
-def get_financial_data(vat_number: str) -> dict:
-    """
-    Retrieves financial data for a given VAT number from the Belgian National Bank API.
+def get_deposits_url(vat_number: str, page: int = 0, size: int = 10) -> str:
+    """Build the NBB URL listing the published deposits of a company, most recent first."""
+    return f"https://consult.cbso.nbb.be/api/rs-consult/published-deposits?page={page}&size={size}&enterpriseNumber={vat_number}&sort=periodEndDate,desc&sort=depositDate,desc"
 
-    Returned financial data includes:
-    - model (str): The annual account model used (e.g., full, abbreviated, micro).
-    - employees (float): The number of employees in full-time equivalents.
-    - previous_year_revenue (float): Revenue from the previous year.
-    - total_asset (float): Total balance sheet assets, extracted from field "10/49".
-    
-    :param vat_number: The VAT number of the company.
 
-    :return dict: A dictionary containing financial data (model, employees, previous_year_revenue, total_asset).
-    """
-    # Main request URL to fetch company data and get the deposit id
-    url = f"https://consult.cbso.nbb.be/api/rs-consult/published-deposits?page=0&size=10&enterpriseNumber={vat_number}&sort=periodEndDate,desc&sort=depositDate,desc"
-    print(url)
-    # Make the first request to obtain the ID of the last annual account
-    content = scraper.run(url)[0].page_content
+def get_deposit_csv_url(deposit_id: str) -> str:
+    """Build the NBB URL of the CSV export of an annual account."""
+    return f"https://consult.cbso.nbb.be/api/external/broker/public/deposits/consult/csv/{deposit_id}"
 
-    # Extract the ID of the last annual account
-    response = json.loads(content)
 
-    deposit_id = get_deposit_id(response)
-    if not deposit_id:
-        return None
+def extract_financial_data(annual_account: str) -> dict:
+    """
+    Extracts the financial indicators used by the pipeline from an annual account CSV.
 
-    # Make a request to retrieve the CSV data for the annual account
-    csv_url = f"https://consult.cbso.nbb.be/api/external/broker/public/deposits/consult/csv/{deposit_id}"
-    last_year_annual_account = scraper.run(csv_url)[0].page_content
-    # Load the CSV data and convert it into a dictionary
-    data = load_csv_to_dict(last_year_annual_account)
+    :param annual_account: The CSV content of the annual account.
+    :return dict: A dictionary containing financial data (model, employees, year revenue, total asset, gross margin),
+                  None when no row could be read (e.g. an empty or error page).
+    """
+    # Stream the CSV and keep only the needed rows, typed as floats
+    data = dict(iter_rubrics(StringIO(annual_account or ""), FINANCIAL_DATA_CODES))
+    if not data:
+        return None
 
     # Extract necessary financial data
     financial_data = {
@@ -203,6 +208,67 @@ def get_financial_data(vat_number: str) -> dict:
     return financial_data
 
 
+def parse_deposits(vat_number: str, content: str) -> str:
+    """
+    Read the ID of the last structured annual account in the deposits list of a company.
+
+    :return str: The deposit ID, None when there is none or the response is not JSON (empty or error page).
+    """
+    try:
+        published_deposit = json.loads(content)
+    except (TypeError, ValueError) as e:
+        logging.error(f"Invalid deposits list for VAT number {vat_number}: {e}")
+        return None
+    return get_deposit_id(published_deposit)
+
+
+def get_latest_deposit_id(vat_number: str) -> str:
+    """ID of the last structured annual account of a company, None when it has none."""
+    content = scraper.run(get_deposits_url(vat_number))[0].page_content
+    return parse_deposits(vat_number, content)
+
+
+async def aget_latest_deposit_id(vat_number: str) -> str:
+    """Asynchronous version of `get_latest_deposit_id`."""
+    content = (await scraper.arun(get_deposits_url(vat_number)))[0].page_content
+    return parse_deposits(vat_number, content)
+
+
+def get_financial_data(vat_number: str, deposit_id: str = None) -> dict:
+    """
+    Retrieves financial data for a given VAT number from the Belgian National Bank API.
+
+    Returned financial data includes:
+    - model (str): The annual account model used (e.g., full, abbreviated, micro).
+    - employees (float): The number of employees in full-time equivalents.
+    - previous_year_revenue (float): Revenue from the previous year.
+    - total_asset (float): Total balance sheet assets, extracted from field "10/49".
+    
+    :param vat_number: The VAT number of the company.
+    :param deposit_id: The ID of the annual account to read, the last one by default.
+
+    :return dict: A dictionary containing financial data (model, employees, previous_year_revenue, total_asset).
+    """
+    # Obtain the ID of the last annual account
+    deposit_id = deposit_id or get_latest_deposit_id(vat_number)
+    if not deposit_id:
+        return None
+
+    # Make a request to retrieve the CSV data for the annual account
+    last_year_annual_account = scraper.run(get_deposit_csv_url(deposit_id))[0].page_content
+    return extract_financial_data(last_year_annual_account)
+
+
+async def aget_financial_data(vat_number: str, deposit_id: str = None) -> dict:
+    """Asynchronous version of `get_financial_data`."""
+    deposit_id = deposit_id or await aget_latest_deposit_id(vat_number)
+    if not deposit_id:
+        return None
+
+    last_year_annual_account = (await scraper.arun(get_deposit_csv_url(deposit_id)))[0].page_content
+    return extract_financial_data(last_year_annual_account)
+
+
 def company_size_by_model(model_id: str) -> str:
 
     if model_id in Annual_account_model.MICRO:
@@ -275,10 +341,21 @@ def determine_company_size(vat_number: str, financial_data: dict) -> CompanySize
     return size
 
 
-def get_size_and_financial_data(vat_number: str) -> list:
+def get_size_and_financial_data(vat_number: str, deposit_id: str = None) -> list:
     if vat_number:
-        financial_data = get_financial_data(vat_number)
+        financial_data = get_financial_data(vat_number, deposit_id)
         if not financial_data:
             return None
         size = determine_company_size(vat_number, financial_data)
     return [size, financial_data]
+
+
+async def aget_size_and_financial_data(vat_number: str, deposit_id: str = None) -> list:
+    """Asynchronous version of `get_size_and_financial_data`."""
+    if not vat_number:
+        return None
+    financial_data = await aget_financial_data(vat_number, deposit_id)
+    if not financial_data:
+        return None
+    size = determine_company_size(vat_number, financial_data)
+    return [size, financial_data]